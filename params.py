@@ -31,10 +31,30 @@ def safe_get(cp, sec, opt, default=None):
     except: v = default
     return v
 
-def load_params(args):
+def get_repo_dir(mysuite, cp, sec):
+    """ the directory of the repo in section sec.  A repo that is cloned
+        from its url need not be there yet """
+
+    dir_name = safe_get(cp, sec, "dir")
+
+    if safe_get(cp, sec, "url") and dir_name and not os.path.isdir(dir_name):
+        return os.path.normpath(os.path.join(mysuite.testTopDir, dir_name)) + "/"
+
+    return mysuite.check_test_dir(dir_name)
+
+def get_repo_fetch_opts(cp, sec):
+    """ the url, depth and filter keyword arguments of the Repo in
+        section sec """
+
+    return dict(url=safe_get(cp, sec, "url"),
+                depth=convert_type(safe_get(cp, sec, "depth", default=0)),
+                fetch_filter=safe_get(cp, sec, "filter"))
+
+def load_params(args, log=None):
     """
     reads the parameter file and creates as list of test objects as well as
-    the suite object
+    the suite object.  log is the Log to use, if one is open already (e.g.
+    for the runs of a --batch)
     """
 
     test_list = []
@@ -46,7 +66,8 @@ def load_params(args):
 
     cp.optionxform = str
 
-    log = test_util.Log(output_file=args.log_file)
+    if log is None:
+        log = test_util.Log(output_file=args.log_file)
 
     log.bold("loading " + args.input_file[0])
 
@@ -88,6 +109,11 @@ def load_params(args):
                 mysuite.emailTo = value.split(",")
             elif opt == "extra_tools":
                 mysuite.extra_tools = value
+            elif opt == "web_staging":
+                if not value in test_util.STAGING_MODES:
+                    mysuite.log.fail("ERROR: invalid web_staging")
+                else:
+                    mysuite.web_staging = value
 
             else:
                 # generic setting of the object attribute
@@ -98,13 +124,14 @@ def load_params(args):
 
 
     # AMReX -- this will always be defined
-    rdir = mysuite.check_test_dir(safe_get(cp, "AMReX", "dir"))
+    rdir = get_repo_dir(mysuite, cp, "AMReX")
 
     branch = convert_type(safe_get(cp, "AMReX", "branch"))
     rhash = convert_type(safe_get(cp, "AMReX", "hash"))
 
     mysuite.repos["AMReX"] = repo.Repo(mysuite, rdir, "AMReX",
-                                       branch_wanted=branch, hash_wanted=rhash)
+                                       branch_wanted=branch, hash_wanted=rhash,
+                                       **get_repo_fetch_opts(cp, "AMReX"))
 
     if args.amrex_pr is not None:
         mysuite.repos["AMReX"].pr_wanted = args.amrex_pr
@@ -126,7 +153,7 @@ def load_params(args):
         else:
             k = "source"
 
-        rdir = mysuite.check_test_dir(safe_get(cp, s, "dir"))
+        rdir = get_repo_dir(mysuite, cp, s)
         branch = convert_type(safe_get(cp, s, "branch"))
         rhash = convert_type(safe_get(cp, s, "hash"))
 
@@ -140,7 +167,8 @@ def load_params(args):
 
         mysuite.repos[k] = repo.Repo(mysuite, rdir, name,
                                      branch_wanted=branch, hash_wanted=rhash,
-                                     build=build, comp_string=comp_string)
+                                     build=build, comp_string=comp_string,
+                                     **get_repo_fetch_opts(cp, s))
 
 
     # AMReX-only tests don't have a sourceDir
@@ -264,13 +292,17 @@ def load_params(args):
                 mysuite.log.warn(f"unrecognized parameter {opt} for test {sec}")
 
 
-        # make sure that the build directory actually exists
+        # make sure that the build directory actually exists -- unless its
+        # repo is yet to be cloned from its url
         if not mytest.extra_build_dir == "":
-            bdir = mysuite.repos[mytest.extra_build_dir].dir + mytest.buildDir
+            brepo = mysuite.repos[mytest.extra_build_dir]
+        elif mysuite.sourceTree in ["AMReX", "amrex"]:
+            brepo = mysuite.repos["AMReX"]
         else:
-            bdir = mysuite.source_dir + mytest.buildDir
+            brepo = mysuite.repos["source"]
+        bdir = brepo.dir + mytest.buildDir
 
-        if not os.path.isdir(bdir):
+        if not os.path.isdir(bdir) and (os.path.isdir(brepo.dir) or not brepo.url):
             mysuite.log.warn(f"invalid build directory: {bdir}")
             invalid = 1
 
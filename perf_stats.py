@@ -0,0 +1,138 @@
+"""This module holds the statistics used to decide whether a test got
+slower: a robust comparison of a run time with the history of the test
+(median and median absolute deviation), and a rank-based change-point
+detection over the whole series"""
+
+import math
+import random
+
+# the fewest past runs we draw any conclusion from
+MIN_RUNS = 3
+
+# the smallest spread we assume the run times to have, relative to their
+# median -- identical past timings would otherwise make any change
+# significant
+NOISE_FLOOR = 0.01
+
+# the number of most recent runs searched for a change point
+CHANGE_POINT_WINDOW = 100
+
+# the smallest relative shift of the median reported as a change point
+MIN_SHIFT = 0.02
+
+# MAD * MAD_SCALE estimates the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+
+def median(values):
+    """ the median of a non-empty list of numbers """
+
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return 0.5*(values[n//2 - 1] + values[n//2])
+
+
+def mad(values, center=None):
+    """ the median absolute deviation of values around center (default:
+        their median), scaled to estimate a standard deviation """
+
+    if center is None:
+        center = median(values)
+    return MAD_SCALE * median([abs(v - center) for v in values])
+
+
+def compare(value, history, noise=0.0):
+    """ compare a run time with the past ones.  Returns (median, scale, z,
+        p): the median of the history, its robust spread, the robust
+        z-score of value and the one-sided p-value of value being that much
+        slower by chance.  All are None if the history is too short.  noise
+        is the spread of value itself, if it is known, e.g. from repeated
+        runs """
+
+    if len(history) < MIN_RUNS:
+        return None, None, None, None
+
+    center = median(history)
+    scale = max(mad(history, center), noise, NOISE_FLOOR * abs(center))
+
+    if scale == 0.0:
+        return center, scale, None, None
+
+    z = (value - center) / scale
+    p = 0.5 * math.erfc(z / math.sqrt(2.0))
+
+    return center, scale, z, p
+
+
+def ranks(values):
+    """ the ranks of values, from 1 -- tied values share the mean of the
+        ranks they span """
+
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    r = [0.0]*len(values)
+
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+            end += 1
+        for k in range(start, end + 1):
+            r[order[k]] = 0.5*(start + end) + 1.0
+        start = end + 1
+
+    return r
+
+
+def change_point(series, min_segment=MIN_RUNS, permutations=200, seed=0):
+    """ find the most likely shift in the level of series (in
+        chronological order).  Returns (index, shift, p): the first entry
+        after the shift, the relative change of the median across it and
+        the permutation p-value of a shift that large -- or None if the
+        series is too short, or the shift is below MIN_SHIFT.
+
+        The statistic is the largest standardized Mann-Whitney rank sum
+        over all the splits, so it is not thrown off by outliers """
+
+    n = len(series)
+    if n < 2*min_segment:
+        return None
+
+    series_ranks = ranks(series)
+
+    splits = range(min_segment, n - min_segment + 1)
+
+    def statistic(r):
+        """ the largest |z| of the rank sum after each split, and where """
+
+        best, where = -1.0, None
+        after = sum(r)
+        for k in range(n):
+            if k in splits:
+                m = n - k
+                z = (after - m*(n + 1)/2.0) / math.sqrt(m*k*(n + 1)/12.0)
+                if abs(z) > best:
+                    best, where = abs(z), k
+            after -= r[k]
+        return best, where
+
+    observed, index = statistic(series_ranks)
+
+    rng = random.Random(seed)
+    shuffled = list(series_ranks)
+    exceed = 0
+    for _ in range(permutations):
+        rng.shuffle(shuffled)
+        if statistic(shuffled)[0] >= observed:
+            exceed += 1
+
+    before = median(series[:index])
+    after = median(series[index:])
+    shift = after / before - 1.0 if before else 0.0
+
+    # e.g. a series that is all ties, or quantized times moving by a tick
+    if abs(shift) < MIN_SHIFT:
+        return None
+
+    return index, shift, (exceed + 1) / (permutations + 1)
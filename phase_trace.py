@@ -0,0 +1,124 @@
+"""This module records where the test harness spends its time: the phases
+of a run (git updates, builds, running, comparing, reporting, ...) as
+spans that can be exported as Chrome trace-event JSON (for chrome://tracing
+or Perfetto) and summarized per phase.
+
+Tracing is off unless enable() is called, and then span() and phase()
+return right away, so the calls can stay in the code."""
+
+import json
+import os
+import threading
+import time
+
+# the recorded spans, as (name, start ns, end ns, thread id, args) -- None
+# when tracing is off
+_events = None
+
+# the phase each thread is in, see phase()
+_local = threading.local()
+
+
+class _NullSpan:
+    """ what span() returns when tracing is off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """ a context manager recording the time spent in its block """
+
+    __slots__ = ["name", "args", "start"]
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+def enable():
+    """ start recording, forgetting anything recorded before """
+
+    global _events
+    _events = []
+    _local.phase = None
+
+
+def enabled():
+    return _events is not None
+
+
+def _record(name, start, end, args):
+    # list.append is atomic, so the threads need no lock
+    _events.append((name, start, end, threading.get_ident(), args))
+
+
+def span(name, **args):
+    """ a context manager timing its block as the span name.  args are
+        shown with it in the trace """
+
+    if _events is None:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def phase(name, **args):
+    """ end the phase the current thread is in, if any, and start the
+        phase name (none if name is None).  This suits a sequence of steps
+        that may be left at any point, like the body of the loop over the
+        tests: the next phase() call ends the last step, however it was
+        left """
+
+    if _events is None:
+        return
+
+    now = time.perf_counter_ns()
+
+    current = getattr(_local, "phase", None)
+    if current is not None:
+        _record(current[0], current[1], now, current[2])
+
+    _local.phase = None if name is None else (name, now, args)
+
+
+def write_chrome_trace(filename):
+    """ write the spans recorded so far in the Chrome trace-event format """
+
+    origin = min((e[1] for e in _events), default=0)
+    pid = os.getpid()
+
+    events = [{"name": name, "cat": "regtest", "ph": "X", "pid": pid, "tid": tid,
+               "ts": (start - origin) / 1000.0, "dur": (end - start) / 1000.0,
+               "args": args}
+              for name, start, end, tid, args in _events]
+
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def summary():
+    """ the number of spans and the total time in s of each phase, as a
+        list of (name, count, total), longest first.  Spans can nest, so
+        the totals may overlap """
+
+    totals = {}
+    for name, start, end, _, _ in _events:
+        count, total = totals.get(name, (0, 0))
+        totals[name] = (count + 1, total + end - start)
+
+    return sorted(((name, count, total * 1.e-9) for name, (count, total) in totals.items()),
+                  key=lambda s: -s[2])
@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
+import datetime
 import os
 import shutil
 import sys
 import getopt
 import string
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import test_util
 import params
@@ -14,16 +16,34 @@ import test_report as report
 def reg_test_gc(argv):
     usage = """
     ./reg_test_gc [--before|-b 2000-00-00]
+                  [--keep_last N] [--keep_failures DAYS] [--keep_benchmarks]
+                  [--max_size GB] [--jobs N] [--dry_run]
        testfile.ini
+
+    Runs are removed from both webTopDir and {suiteName}-tests unless one
+    of the policies keeps them:
+
+      --before DATE      keep every run from DATE on
+      --keep_last N      keep the N most recent runs
+      --keep_failures M  keep runs with failures for M days
+      --keep_benchmarks  keep every run that updated benchmarks (the
+                         most recent benchmark of each test is always kept)
+      --max_size X       afterwards, remove the oldest remaining runs until
+                         each of the two directories is under X GB
+
+    --dry_run only reports what would be removed and how much space that
+    would reclaim.  --jobs sets how many directories are removed at once.
     """
 
     if len(sys.argv) == 1:
         print(usage)
         sys.exit(2)
-        
+
     try:
         opts, next = getopt.getopt(argv[1:], "b:",
-                                   ["before="])
+                                   ["before=", "keep_last=", "keep_failures=",
+                                    "keep_benchmarks", "max_size=", "jobs=",
+                                    "dry_run"])
 
     except getopt.GetoptError:
         print("invalid calling sequence")
@@ -32,10 +52,33 @@ def reg_test_gc(argv):
 
     # defaults
     gcdate = ""
-    
-    for o, a in opts:
-        if o == "--before" or o == "-b" :
-            gcdate = a
+    keep_last = 0
+    keep_failures = None
+    keep_benchmarks = False
+    max_size = None
+    jobs = 8
+    dry_run = False
+
+    try:
+        for o, a in opts:
+            if o == "--before" or o == "-b" :
+                gcdate = a
+            elif o == "--keep_last":
+                keep_last = int(a)
+            elif o == "--keep_failures":
+                keep_failures = int(a)
+            elif o == "--keep_benchmarks":
+                keep_benchmarks = True
+            elif o == "--max_size":
+                max_size = float(a)
+            elif o == "--jobs":
+                jobs = max(1, int(a))
+            elif o == "--dry_run":
+                dry_run = True
+    except ValueError:
+        print("ERROR: invalid value for", o)
+        print(usage)
+        sys.exit(2)
 
     try:
         testFile = next[0]
@@ -45,17 +88,23 @@ def reg_test_gc(argv):
         print(usage)
         sys.exit(2)
 
-    if not gcdate:
-        print("ERROR: date was not specified")
-        print(usage)
-        sys.exit(2)
-            
-    gcd = valid_date(gcdate)
-    if gcd == '':
-        print("ERROR: invalid date", gcdate)
+    if not (gcdate or keep_last or keep_failures is not None or max_size is not None):
+        print("ERROR: no retention policy was specified")
         print(usage)
         sys.exit(2)
 
+    gcd = None
+    if gcdate:
+        gcd = valid_date(gcdate)
+        if gcd == '':
+            print("ERROR: invalid date", gcdate)
+            print(usage)
+            sys.exit(2)
+
+    max_bytes = None
+    if max_size is not None:
+        max_bytes = int(max_size * 1024**3)
+
 
     workdir = os.getcwd()
 
@@ -66,78 +115,270 @@ def reg_test_gc(argv):
     suite, testList = params.load_params(args)
     activeTestList = [t.name for t in testList]
 
-    benchmarkTestList = [t for t in testList if not (t.compileTest or t.restartTest)]
-    benchmarkNotFound = {}
-    for t in benchmarkTestList:
-        benchmarkNotFound[t.name] = ''
-
-
-    ### clean up the web dir
-    print("\ncleaning ", suite.webTopDir)
-
-    os.chdir(suite.webTopDir)
-    validDirs = []
-    for d in os.listdir(suite.webTopDir):
-        if (d.startswith("20") and os.path.isdir(d)):
-            statusFile = d + '/' + d + '.status'
-            if (os.path.isfile(statusFile)):
-                validDirs.append(d)
-    validDirs.sort()
-    validDirs.reverse()
-    
-    latestBMDate = {}
-
-    for d in validDirs:
-        bmtests = list(benchmarkNotFound)
-        if d >= gcd and bmtests:
-            if isBenchmarkDir(d):
-                for t in bmtests:
-                    if findBenchmark(d,t):
-                        del benchmarkNotFound[t]
-                        latestBMDate[t] = d
-        else:
-            if isBenchmarkDir(d) and bmtests:
-                found = False
-                for t in bmtests:
-                    if findBenchmark(d,t):
-                        found = True
-                        del benchmarkNotFound[t]
-                        latestBMDate[t] = d
-                if not found:
-                    rmDir(d)
-            else:
-                rmDir(d)
-
-
-    ### clean up the test dir
-    testDirs = os.path.join(suite.testTopDir,suite.suiteName+"-tests")
-    print("\ncleaning ", testDirs)
-
-    os.chdir(testDirs)
-    validDirs = []
-    for d in os.listdir(testDirs):
-        if (d.startswith("20") and os.path.isdir(d)):
-            validDirs.append(d)
-    validDirs.sort()
-    validDirs.reverse()
-
-    for d in validDirs:
-        if d < gcd:
-            tests = [t for t in os.listdir(d) if os.path.isdir(os.path.join(d,t))]
-            found = False
-            for t in tests:
-                if t in latestBMDate.keys() and latestBMDate[t] == d:
-                    found = True
-                    break
-            if not found:
-                rmDir(d)
-    
+    benchmarkTestList = [t.name for t in testList if not (t.compileTest or t.restartTest)]
+
+    testDirs = os.path.join(suite.testTopDir, suite.suiteName+"-tests")
+
+    print("\nindexing ", suite.webTopDir, "and", testDirs)
+    runs = build_index(suite.db, suite.webTopDir, testDirs, benchmarkTestList, jobs)
+
+    doomed = plan_deletions(runs, benchmarkTestList, gcd=gcd,
+                            keep_last=keep_last, keep_failures=keep_failures,
+                            keep_benchmarks=keep_benchmarks, max_bytes=max_bytes)
+
+    web_total, test_total = tree_sizes(runs)
+    web_freed, test_freed = reclaimed(doomed)
+
+    print("")
+    for r in sorted(doomed, key=lambda q: q.name):
+        print("  {} {:>10}".format(r.name, test_util.human_size(r.web_size + r.test_size)))
+
+    print("\n{} of {} runs selected for removal".format(len(doomed), len(runs)))
+    print("  web dir:  {} of {} reclaimed".format(test_util.human_size(web_freed), test_util.human_size(web_total)))
+    print("  test dir: {} of {} reclaimed".format(test_util.human_size(test_freed), test_util.human_size(test_total)))
+
+    if dry_run:
+        print("\ndry run -- nothing removed")
+        return
+
+    paths = [d for r in doomed for d in (r.web_dir, r.test_dir) if d is not None]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(rmDir, paths))
+
+    for r in doomed:
+        suite.db.delete_run(r.name)
+
     print("\ncreating suite report...")
+    os.chdir(workdir)
     report.report_all_runs(suite, activeTestList)
 
     print("\nGarbage cleaning finished.")
 
 
+class RunRecord:
+    """ what the garbage collector knows about a single run of the suite """
+
+    def __init__(self, name):
+
+        self.name = name
+        self.date = datetime.date.fromisoformat(name[:10])
+
+        self.web_dir = None
+        self.test_dir = None
+
+        # overall status of the run, None if the run never
+        # finished
+        self.status = None
+
+        # tests whose benchmarks were updated in this run
+        self.bench_tests = []
+
+        # the files under web_dir and test_dir, as a dictionary of [size,
+        # number of links, links in this run, under test_dir] keyed by
+        # (st_dev, st_ino) -- the web files may be hardlinks to the ones
+        # in the test directory
+        self.inodes = {}
+
+        # the bytes deleting just this run frees in each directory
+        self.web_size = 0
+        self.test_size = 0
+
+    @property
+    def failed(self):
+        return self.status is not None and "FAILED" in self.status
+
+
+def build_index(db, web_top_dir, test_top_dir, benchmark_tests, jobs=8):
+    """ return a RunRecord for each run found in either the web or the test
+        directory, newest first, filled in from the results database db """
+
+    runs = {}
+
+    for top, attr in ((web_top_dir, "web_dir"), (test_top_dir, "test_dir")):
+        if not os.path.isdir(top): continue
+
+        for d in os.listdir(top):
+            path = os.path.join(top, d)
+            if not (d.startswith("20") and os.path.isdir(path)): continue
+
+            try: r = runs.setdefault(d, RunRecord(d))
+            except ValueError: continue
+            setattr(r, attr, path)
+
+    for r in runs.values():
+        if r.web_dir is None: continue
+
+        info = db.run_info(r.name)
+        if info is None or info[0] is None: continue
+
+        r.status = info[0]
+        if info[1]:
+            r.bench_tests = [t for t in db.benchmark_tests(r.name) if t in benchmark_tests]
+
+    # the sizes are the expensive part -- walk the trees concurrently
+    records = list(runs.values())
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        web_inodes = pool.map(dir_inodes, [r.web_dir for r in records])
+        test_inodes = pool.map(dir_inodes, [r.test_dir for r in records])
+        for r, wi, ti in zip(records, web_inodes, test_inodes):
+            r.inodes = merge_inodes(wi, ti)
+            r.web_size, r.test_size = reclaimed([r])
+
+    records.sort(key=lambda r: r.name, reverse=True)
+    return records
+
+
+def plan_deletions(runs, benchmark_tests, gcd=None, keep_last=0,
+                   keep_failures=None, keep_benchmarks=False,
+                   max_bytes=None, today=None):
+    """ given the index of runs (newest first), return the runs to delete.
+
+        The most recent benchmark of each test, the newest keep_last
+        runs and the runs without a status (unless they are older than gcd)
+        are never deleted.  A run is kept by the age policies if it is not
+        older than gcd, or it has failures and is at most keep_failures days
+        old.  If max_bytes is set, the oldest runs that are not protected
+        are then deleted until both the web and the test directory fit. """
+
+    if today is None:
+        today = datetime.date.today()
+
+    protected = set()
+
+    # a run without a status may still be in progress, or crashed before
+    # recording it -- only the date tells us it is safe to delete
+    for r in runs:
+        if r.status is None and (gcd is None or r.name >= gcd):
+            protected.add(r.name)
+
+    for r in runs[:keep_last]:
+        protected.add(r.name)
+
+    latest_bench = set()
+    for t in benchmark_tests:
+        for r in runs:
+            if t in r.bench_tests:
+                latest_bench.add(r.name)
+                break
+    protected |= latest_bench
+
+    if keep_benchmarks:
+        protected |= {r.name for r in runs if r.bench_tests}
+
+    age_policy = gcd is not None or keep_last or keep_failures is not None
+
+    def kept_by_age(r):
+        if not age_policy:
+            return True
+        if gcd is not None and r.name >= gcd:
+            return True
+        if (keep_failures is not None and r.failed and
+            (today - r.date).days <= keep_failures):
+            return True
+        return False
+
+    doomed = [r for r in runs if r.name not in protected and not kept_by_age(r)]
+
+    if max_bytes is not None:
+        gone = {r.name for r in doomed}
+        web_size, test_size = tree_sizes([r for r in runs if r.name not in gone])
+
+        for r in reversed(runs):
+            if web_size <= max_bytes and test_size <= max_bytes:
+                break
+            if r.name in protected or r.name in gone:
+                continue
+            doomed.append(r)
+            web_size -= r.web_size
+            test_size -= r.test_size
+
+    return doomed
+
+
+def dir_inodes(d, inodes=None):
+    """ the files under directory d, as a dictionary of [size, number of
+        links, links under d] keyed by (st_dev, st_ino) """
+
+    if inodes is None:
+        inodes = {}
+
+    if d is None:
+        return inodes
+
+    try:
+        entries = list(os.scandir(d))
+    except OSError:
+        return inodes
+
+    for e in entries:
+        try:
+            if e.is_dir(follow_symlinks=False):
+                dir_inodes(e.path, inodes)
+            else:
+                st = e.stat(follow_symlinks=False)
+                key = (st.st_dev, st.st_ino)
+                if key in inodes:
+                    inodes[key][2] += 1
+                else:
+                    inodes[key] = [st.st_size, st.st_nlink, 1]
+        except OSError:
+            pass
+
+    return inodes
+
+
+def merge_inodes(web_inodes, test_inodes):
+    """ combine the files of the web and the test directory of a run (see
+        RunRecord.inodes).  A file linked from both belongs to the test
+        directory, where it was written """
+
+    inodes = {key: [size, nlink, links, False]
+              for key, (size, nlink, links) in web_inodes.items()}
+
+    for key, (size, nlink, links) in test_inodes.items():
+        if key in inodes:
+            inodes[key][2] += links
+            inodes[key][3] = True
+        else:
+            inodes[key] = [size, nlink, links, True]
+
+    return inodes
+
+
+def tree_sizes(runs):
+    """ the bytes used by runs in the web and the test directory, counting
+        each file once however many links it has """
+
+    sizes = [0, 0]
+    seen = set()
+    for r in runs:
+        for key, (size, _, _, in_test) in r.inodes.items():
+            if key not in seen:
+                seen.add(key)
+                sizes[in_test] += size
+
+    return tuple(sizes)
+
+
+def reclaimed(runs):
+    """ the bytes freed in the web and the test directory by deleting runs
+        -- a file only counts once all of its links are deleted """
+
+    files = {}
+    for r in runs:
+        for key, (size, nlink, links, in_test) in r.inodes.items():
+            f = files.setdefault(key, [size, nlink, 0, in_test])
+            f[2] += links
+            f[3] = f[3] or in_test
+
+    sizes = [0, 0]
+    for size, nlink, links, in_test in files.values():
+        if links >= nlink:
+            sizes[in_test] += size
+
+    return tuple(sizes)
+
+
 def valid_date(gcdate):
     try:
         y,m,d = gcdate.split("-")
@@ -169,33 +410,10 @@ def valid_date(gcdate):
     return '-'.join([y,m.zfill(2),d.zfill(2)])
 
 
-def isBenchmarkDir(d):
-    f = open(os.path.join(d,d+'.status'), 'r')
-    line = f.readline()
-    f.close()
-    if str.find(line, 'BENCHMARKS UPDATED') == -1:
-        return False
-    else:
-        return True
-
-
-def findBenchmark(d, t):
-    try:
-        f = open(os.path.join(d,t+'.status'), 'r')
-    except:
-        return False
-    line = f.readline()
-    f.close()
-    if str.find(line, 'benchmarks updated') == -1:
-        return False
-    else:
-        return True
-
-
 def rmDir(d):
     print('  deleting', d)
     shutil.rmtree(d)
-    
+
 
 if __name__== "__main__":
     reg_test_gc(sys.argv)
@@ -13,17 +13,23 @@ This test framework understands source based out of the AMReX framework.
 
 
 import email
+import fnmatch
+import math
 import os
 import shutil
 import smtplib
+import statistics
 import sys
 import tarfile
 import time
 import re
-import json
 
 import params
+import perf_stats
+import phase_trace
+import repo
 import test_util
+import tiny_profiler
 import test_report as report
 import test_coverage as coverage
 
@@ -69,6 +75,367 @@ def find_build_dirs(tests):
                 
     return build_dirs
                 
+def select_changed_tests(suite, test_list, base_run=None):
+    """ split test_list into the tests affected by the changes to the repos
+        since the last run each of them passed in (or since base_run, for
+        the tests that passed in it), and the others.  A changed file
+        affects the tests that watch it (see Test.get_watched_paths) -- or,
+        if no test does and it is not in the suite's ignore_paths, all of
+        them """
+
+    if suite.sourceTree in ["AMReX", "amrex"]:
+        source_repo = "AMReX"
+    else:
+        source_repo = "source"
+
+    watched = [t.get_watched_paths(source_repo) for t in test_list]
+
+    ignored = []
+    for p in suite.ignore_paths.split():
+        name, sep, glob = p.rpartition(":")
+        ignored.append((name if sep else None, glob))
+
+    def matches(patterns, k, path):
+        return any((r is None or r == k) and fnmatch.fnmatch(path, glob)
+                   for r, glob in patterns)
+
+    if base_run is None:
+        last_passed = suite.db.last_passed_runs()
+    else:
+        last_passed = {t: base_run for t in suite.db.passed_tests(base_run)}
+    run_repos = {}
+    changes = {}
+
+    def affected(test, patterns):
+
+        run = last_passed.get(test.name)
+        if run is None:
+            return True
+
+        if run not in run_repos:
+            run_repos[run] = suite.db.run_repos(run)
+
+        for k, r in suite.repos.items():
+
+            base_hash = run_repos[run].get(r.name, (None, None))[1]
+            if not base_hash:
+                return True
+
+            if (k, base_hash) not in changes:
+                changes[(k, base_hash)] = r.changed_files(base_hash)
+
+            paths = changes[(k, base_hash)]
+            if paths is None:
+                return True
+
+            for p in paths:
+                if matches(patterns, k, p):
+                    return True
+                if matches(ignored, k, p):
+                    continue
+                if not any(matches(w, k, p) for w in watched):
+                    return True
+
+        return False
+
+    run_tests = []
+    unchanged = []
+
+    for test, patterns in zip(test_list, watched):
+        if affected(test, patterns):
+            run_tests.append(test)
+        else:
+            unchanged.append(test)
+
+    return run_tests, unchanged
+
+class Batch:
+    """ the state shared by the runs of a --batch, one for each variant """
+
+    def __init__(self, variants):
+
+        self.variants = variants
+        self.variant = None
+
+        # the (variant, run name) of each run done so far -- the first is
+        # the base the others are compared to
+        self.runs = []
+
+        # the AMReX hash the comparison tools were built at
+        self.tools_hash = None
+
+        # the first variant starts with a make realclean, the others
+        # rebuild incrementally on top of its builds
+        self.keep_builds = False
+
+        # the log all the runs write to
+        self.log = None
+
+        self.suite = None
+
+    @property
+    def base_run(self):
+        return self.runs[0][1] if self.runs else None
+
+    def apply(self, args):
+        """ set the commandline arguments up for the next run """
+
+        args.source_pr, args.source_branch, args.amrex_pr = parse_variant(self.variant)
+        args.note = f"{args.note} [batch: {self.variant}]".lstrip()
+
+    def pinned_hashes(self, suite, args):
+        """ the hashes, by repo name, the next run tests the repos at: the
+            repos a variant does not change stay at the versions the first
+            run tested.  The remotes are only fetched from once """
+
+        if self.base_run is None:
+            return {}
+
+        base_repos = suite.db.run_repos(self.base_run)
+        pinned = {}
+
+        for k, r in suite.repos.items():
+            r.fetch_origin = False
+            if r.pr_wanted is None and not (k == "source" and args.source_branch):
+                pinned[r.name] = base_repos.get(r.name, (None, None))[1]
+
+        return pinned
+
+    def record(self, suite):
+        """ note that the suite finished the run of the current variant """
+
+        self.runs.append((self.variant, suite.run_name))
+        self.keep_builds = True
+        self.suite = suite
+
+
+class Bisection:
+    """ the state shared by the runs of a --bisect: each runs the test
+        alone, in a temporary run, at the versions in hashes """
+
+    def __init__(self, test_name):
+
+        self.test_name = test_name
+        self.hashes = {}
+
+        # the status line of the test in the last run
+        self.status = None
+
+        self.base_run = None
+        self.tools_hash = None
+
+        # the builds are incremental from one step to the next
+        self.keep_builds = True
+
+        # the log all the runs write to
+        self.log = None
+
+        self.suite = None
+
+    def apply(self, args):
+        """ set the commandline arguments up for the next run """
+
+        args.do_temp_run = True
+        args.single_test = self.test_name
+        args.tests = ""
+        args.keyword = None
+        args.redo_failed = False
+        args.changed_only = False
+        args.no_update = "all"
+        args.send_no_email = True
+
+    def pinned_hashes(self, suite, args):
+        for r in suite.repos.values():
+            r.fetch_origin = False
+        return dict(self.hashes)
+
+    def record(self, suite):
+        self.status = suite.db.test_statuses(suite.run_name).get(self.test_name)
+        self.suite = suite
+
+
+def parse_variant(variant):
+    """ return the (source_pr, source_branch, amrex_pr) of a --batch
+        variant: a source PR number, amrex:N for AMReX PR N, or else the
+        name of a source branch """
+
+    if variant.isdigit():
+        return int(variant), None, None
+
+    if variant.startswith("amrex:") and variant[6:].isdigit():
+        return None, None, int(variant[6:])
+
+    return None, variant, None
+
+
+def test_batch(argv, args):
+    """ run the suite for each of the --batch variants in turn and write
+        a report comparing them """
+
+    suite, _ = params.load_params(args)
+
+    if (args.resume or args.do_temp_run or args.complete_report_from_crash or
+        args.make_benchmarks is not None or args.copy_benchmarks is not None):
+        suite.log.fail("ERROR: --batch cannot be combined with --resume, --do_temp_run, " +
+                       "--complete_report_from_crash, --make_benchmarks or --copy_benchmarks")
+
+    if args.source_pr is not None or args.source_branch is not None or args.amrex_pr is not None:
+        suite.log.fail("ERROR: the --batch variants replace --source_pr, --source_branch and --amrex_pr")
+
+    batch = Batch(args.batch.split())
+    batch.log = suite.log
+    num_failed = 0
+
+    try:
+        for variant in batch.variants:
+            batch.variant = variant
+            num_failed += test_suite(argv, batch=batch)
+    except SystemExit:
+        # a variant failed to run -- still compare the ones that did
+        if batch.runs:
+            report.report_batch(batch.suite, batch.runs)
+        raise
+
+    suite = batch.suite
+    suite.log.outdent()
+    suite.log.skip()
+    suite.log.bold("creating batch report...")
+    report_file = report.report_batch(suite, batch.runs)
+    suite.log.log(f"batch report: {report_file}")
+
+    return num_failed
+
+
+def test_bisect(argv, args):
+    """ find the commit that made the test args.bisect fail, or run
+        slowly, in the last run it was part of: git bisect between the
+        versions of the repos that run and the last run the test passed in
+        tested, running the test alone in a temporary run at each step.
+        The culprit is reported on the test page of the failing run """
+
+    suite, _ = params.load_params(args)
+
+    if (args.batch or args.resume or args.do_temp_run or args.complete_report_from_crash or
+        args.make_benchmarks is not None or args.copy_benchmarks is not None):
+        suite.log.fail("ERROR: --bisect cannot be combined with --batch, --resume, --do_temp_run, " +
+                       "--complete_report_from_crash, --make_benchmarks or --copy_benchmarks")
+    test_name = args.bisect
+
+    # the last run of the test, and the last one before it passed in
+    bad_run = good_run = None
+    bad_code = None
+
+    for run in suite.db.completed_runs():
+        status = suite.db.test_statuses(run).get(test_name)
+        if status is None or "SKIPPED" in status:
+            continue
+
+        code = report.status_code(status)
+        if bad_run is None:
+            if code not in ["S", "C", "X", "F"]:
+                suite.log.fail(f"ERROR: {test_name} did not fail or slow down in its last run, {run}")
+            bad_run, bad_code = run, code
+
+        elif code == "P" or (code == "S" and bad_code != "S"):
+            good_run = run
+            break
+
+    if bad_run is None:
+        suite.log.fail(f"ERROR: no run of {test_name} found")
+    if good_run is None:
+        suite.log.fail(f"ERROR: {test_name} did not pass in any run before {bad_run}")
+
+    def outcome(status):
+        """ what a step's status says about the version it tested """
+        code = report.status_code(status or "")
+        if code == bad_code:
+            return "bad"
+        if code == "P" or (code == "S" and bad_code != "S"):
+            return "good"
+        return "skip"
+
+    bisection = Bisection(test_name)
+    bisection.log = suite.log
+
+    def step(hashes):
+        bisection.hashes = hashes
+        test_suite(argv, batch=bisection)
+        suite.log.outdent()
+        suite.log.skip()
+        suite.log.log(f"{test_name}: {(bisection.status or 'no status').strip()}")
+        return outcome(bisection.status)
+
+    good_hashes = {name: h for name, (_, h) in suite.db.run_repos(good_run).items() if h}
+    bad_hashes = {name: h for name, (_, h) in suite.db.run_repos(bad_run).items() if h}
+
+    # the source repo is the most likely culprit, so it goes first
+    repos = sorted(suite.repos.items(), key=lambda item: item[0] != "source")
+    changed = [r for _, r in repos if r.name in good_hashes and r.name in bad_hashes and
+               good_hashes[r.name] != bad_hashes[r.name]]
+
+    suite.log.skip()
+    suite.log.bold(f"bisecting {test_name} between {good_run} and {bad_run}...")
+
+    # find the repo whose change broke the test: with the others at their
+    # failing versions, the test passes with it back at its good version
+    hashes = dict(bad_hashes)
+    for r in changed:
+        trial = dict(hashes)
+        trial[r.name] = good_hashes[r.name]
+
+        suite.log.skip()
+        suite.log.bold(f"trying {r.name} at {good_hashes[r.name]}...")
+        if step(trial) == "good":
+            break
+
+        hashes = trial
+    else:
+        suite.log.fail(f"ERROR: {test_name} does not pass with any repo back at its {good_run} version")
+
+    def git(command):
+        return test_util.run(command, cwd=r.dir)
+
+    stdout, _, rc = git(f"git bisect start --no-checkout {bad_hashes[r.name]} {good_hashes[r.name]}")
+    if rc != 0:
+        suite.log.fail(f"ERROR: unable to start git bisect in {r.dir}")
+
+    while rc == 0 and "is the first bad commit" not in stdout:
+        candidate = git("git rev-parse BISECT_HEAD")[0].strip()
+
+        trial = dict(hashes)
+        trial[r.name] = candidate
+
+        suite.log.skip()
+        suite.log.bold(f"testing {r.name} at {candidate}...")
+        stdout, _, rc = git(f"git bisect {step(trial)}")
+
+    git("git bisect reset")
+
+    suite.log.skip()
+    suite.log.bold("bisection result:")
+    suite.log.log(stdout)
+
+    report.report_bisection(suite, bad_run, test_name,
+                            f"{r.name} between {good_run} ({good_hashes[r.name]}) and " +
+                            f"{bad_run} ({bad_hashes[r.name]}):\n\n{stdout}")
+
+    return 0 if "is the first bad commit" in stdout else 1
+
+
+def finish_trace(suite):
+    """ write the spans recorded in this run as a Chrome trace and as a
+        summary page, in the web directory of the run """
+
+    # nothing to do if the run stopped before its web directory was made
+    web_dir = getattr(suite, "full_web_dir", None)
+    if not (phase_trace.enabled() and web_dir and os.path.isdir(web_dir)):
+        return
+
+    phase_trace.phase(None)
+    phase_trace.write_chrome_trace(os.path.join(web_dir, "trace.json"))
+    report.report_phases(suite, phase_trace.summary())
+
+
 def cmake_setup(suite):
     "Setup for cmake"
 
@@ -123,11 +490,12 @@ def cmake_setup(suite):
 
 
 
-def copy_benchmarks(old_full_test_dir, full_web_dir, test_list, bench_dir, log):
+def copy_benchmarks(old_full_test_dir, suite, test_list, bench_dir):
     """ copy the last plotfile output from each test in test_list
         into the benchmark directory.  Also copy the diffDir, if
         it exists """
     td = os.getcwd()
+    log = suite.log
 
     for t in test_list:
         wd = f"{old_full_test_dir}/{t.name}"
@@ -168,12 +536,10 @@ def copy_benchmarks(old_full_test_dir, full_web_dir, test_list, bench_dir, log):
                 pass
             shutil.copytree(p, f"{bench_dir}/{store_file}")
 
-            with open(f"{full_web_dir}/{t.name}.status", 'w') as cf:
-                cf.write(f"benchmarks updated.  New file:  {store_file}\n")
+            suite.record_test_status(t.name, f"benchmarks updated.  New file:  {store_file}\n")
 
         else:   # no benchmark exists
-            with open(f"{full_web_dir}/{t.name}.status", 'w') as cf:
-                cf.write("benchmarks update failed")
+            suite.record_test_status(t.name, "benchmarks update failed")
 
         # is there a diffDir to copy too?
         if not t.diffDir == "":
@@ -240,37 +606,140 @@ def process_comparison_results(stdout, tvars, test):
 
 def test_performance(test, suite, runtimes):
     """ outputs a warning if the execution time of the test this run
-        does not compare favorably to past logged times """
+        is significantly slower than its past logged times """
 
     if test.name not in runtimes:
         return
-    runtimes = runtimes[test.name]["runtimes"]
 
-    if len(runtimes) < 1:
+    # with timing repeats, their medians are compared with each other
+    value, column = test.performance_time()
+    history = [(d, t) for d, t in zip(runtimes[test.name]["dates"], runtimes[test.name][column])
+               if not math.isnan(t)]
+
+    if len(history) < 1:
         suite.log.log("no completed runs found")
         return
 
-    num_times = len(runtimes)
+    num_times = len(history)
     suite.log.log(f"{num_times} completed run(s) found")
     suite.log.log("checking performance ...")
 
     # Slice out correct number of times
-    run_diff = num_times - test.runs_to_average
-    if run_diff > 0:
-        runtimes = runtimes[:-run_diff]
+    if num_times > test.runs_to_average:
         num_times = test.runs_to_average
     else:
         test.runs_to_average = num_times
 
-    test.past_average = sum(runtimes) / num_times
+    past = [t for _, t in history[:num_times]]
+    test.past_average = sum(past) / num_times
+
+    test.past_median, _, test.perf_zscore, test.perf_pvalue = perf_stats.compare(
+        value, past, noise=test.timing_stddev or 0.0)
+    if test.past_median is None:
+        suite.log.log(f"fewer than {perf_stats.MIN_RUNS} past runs -- no comparison done")
+        return
 
     # Test against threshold
     meets_threshold, percentage, compare_str = test.measure_performance()
     if meets_threshold is not None and not meets_threshold:
-        warn_msg = "test ran {:.1f}% {} than running average of the past {} runs"
-        warn_msg = warn_msg.format(percentage, compare_str, num_times)
+        warn_msg = "test ran {:.1f}% {} than the median of the past {} runs (p = {:.2g})"
+        warn_msg = warn_msg.format(percentage, compare_str, num_times, test.perf_pvalue)
         suite.log.warn(warn_msg)
 
+    # look for a lasting shift over the whole history, this run included
+    if test.change_point_detection:
+
+        def find_change_point(window):
+            """ the significant change point of window, a chronological list
+                of (date, time), as (index, shift, p) -- or None """
+            result = perf_stats.change_point([t for _, t in window])
+            if result is None or result[2] >= test.performance_significance:
+                return None
+            return result
+
+        window = history[:perf_stats.CHANGE_POINT_WINDOW - 1][::-1] + [(suite.run_name, value)]
+        dates = [d for d, _ in window]
+        result = find_change_point(window)
+
+        # a shift stays detectable for as long as it is in the window --
+        # only report it on the run it is first found in, i.e. if the last
+        # run did not find it already (give or take a few runs)
+        if result is not None:
+            index, shift, p = result
+
+            previous_window = history[:perf_stats.CHANGE_POINT_WINDOW][::-1]
+            previous = find_change_point(previous_window)
+            if previous is not None:
+                previous_date = previous_window[previous[0]][0]
+                if (previous_date in dates and
+                    abs(dates.index(previous_date) - index) < perf_stats.MIN_RUNS):
+                    result = None
+
+        if result is not None:
+            test.change_point = [dates[index], shift, p]
+            msg = "run time changed by {:+.1f}% from {} on (p = {:.2g})".format(
+                100*shift, dates[index], p)
+            if shift > 0:
+                suite.log.warn(msg)
+            else:
+                suite.log.log(msg)
+
+# the resources of a run that are compared with the past runs
+RESOURCE_CHECKS = ["max_rss", "user_time", "sys_time", "read_bytes", "write_bytes"]
+
+def test_resources(test, suite, runtimes):
+    """ warn about the resources the test used significantly more of than
+        in its past runs """
+
+    if not test.resources or test.name not in runtimes:
+        return
+
+    test.resource_regressions = []
+
+    for name in RESOURCE_CHECKS:
+        value = test.resources.get(name)
+        if value is None:
+            continue
+
+        past = [v for v in runtimes[test.name][name][:test.runs_to_average] if not math.isnan(v)]
+
+        center, _, _, p = perf_stats.compare(value, past)
+        if not center or p is None:
+            continue
+
+        ratio = value / center
+        if ratio >= test.resource_threshold and p < test.performance_significance:
+            test.resource_regressions.append([name, 100*(ratio - 1), p])
+            suite.log.warn("{} was {:.1f}% higher than the median of the past {} runs (p = {:.2g})".format(
+                name, 100*(ratio - 1), len(past), p))
+
+def test_region_performance(test, suite, regions):
+    """ compare the TinyProfiler regions of the test with its past runs,
+        and warn about those that got significantly slower """
+
+    history = suite.db.region_history(test.name, suite.run_name, test.runs_to_average)
+    total = max((v[2] or 0.0 for v in regions.values()), default=0.0)
+
+    test.profile_regions = []
+    test.region_regressions = []
+
+    for name, (ncalls, exclusive, inclusive) in regions.items():
+
+        past = history.get(name, [])
+        past_median = perf_stats.median(past) if past else None
+        test.profile_regions.append([name, ncalls, exclusive, inclusive, past_median])
+
+        if (not test.check_performance or exclusive is None or not past_median or
+            exclusive < tiny_profiler.MIN_FRACTION * total):
+            continue
+
+        _, _, _, p = perf_stats.compare(exclusive, past)
+        ratio = exclusive / past_median
+        if p is not None and ratio >= test.performance_threshold and p < test.performance_significance:
+            test.region_regressions.append([name, 100*(ratio - 1), p])
+            suite.log.warn("{} ran {:.1f}% slower than the median of the past {} runs (p = {:.2g})".format(
+                name, 100*(ratio - 1), len(past), p))
+
 def determine_coverage(suite):
 
     try:
@@ -289,19 +758,42 @@ def determine_coverage(suite):
         spec_file = os.path.join(suite.full_test_dir, coverage.SPEC_FILE)
         nonspec_file = os.path.join(suite.full_test_dir, coverage.NONSPEC_FILE)
 
-        shutil.copy(spec_file, suite.full_web_dir)
-        shutil.copy(nonspec_file, suite.full_web_dir)
+        suite.stage_to_web(spec_file)
+        suite.stage_to_web(nonspec_file)
 
-def test_suite(argv):
+def test_suite(argv, batch=None):
     """
-    the main test suite driver
+    the main test suite driver.  batch is the state shared with the other
+    runs of a --batch or --bisect
     """
 
     # parse the commandline arguments
     args = test_util.get_args(arg_string=argv)
 
+    if args.batch is not None and batch is None:
+        return test_batch(argv, args)
+
+    if args.bisect is not None and batch is None:
+        return test_bisect(argv, args)
+
+    if batch is not None:
+        batch.apply(args)
+
+    if args.trace:
+        phase_trace.enable()
+
     # read in the test information
-    suite, test_list = params.load_params(args)
+    suite, test_list = params.load_params(args, log=batch.log if batch is not None else None)
+
+    # the trace is written however the run ends
+    try:
+        return run_suite(suite, test_list, args, batch)
+    finally:
+        finish_trace(suite)
+
+
+def run_suite(suite, test_list, args, batch=None):
+    """ run the tests of test_list and report on them """
 
     active_test_list = [t.name for t in test_list]
 
@@ -324,23 +816,23 @@ def test_suite(argv):
 
         suite.test_dir = args.complete_report_from_crash
 
-        # find all the tests that completed in that web directory
-        tests = []
-        test_file = ""
-        was_benchmark_run = 0
-        for sfile in os.listdir(suite.full_web_dir):
-            if os.path.isfile(sfile) and sfile.endswith(".status"):
-                index = sfile.rfind(".status")
-                tests.append(sfile[:index])
+        # find all the tests that completed in that run
+        completed = suite.db.test_statuses(suite.run_name)
+        tests = [t for t in test_list if t.name in completed]
 
-                with open(suite.full_web_dir + sfile) as f:
-                    for line in f:
-                        if line.find("benchmarks updated") > 0:
-                            was_benchmark_run = 1
+        # and restore their timings and outcomes
+        results = suite.load_results()
+        for t in tests:
+            t.set_results(results.get(t.name, {}))
 
-            if os.path.isfile(sfile) and sfile.endswith(".ini"):
-                test_file = sfile
+        was_benchmark_run = None
+        if suite.db.benchmark_tests(suite.run_name):
+            was_benchmark_run = "recreated after crash"
 
+        test_file = ""
+        for sfile in os.listdir(suite.full_web_dir):
+            if sfile.endswith(".ini"):
+                test_file = sfile
 
         # create the report for this test run
         num_failed = report.report_this_test_run(suite, was_benchmark_run,
@@ -365,7 +857,16 @@ def test_suite(argv):
     if not args.copy_benchmarks is None:
         last_run = suite.get_last_run()
 
-    suite.make_test_dirs()
+    if args.resume:
+        # a resumed benchmark run would mix new benchmarks with the ones
+        # it was to replace
+        if (not args.make_benchmarks is None or not args.copy_benchmarks is None or
+            args.do_temp_run):
+            suite.log.fail("ERROR: --resume cannot be combined with --make_benchmarks, " +
+                           "--copy_benchmarks or --do_temp_run")
+        suite.resume_test_dirs(args.resume)
+    else:
+        suite.make_test_dirs()
 
     if suite.slack_post:
         if args.note == "" and suite.repos["source"].pr_wanted is not None:
@@ -379,8 +880,7 @@ def test_suite(argv):
 
     if not args.copy_benchmarks is None:
         old_full_test_dir = suite.testTopDir + suite.suiteName + "-tests/" + last_run
-        copy_benchmarks(old_full_test_dir, suite.full_web_dir,
-                        test_list, bench_dir, suite.log)
+        copy_benchmarks(old_full_test_dir, suite, test_list, bench_dir)
 
         # here, args.copy_benchmarks plays the role of make_benchmarks
         num_failed = report.report_this_test_run(suite, args.copy_benchmarks,
@@ -419,26 +919,46 @@ def test_suite(argv):
     else:
         nouplist = [k.strip() for k in no_update.split(",")]
 
-        for repo in suite.repos.keys():
-            if repo.lower() in nouplist:
-                suite.repos[repo].update = False
+        for k in suite.repos.keys():
+            if k.lower() in nouplist:
+                suite.repos[k].update = False
 
     os.chdir(suite.testTopDir)
 
-    for k in suite.repos:
-        suite.log.skip()
-        suite.log.bold(f"repo: {suite.repos[k].name}")
-        suite.log.indent()
+    # when resuming, go back to the versions the run was testing
+    resumed_repos = {}
+    if args.resume:
+        resumed_repos = {name: githash for name, (_, githash)
+                         in suite.db.run_repos(suite.run_name).items()}
 
-        if suite.repos[k].update or suite.repos[k].hash_wanted:
-            suite.repos[k].git_update()
+    # a batch or bisection may test some repos at given versions
+    pinned_repos = {}
+    if batch is not None:
+        pinned_repos = batch.pinned_hashes(suite, args)
 
-        suite.repos[k].save_head()
+    suite.log.skip()
+    suite.log.bold("updating the git repos...")
+    suite.log.indent()
+    phase_trace.phase("git")
 
-        if suite.repos[k].update:
-            suite.repos[k].make_changelog()
+    # the repos are updated concurrently -- record each one as soon as it
+    # is done
+    updated = []
+    for r in repo.update_repos(suite, resumed_repos or pinned_repos):
 
-        suite.log.outdent()
+        if resumed_repos.get(r.name):
+            continue
+
+        suite.db.record_repo(suite.run_name, r.name, r.get_branch_name(), r.hash_current)
+
+        if r.update:
+            updated.append(r)
+
+    # the ChangeLogs only cover the commits since the last run
+    repo.make_changelogs(updated, [suite.db.last_repo_hash(r.name, suite.run_name)
+                                   for r in updated])
+
+    suite.log.outdent()
 
 
     # keep track if we are running on any branch that is not the suite
@@ -449,16 +969,51 @@ def test_suite(argv):
         bf = open(f"{suite.full_web_dir}/branch.status", "w")
         bf.write("branch different than suite default")
         bf.close()
+        suite.db.set_branch_mark(suite.run_name)
 
     #--------------------------------------------------------------------------
-    # build the tools and do a make clean, only once per build directory
+    # skip the tests that are not affected by the changes to the repos
     #--------------------------------------------------------------------------
-    suite.build_tools(test_list)
+    report_list = test_list
 
-    all_build_dirs = find_build_dirs(test_list)
+    phase_trace.phase(None)
 
-    suite.log.skip()
-    suite.log.bold("make clean in...")
+    if args.changed_only:
+        # a batch variant only runs the tests its changes affect
+        base_run = batch.base_run if batch is not None else None
+        test_list, unchanged = select_changed_tests(suite, test_list, base_run)
+
+        suite.log.skip()
+        suite.log.bold("skipping the tests not affected by any change:")
+        suite.log.indent()
+        for test in unchanged:
+            suite.log.log(test.name)
+            suite.record_test_status(test.name, "SKIPPED (UNCHANGED)\n")
+        suite.log.outdent()
+
+    #--------------------------------------------------------------------------
+    # build the tools and do a make clean, only once per build directory
+    #--------------------------------------------------------------------------
+    reuse_tools = bool(args.resume)
+    if batch is not None:
+        # the tools only change with AMReX
+        amrex_hash = suite.repos["AMReX"].hash_current.strip()
+        reuse_tools = batch.tools_hash == amrex_hash
+        batch.tools_hash = amrex_hash
+
+    phase_trace.phase("tools")
+    suite.build_tools(test_list, reuse=reuse_tools)
+    phase_trace.phase("realclean")
+
+    # a resumed run keeps what it built, so the builds are incremental
+    if args.resume or (batch is not None and batch.keep_builds):
+        all_build_dirs = []
+    else:
+        all_build_dirs = find_build_dirs(test_list)
+
+    if all_build_dirs:
+        suite.log.skip()
+        suite.log.bold("make clean in...")
 
     for d, source_tree in all_build_dirs:
 
@@ -475,6 +1030,7 @@ def test_suite(argv):
                 suite.make_realclean()
 
     os.chdir(suite.testTopDir)
+    phase_trace.phase(None)
 
 
     #--------------------------------------------------------------------------
@@ -487,7 +1043,16 @@ def test_suite(argv):
     #--------------------------------------------------------------------------
     # Get execution times from previous runs
     #--------------------------------------------------------------------------
-    runtimes = suite.get_wallclock_history()
+    # only the columns the performance checks compare with
+    runtimes = {}
+    if any(t.check_performance for t in test_list):
+        runtimes = suite.get_wallclock_history([t.name for t in test_list],
+                                               ["runtimes", "timing_median"] + RESOURCE_CHECKS)
+
+    # the tests a resumed run already completed
+    completed = {}
+    if args.resume:
+        completed = suite.load_results()
 
     #--------------------------------------------------------------------------
     # main loop over tests
@@ -498,6 +1063,13 @@ def test_suite(argv):
         suite.log.skip()
         suite.log.bold(f"working on test: {test.name}")
         suite.log.indent()
+        phase_trace.phase(None)
+
+        if test.name in completed:
+            suite.log.log("already completed in the run being resumed")
+            test.output_dir = suite.full_test_dir + test.name + '/'
+            test.set_results(completed[test.name])
+            continue
 
         if not args.make_benchmarks is None and (test.restartTest or test.compileTest or
                                                  test.selfTest):
@@ -505,6 +1077,9 @@ def test_suite(argv):
             continue
 
         output_dir = suite.full_test_dir + test.name + '/'
+        if args.resume and os.path.isdir(output_dir):
+            # left behind by the test that was interrupted
+            shutil.rmtree(output_dir)
         os.mkdir(output_dir)
         test.output_dir = output_dir
 
@@ -512,6 +1087,7 @@ def test_suite(argv):
         #----------------------------------------------------------------------
         # compile the code
         #----------------------------------------------------------------------
+        phase_trace.phase("compile", test=test.name)
         if not test.extra_build_dir == "":
             bdir = suite.repos[test.extra_build_dir].dir + test.buildDir
         else:
@@ -557,7 +1133,7 @@ def test_suite(argv):
         test.build_time = time.time() - test.build_time
 
         # copy the make.out into the web directory
-        shutil.copy(f"{output_dir}/{test.name}.make.out", suite.full_web_dir)
+        suite.stage_to_web(f"{output_dir}/{test.name}.make.out")
 
         if not test.compile_successful:
             error_msg = "ERROR: compilation failed"
@@ -573,9 +1149,11 @@ def test_suite(argv):
         #----------------------------------------------------------------------
         # copy the necessary files over to the run directory
         #----------------------------------------------------------------------
+        phase_trace.phase("stage inputs", test=test.name)
         suite.log.log("copying files to run directory...")
 
         needed_files = []
+        run_files = []
         if executable is not None:
             needed_files.append((executable, "move"))
 
@@ -617,6 +1195,8 @@ def test_suite(argv):
         if skip_to_next_test:
             continue
 
+        run_files += [os.path.basename(nfile) for nfile, _ in needed_files]
+
         skip_to_next_test = 0
         for lfile in test.linkFiles:
             if not os.path.exists(lfile):
@@ -628,6 +1208,7 @@ def test_suite(argv):
             else:
                 link_source = os.path.abspath(lfile)
                 link_name = os.path.join(output_dir, os.path.basename(lfile))
+                run_files.append(os.path.basename(lfile))
                 try:
                     os.symlink(link_source, link_name)
                 except OSError:
@@ -643,6 +1224,7 @@ def test_suite(argv):
         #----------------------------------------------------------------------
         # run the test
         #----------------------------------------------------------------------
+        phase_trace.phase("run", test=test.name)
         suite.log.log("running the test...")
 
         os.chdir(output_dir)
@@ -698,9 +1280,9 @@ def test_suite(argv):
             if skip_restart:
                 # copy what we can
                 test.wall_time = time.time() - test.wall_time
-                shutil.copy(test.outfile, suite.full_web_dir)
+                suite.stage_to_web(test.outfile)
                 if os.path.isfile(test.errfile):
-                    shutil.copy(test.errfile, suite.full_web_dir)
+                    suite.stage_to_web(test.errfile)
                     test.has_stderr = True
                 suite.copy_backtrace(test)
                 report.report_single_test(suite, test, test_list, failure_msg=error_msg)
@@ -731,9 +1313,29 @@ def test_suite(argv):
 
         test.wall_time = time.time() - test.wall_time
 
+        # time the test on its own, apart from the run that is checked
+        phase_trace.phase("timing", test=test.name)
+        if test.timing_repeats > 0 and test.return_code == 0:
+            if test.restartTest or args.with_valgrind:
+                suite.log.warn("no timing repeats for restart tests or with valgrind")
+            else:
+                suite.log.log(f"timing {test.timing_repeats} runs after {test.warmup_runs} warm-up run(s)...")
+                times = suite.time_test(test, base_cmd, run_files)
+                if times:
+                    test.timing_min = min(times)
+                    test.timing_median = statistics.median(times)
+                    test.timing_stddev = statistics.stdev(times) if len(times) > 1 else 0.0
+
         # Check for performance drop
         if test.check_performance:
             test_performance(test, suite, runtimes)
+            test_resources(test, suite, runtimes)
+
+        # the timers of AMReX's TinyProfiler, if it was on
+        regions = tiny_profiler.parse_file(test.outfile)
+        if regions:
+            test_region_performance(test, suite, regions)
+            suite.db.record_regions(suite.run_name, test.name, regions)
 
         #----------------------------------------------------------------------
         # do the comparison
@@ -758,6 +1360,7 @@ def test_suite(argv):
 
 
             # get the number of levels for reporting
+            phase_trace.phase("fboxinfo", test=test.name)
             if not test.run_as_script:
 
                 prog = "{} -l {}".format(suite.tools["fboxinfo"], output_file)
@@ -766,6 +1369,7 @@ def test_suite(argv):
                 if not isinstance(params.convert_type(test.nlevels), int):
                     test.nlevels = ""
 
+            phase_trace.phase("compare", test=test.name)
             if not test.doComparison:
                 test.compare_succesful = not test.crashed
 
@@ -913,22 +1517,21 @@ def test_suite(argv):
 
                         shutil.copytree(source_file, f"{bench_dir}/{compare_file}")
 
-                    with open(f"{test.name}.status", 'w') as cf:
-                        cf.write(f"benchmarks updated.  New file:  {compare_file}\n")
+                    suite.record_test_status(test.name,
+                                             f"benchmarks updated.  New file:  {compare_file}\n")
 
                 else:
-                    with open(f"{test.name}.status", 'w') as cf:
-                        cf.write("benchmarks failed")
-
                     # copy what we can
-                    shutil.copy(test.outfile, suite.full_web_dir)
+                    suite.stage_to_web(test.outfile)
                     if os.path.isfile(test.errfile):
-                        shutil.copy(test.errfile, suite.full_web_dir)
+                        suite.stage_to_web(test.errfile)
                         test.has_stderr = True
                     suite.copy_backtrace(test)
                     error_msg = "ERROR: runtime failure during benchmark creation"
                     report.report_single_test(suite, test, test_list, failure_msg=error_msg)
 
+                    suite.record_test_status(test.name, "benchmarks failed")
+
 
                 if not test.diffDir == "":
                     diff_dir_bench = f"{bench_dir}/{test.name}_{test.diffDir}"
@@ -1020,6 +1623,7 @@ def test_suite(argv):
                                     break
 
                     # visualization
+                    phase_trace.phase("visualization", test=test.name)
                     if test.doVis:
 
                         if test.dim == 1:
@@ -1038,6 +1642,7 @@ def test_suite(argv):
                                 test.png_file = png_file
 
                     # analysis
+                    phase_trace.phase("analysis", test=test.name)
                     if not test.analysisRoutine == "":
 
                         suite.log.log("doing the analysis...")
@@ -1070,61 +1675,49 @@ def test_suite(argv):
                 if test.doVis or test.analysisRoutine != "":
                     suite.log.warn("no output file.  Skipping visualization")
 
-        #----------------------------------------------------------------------
-        # if the test ran and passed, add its runtime to the dictionary
-        #----------------------------------------------------------------------
-
-        if test.record_runtime(suite):
-            test_dict = runtimes.setdefault(test.name, suite.timing_default)
-            test_dict["runtimes"].insert(0, test.wall_time)
-            test_dict["dates"].insert(0, suite.test_dir.rstrip("/"))
-
         #----------------------------------------------------------------------
         # move the output files into the web directory
         #----------------------------------------------------------------------
+        phase_trace.phase("stage outputs", test=test.name)
         if args.make_benchmarks is None:
-            shutil.copy(test.outfile, suite.full_web_dir)
+            suite.stage_to_web(test.outfile)
             if os.path.isfile(test.errfile):
-                shutil.copy(test.errfile, suite.full_web_dir)
+                suite.stage_to_web(test.errfile)
                 test.has_stderr = True
             if test.doComparison:
-                shutil.copy(test.comparison_outfile, suite.full_web_dir)
+                suite.stage_to_web(test.comparison_outfile)
             try:
-                shutil.copy(f"{test.name}.analysis.out", suite.full_web_dir)
+                suite.stage_to_web(f"{test.name}.analysis.out")
             except:
                 pass
 
             if test.inputFile:
 
-                shutil.copy(test.inputFile, "{}/{}.{}".format(
-                    suite.full_web_dir, test.name, test.inputFile))
+                suite.stage_to_web(test.inputFile, f"{test.name}.{test.inputFile}")
 
             if test.has_jobinfo:
-                shutil.copy(job_info_file, "{}/{}.job_info".format(
-                    suite.full_web_dir, test.name))
+                suite.stage_to_web(job_info_file, f"{test.name}.job_info")
 
             if suite.sourceTree == "C_Src" and test.probinFile != "":
-                shutil.copy(test.probinFile, "{}/{}.{}".format(
-                    suite.full_web_dir, test.name, test.probinFile))
+                suite.stage_to_web(test.probinFile, f"{test.name}.{test.probinFile}")
 
             for af in test.auxFiles:
 
                 # strip out any sub-directory under build dir for the aux file
                 # when copying
-                shutil.copy(os.path.basename(af),
-                            "{}/{}.{}".format(suite.full_web_dir,
-                                              test.name, os.path.basename(af)))
+                suite.stage_to_web(os.path.basename(af),
+                                   f"{test.name}.{os.path.basename(af)}")
 
             if not test.png_file is None:
                 try:
-                    shutil.copy(test.png_file, suite.full_web_dir)
+                    suite.stage_to_web(test.png_file)
                 except OSError:
                     # visualization was not successful.  Reset image
                     test.png_file = None
 
             if not test.analysisRoutine == "":
                 try:
-                    shutil.copy(test.analysisOutputImage, suite.full_web_dir)
+                    suite.stage_to_web(test.analysisOutputImage)
                 except OSError:
                     suite.log.warn("unable to copy analysis image")
                     # analysis was not successful.  Reset the output image
@@ -1133,52 +1726,64 @@ def test_suite(argv):
             # were any Backtrace files output (indicating a crash)
             suite.copy_backtrace(test)
 
-        else:
-            if test.doComparison:
-                shutil.copy(f"{test.name}.status", suite.full_web_dir)
-
 
         #----------------------------------------------------------------------
         # archive (or delete) the output
         #----------------------------------------------------------------------
+        phase_trace.phase("archive", test=test.name)
         suite.log.log("archiving the output...")
-        for pfile in os.listdir(output_dir):
+        outputs = [pfile for pfile in os.listdir(output_dir)
+                   if (os.path.isdir(pfile) and
+                       re.match(f"{test.name}.*_(plt|chk)[0-9]+", pfile))]
 
-            if (os.path.isdir(pfile) and
-                re.match(f"{test.name}.*_(plt|chk)[0-9]+", pfile)):
+        retained = test.get_retained_output(outputs, output_file,
+                                            purge=suite.purge_output == 1)
 
-                if suite.purge_output == 1 and not pfile == output_file:
+        for pfile in outputs:
 
-                    # delete the plt/chk file
-                    try:
-                        shutil.rmtree(pfile)
-                    except:
-                        suite.log.warn(f"unable to remove {pfile}")
+            if pfile not in retained:
 
-                else:
-                    # tar it up
-                    try:
-                        tar = tarfile.open(f"{pfile}.tgz", "w:gz")
-                        tar.add(f"{pfile}")
-                        tar.close()
+                # delete the plt/chk file
+                try:
+                    shutil.rmtree(pfile)
+                except:
+                    suite.log.warn(f"unable to remove {pfile}")
 
-                    except:
-                        suite.log.warn(f"unable to tar output file {pfile}")
+            else:
+                # tar it up
+                try:
+                    tar = tarfile.open(f"{pfile}.tgz", "w:gz")
+                    tar.add(f"{pfile}")
+                    tar.close()
 
-                    else:
-                        try:
-                            shutil.rmtree(pfile)
-                        except OSError:
-                            suite.log.warn(f"unable to remove {pfile}")
+                except:
+                    suite.log.warn(f"unable to tar output file {pfile}")
+
+                else:
+                    try:
+                        shutil.rmtree(pfile)
+                    except OSError:
+                        suite.log.warn(f"unable to remove {pfile}")
 
 
         #----------------------------------------------------------------------
         # write the report for this test
         #----------------------------------------------------------------------
         if args.make_benchmarks is None:
+            phase_trace.phase("report", test=test.name)
             suite.log.log("creating problem test report ...")
             report.report_single_test(suite, test, test_list)
 
+        #----------------------------------------------------------------------
+        # if the test ran and passed, add its runtime to the history -- only
+        # once the journal has its record, so a --resume after a crash in
+        # between does not time the test a second time
+        #----------------------------------------------------------------------
+        if test.record_runtime(suite):
+            suite.record_wallclock(test)
+
+    phase_trace.phase(None)
+
     #--------------------------------------------------------------------------
     # Clean Cmake build and install directories if needed
     #--------------------------------------------------------------------------
@@ -1186,17 +1791,11 @@ def test_suite(argv):
         suite.cmake_clean("AMReX", suite.amrex_dir)
         suite.cmake_clean(suite.suiteName, suite.source_dir)
 
-    #--------------------------------------------------------------------------
-    # jsonify and save runtimes
-    #--------------------------------------------------------------------------
-    file_path = suite.get_wallclock_file()
-    with open(file_path, 'w') as json_file:
-        json.dump(runtimes, json_file, indent=4)
-
     #--------------------------------------------------------------------------
     # parameter coverage
     #--------------------------------------------------------------------------
     if suite.reportCoverage:
+        phase_trace.phase("coverage")
         determine_coverage(suite)
 
     #--------------------------------------------------------------------------
@@ -1205,12 +1804,19 @@ def test_suite(argv):
     suite.log.outdent()
     suite.log.skip()
     suite.log.bold("creating new test report...")
+    phase_trace.phase("run report")
     num_failed = report.report_this_test_run(suite, args.make_benchmarks, args.note,
                                              update_time,
-                                             test_list, args.input_file[0])
+                                             report_list, args.input_file[0])
+
+    if batch is not None:
+        batch.record(suite)
 
-    # make sure that all of the files in the web directory are world readable
+    # make sure that all of the files in the web directory are world
+    # readable -- staged files were already created that way
     for file in os.listdir(suite.full_web_dir):
+        if file in suite.staged_files: continue
+
         current_file = suite.full_web_dir + file
 
         if os.path.isfile(current_file):
@@ -1220,6 +1826,7 @@ def test_suite(argv):
     suite.log.skip()
     suite.log.bold("reverting git branches/hashes")
     suite.log.indent()
+    phase_trace.phase("git")
 
     for k in suite.repos:
         if suite.repos[k].update or suite.repos[k].hash_wanted:
@@ -1251,7 +1858,9 @@ def test_suite(argv):
     #--------------------------------------------------------------------------
     suite.log.skip()
     suite.log.bold("creating suite report...")
+    phase_trace.phase("suite report")
     report.report_all_runs(suite, active_test_list)
+    phase_trace.phase(None)
 
     # delete any temporary directories
     suite.delete_tempdirs()
@@ -1,15 +1,175 @@
 """This module is used to handle all of the git operations for the
 test suite"""
 
+import fcntl
 import os
-import shutil
+import re
 import test_util
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# how many commits go in the ChangeLog when we don't know which version
+# was tested last
+CHANGELOG_MAX_COUNT = 100
+
+
+def make_changelogs(repos, base_hashes):
+    """ generate the ChangeLogs of several repos at once -- each covering
+        the commits since the corresponding base hash -- and copy them to
+        the web directory """
+
+    if not repos:
+        return
+
+    suite = repos[0].suite
+    for r in repos:
+        suite.log.log(f"generating ChangeLog for {r.name}/")
+
+    results = test_util.run_concurrent([r.changelog_command(b)
+                                        for r, b in zip(repos, base_hashes)])
+
+    for r, (_, _, rc) in zip(repos, results):
+
+        # the base may no longer be there, e.g. after a force push
+        if rc != 0 and r.changelog_range is not None:
+            suite.log.warn(f"unable to get the {r.name} log since {r.changelog_range[0]}")
+            test_util.run(**r.changelog_command())
+
+        suite.stage_to_web(os.path.join(r.dir, f"ChangeLog.{r.name}"), mode="copy")
+
+
+def update_repos(suite, resume_hashes=None, max_jobs=None):
+    """ update all the repos of the suite at once: each is git-updated if
+        wanted and its HEAD saved or, if resume_hashes (keyed by repo name)
+        has a hash for it, put back at that hash.  The repos are yielded as
+        they are done.  Once they all are, we fail with a report of every
+        repo that could not be updated """
+
+    if resume_hashes is None:
+        resume_hashes = {}
+
+    def update(r):
+        r.web_files = []
+
+        if not os.path.isdir(r.dir):
+            r.clone()
+        elif suite.git_cache_dir:
+            r.attach_cache()
+
+        if resume_hashes.get(r.name):
+            r.resume(resume_hashes[r.name])
+            return
+
+        if suite.use_worktrees:
+            r.worktree_update()
+        elif r.update or r.hash_wanted:
+            r.git_update()
+
+        r.save_head()
+
+    errors = []
+
+    # each repo keeps its messages until it is done, so those of the
+    # different repos do not get mixed up
+    for r in suite.repos.values():
+        r.log = RepoLog()
+
+    with ThreadPoolExecutor(max_workers=max_jobs or len(suite.repos) or 1) as pool:
+        futures = {pool.submit(update, r): r for r in suite.repos.values()}
+
+        for future in as_completed(futures):
+            r = futures[future]
+            r.log.replay(suite.log)
+            r.log = suite.log
+
+            try:
+                future.result()
+            except GitError as e:
+                errors.append(str(e))
+                continue
+
+            for f in r.web_files:
+                suite.stage_to_web(f, mode="copy")
+
+            if r.clone_dir is not None:
+                suite.relocate_repo(r, r.clone_dir)
+
+            yield r
+
+    if errors:
+        suite.log.fail("ERROR: unable to update the git repos:\n  " + "\n  ".join(errors))
+
+
+def update_mirror(suite, url, log=None):
+    """ bring the bare mirror of url in the suite's git cache up to date,
+        creating it the first time, and return its path (None if that
+        fails -- the repos then just fetch everything themselves).  The
+        cache may be shared by all the suites on the host, so each mirror
+        is locked while it is updated.  Messages go to log (default: the
+        suite's) """
+
+    if log is None:
+        log = suite.log
+
+    os.makedirs(suite.git_cache_dir, exist_ok=True)
+    mirror = os.path.join(suite.git_cache_dir, re.sub(r"[^\w.-]+", "_", url) + ".git")
+
+    with open(mirror + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not os.path.isdir(mirror):
+            log.log(f"creating the git mirror {mirror}")
+            _, _, rc = test_util.run(f"git clone --bare --quiet {url} {mirror}", stdin=True)
+            if rc != 0:
+                log.warn(f"unable to create the git mirror of {url}")
+                return None
+
+            # the repos borrowing objects from the mirror would break if
+            # any of them were ever pruned
+            test_util.run("git config gc.auto 0", cwd=mirror)
+
+        log.log(f"git fetch in {mirror}")
+        _, _, rc = test_util.run("git fetch --quiet origin +refs/heads/*:refs/heads/* " +
+                                 "+refs/tags/*:refs/tags/*", cwd=mirror, stdin=True)
+        if rc != 0:
+            log.warn(f"unable to update the git mirror of {url}")
+
+    return mirror
+
+
+class GitError(Exception):
+    """ a git operation on a repo failed """
+
+
+class RepoLog:
+    """ stands in for the suite's Log while a repo is updated in a worker
+        thread: the messages are kept to be replayed from the main thread,
+        and a failure raises a GitError instead of exiting """
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, string):
+        self.messages.append(("log", string))
+
+    def warn(self, warn_msg):
+        self.messages.append(("warn", warn_msg))
+
+    def fail(self, string):
+        raise GitError(string.strip())
+
+    def replay(self, log):
+        """ write the messages kept so far to log """
+
+        for kind, msg in self.messages:
+            getattr(log, kind)(msg)
+        self.messages = []
+
 
 class Repo:
     """ a simple class to manage our git operations """
     def __init__(self, suite, directory, name,
                  branch_wanted=None, pr_wanted=None, hash_wanted=None,
-                 build=0, comp_string=None):
+                 build=0, comp_string=None, url=None, depth=0, fetch_filter=None):
 
         self.suite = suite
         self.dir = directory
@@ -21,10 +181,35 @@ class Repo:
         self.build = build   # does this repo contain build directories?
         self.comp_string = comp_string   # environment vars needed to build
 
+        # where to clone the repo from if it is not there yet, and how much
+        # of it to fetch: the number of commits of history (0 for all) and
+        # a partial clone filter such as blob:none
+        self.url = url
+        self.depth = depth
+        self.fetch_filter = fetch_filter
+
+        # whether to fetch from the remote before updating -- a --batch
+        # only does it once
+        self.fetch_origin = True
+
+        # where our messages go -- while the repos are updated
+        # concurrently, a RepoLog keeps them until the update is done
+        self.log = suite.log
+
+        # the files of the last update to copy to the web directory, which
+        # update_repos does once the update is done
+        self.web_files = []
+
         # for storage
         self.branch_orig = None
         self.hash_current = None
 
+        # the (from, to) hashes covered by the ChangeLog, if it is a range
+        self.changelog_range = None
+
+        # the clone the worktree we test in (if any) belongs to
+        self.clone_dir = None
+
         self.update = True
         if hash_wanted:
             self.update = False
@@ -39,44 +224,140 @@ class Repo:
 
         return None
 
+    def _git(self, command, error=None, **kwargs):
+        """ run a git command in the repo and return its stdout.  If it
+            fails and error is given, raise a GitError with that message """
+
+        stdout, _, rc = test_util.run(command, cwd=self.dir, log=self.log, **kwargs)
+
+        if rc != 0 and error is not None:
+            raise GitError(f"{self.name}: {error}")
+
+        return stdout
+
+    def _file(self, name):
+        return os.path.join(self.dir, name)
+
+    def is_shallow(self):
+        """ is the clone we work with shallow? """
+
+        stdout, _, rc = test_util.run("git rev-parse --is-shallow-repository",
+                                      cwd=self.clone_dir or self.dir)
+        return rc == 0 and stdout.strip() == "true"
+
+    def fetch_options(self, fetch_filter=True, clone=False):
+        """ the git fetch options limiting what we fetch -- git pull does
+            not take a filter, but a partial clone remembers its own.  The
+            depth is only passed when cloning, or to a clone that is shallow
+            already: fetching with a depth would make a full clone shallow """
+
+        opts = ""
+        if self.depth and (clone or self.is_shallow()):
+            opts += f" --depth={self.depth}"
+        if fetch_filter and self.fetch_filter:
+            opts += f" --filter={self.fetch_filter}"
+        return opts
+
+    def clone(self):
+        """ clone the repo from its url, borrowing the objects of the
+            suite's git cache if there is one.  Raises GitError if this
+            fails """
+
+        if not self.url:
+            raise GitError(f"{self.name}: {self.dir} does not exist and no url is given")
+
+        command = "git clone" + self.fetch_options(clone=True)
+
+        if self.suite.git_cache_dir:
+            mirror = update_mirror(self.suite, self.url, self.log)
+            if mirror is not None:
+                command += f" --reference-if-able {mirror}"
+
+        branch = self.get_branch_name()
+        if self.pr_wanted is None and branch is not None:
+            command += f" --branch {branch}"
+
+        self.log.log(f"cloning {self.url} into {self.dir}")
+        _, _, rc = test_util.run(f"{command} {self.url} {self.dir}", stdin=True)
+        if rc != 0:
+            raise GitError(f"{self.name}: git clone of {self.url} was unsuccessful")
+
+    def attach_cache(self):
+        """ make the repo borrow the objects of its mirror in the suite's
+            git cache, so that fetches only get what the mirror does not
+            have.  The first time, the objects the repo already shares with
+            the mirror are dropped from it """
+
+        url = self.url or self._git("git config --get remote.origin.url").strip()
+        if not url:
+            return
+
+        mirror = update_mirror(self.suite, url, self.log)
+        if mirror is None:
+            return
+
+        git_dir = os.path.join(self.dir, self._git("git rev-parse --git-common-dir").strip())
+        alternates = os.path.join(git_dir, "objects", "info", "alternates")
+        objects = os.path.join(mirror, "objects")
+
+        try:
+            with open(alternates) as f:
+                if objects in f.read().splitlines():
+                    return
+        except OSError:
+            pass
+
+        self.log.log(f"borrowing the objects of {mirror} in {self.dir}")
+        os.makedirs(os.path.dirname(alternates), exist_ok=True)
+        with open(alternates, "a") as f:
+            f.write(f"{objects}\n")
+
+        self._git("git repack -a -d -l -q")
+
+    def fetch_hash(self, githash, cwd=None):
+        """ a shallow or partial clone may not have githash yet -- fetch it
+            by itself if so.  Raises GitError if this fails """
+
+        cwd = cwd or self.dir
+        _, _, rc = test_util.run(f"git cat-file -e {githash}^{{commit}}", cwd=cwd)
+        if rc == 0:
+            return
+
+        self.log.log(f"fetching {githash}")
+        _, _, rc = test_util.run(f"git fetch{self.fetch_options()} origin {githash}",
+                                 cwd=cwd, stdin=True)
+        if rc != 0:
+            raise GitError(f"{self.name}: git fetch of {githash} was unsuccessful")
+
     def git_update(self):
         """ Do a git update of the repository.  If githash is not empty, then
-            we will check out that version instead of git-pulling. """
-
-        os.chdir(self.dir)
+            we will check out that version instead of git-pulling.  Raises
+            GitError if this fails """
 
         # find out current branch so that we can go back later if we need.
-        stdout0, _, _ = test_util.run("git rev-parse --abbrev-ref HEAD")
+        stdout0 = self._git("git rev-parse --abbrev-ref HEAD")
         self.branch_orig = stdout0.rstrip('\n')
 
         # just in case the branch we want is not in the local repo
         # yet, start out with a git fetch
-        self.suite.log.log(f"git fetch in {self.dir}")
-        _, _, rc = test_util.run("git fetch", stdin=True)
-
-        if rc != 0:
-            self.suite.log.fail("ERROR: git fetch was unsuccessful")
+        if self.fetch_origin:
+            self.log.log(f"git fetch in {self.dir}")
+            self._git(f"git fetch{self.fetch_options()}", "git fetch was unsuccessful", stdin=True)
 
         # if we need a special branch or are working on a PR, check it out now
         if self.pr_wanted is not None:
-            self.suite.log.log(f"fetching PR {self.pr_wanted}")
-            _, _, rc = test_util.run("git fetch origin pull/{}/head:pr-{}".format(
-                self.pr_wanted, self.pr_wanted), stdin=True)
-            if rc != 0:
-                self.suite.log.fail("ERROR: git fetch was unsuccessful")
+            self.log.log(f"fetching PR {self.pr_wanted}")
+            self._git("git fetch{} origin pull/{}/head:pr-{}".format(
+                self.fetch_options(), self.pr_wanted, self.pr_wanted), "git fetch was unsuccessful", stdin=True)
 
-            self.suite.log.log(f"checking out pr-{self.pr_wanted}")
-            _, _, rc = test_util.run(f"git checkout pr-{self.pr_wanted}", stdin=True)
-            if rc != 0:
-                self.suite.log.fail("ERROR: git checkout was unsuccessful")
+            self.log.log(f"checking out pr-{self.pr_wanted}")
+            self._git(f"git checkout pr-{self.pr_wanted}",
+                      "git checkout was unsuccessful", stdin=True)
 
         elif self.branch_orig != self.branch_wanted:
-            self.suite.log.log(f"git checkout {self.branch_wanted} in {self.dir}")
-            _, _, rc = test_util.run(f"git checkout {self.branch_wanted}",
-                                     stdin=True)
-
-            if rc != 0:
-                self.suite.log.fail("ERROR: git checkout was unsuccessful")
+            self.log.log(f"git checkout {self.branch_wanted} in {self.dir}")
+            self._git(f"git checkout {self.branch_wanted}",
+                      "git checkout was unsuccessful", stdin=True)
 
         else:
             self.branch_wanted = self.branch_orig
@@ -84,61 +365,189 @@ class Repo:
         # get up to date on our branch or hash
         if self.pr_wanted is None:
             if self.hash_wanted == "" or self.hash_wanted is None:
-                self.suite.log.log(f"'git pull' in {self.dir}")
+                self.log.log(f"'git pull' in {self.dir}")
 
-                _, _, rc = test_util.run("git pull", stdin=True,
-                                         outfile=f"git.{self.name}.out")
+                self._git(f"git pull{self.fetch_options(fetch_filter=False)}", stdin=True,
+                          outfile=self._file(f"git.{self.name}.out"))
 
             else:
-                _, _, rc = test_util.run(f"git checkout {self.hash_wanted}",
-                                         outfile=f"git.{self.name}.out")
+                self.fetch_hash(self.hash_wanted)
+                self._git(f"git checkout {self.hash_wanted}", "git update was unsuccessful",
+                          outfile=self._file(f"git.{self.name}.out"))
 
-                if rc != 0:
-                    self.suite.log.fail("ERROR: git update was unsuccessful")
+            self.web_files.append(self._file(f"git.{self.name}.out"))
 
-            shutil.copy(f"git.{self.name}.out", self.suite.full_web_dir)
+    def worktree_update(self, githash=None):
+        """ check out the PR, branch or hash we want in a worktree of its
+            own under the suite's worktree directory, creating it the first
+            time, and test there from now on.  Since the worktree persists,
+            its builds do too.  If githash is given, that version is checked
+            out in the worktree instead.  Raises GitError if this fails """
+
+        if self.clone_dir is None:
+            self.clone_dir = self.dir
+
+        def git(command, error, **kwargs):
+            stdout, _, rc = test_util.run(command, cwd=self.clone_dir, log=self.log, **kwargs)
+            if rc != 0:
+                raise GitError(f"{self.name}: {error}")
+            return stdout
+
+        # with no update wanted, an existing worktree is used as it is
+        refresh = (githash is not None or self.update or self.hash_wanted or
+                   self.pr_wanted is not None)
+
+        if githash is None and refresh and self.fetch_origin:
+            self.log.log(f"git fetch in {self.clone_dir}")
+            git(f"git fetch{self.fetch_options()}", "git fetch was unsuccessful", stdin=True)
+
+        if self.pr_wanted is not None:
+            if githash is None:
+                self.log.log(f"fetching PR {self.pr_wanted}")
+                git("git fetch{} origin +pull/{}/head:pr-{}".format(
+                    self.fetch_options(), self.pr_wanted, self.pr_wanted), "git fetch was unsuccessful", stdin=True)
+            label = target = f"pr-{self.pr_wanted}"
+
+        elif self.hash_wanted:
+            label = target = self.hash_wanted
+
+        else:
+            if not self.branch_wanted:
+                self.branch_wanted = git("git rev-parse --abbrev-ref HEAD",
+                                         "unable to find the current branch").strip()
+            label = self.branch_wanted.strip("\"")
+
+            # a branch that only exists here has no remote-tracking ref
+            target = f"origin/{label}"
+            _, _, rc = test_util.run(f"git rev-parse --verify --quiet {target}^{{commit}}",
+                                     cwd=self.clone_dir)
+            if rc != 0:
+                target = label
+
+        if githash is not None:
+            target = githash.strip()
+
+        if githash is not None or self.hash_wanted:
+            self.fetch_hash(target, cwd=self.clone_dir)
+
+        worktree = os.path.join(self.suite.get_worktree_dir(), self.name,
+                                label.replace("/", "_")) + "/"
+
+        if not os.path.isdir(worktree):
+            self.log.log(f"creating worktree {worktree}")
+            git(f"git worktree add --detach {worktree} {target}",
+                "git worktree add was unsuccessful", stdin=True)
+
+        elif refresh:
+            self.log.log(f"checking out {target} in {worktree}")
+            _, _, rc = test_util.run(f"git checkout --detach {target}", cwd=worktree,
+                                     stdin=True, outfile=os.path.join(worktree, f"git.{self.name}.out"),
+                                     log=self.log)
+            if rc != 0:
+                raise GitError(f"{self.name}: git checkout in {worktree} was unsuccessful")
+
+            self.web_files.append(os.path.join(worktree, f"git.{self.name}.out"))
+
+        self.dir = worktree
 
     def save_head(self):
         """Save the current head of the repo"""
 
-        os.chdir(self.dir)
+        self.log.log(f"saving git HEAD for {self.name}/")
+
+        self.hash_current = self._git("git rev-parse HEAD",
+                                      outfile=self._file(f"git.{self.name}.HEAD"))
+
+        self.web_files.append(self._file(f"git.{self.name}.HEAD"))
 
-        self.suite.log.log(f"saving git HEAD for {self.name}/")
+    def resume(self, githash):
+        """ get back to githash, the version tested by the run we are
+            resuming, without otherwise updating the repo """
 
-        stdout, _, _ = test_util.run("git rev-parse HEAD",
-                                     outfile=f"git.{self.name}.HEAD")
+        self.update = False
+        self.hash_current = githash
 
-        self.hash_current = stdout
-        shutil.copy(f"git.{self.name}.HEAD", self.suite.full_web_dir)
+        if self.suite.use_worktrees:
+            self.worktree_update(githash)
+            self.hash_wanted = None
+            return
 
-    def make_changelog(self):
-        """ generate a ChangeLog git repository, and copy it to the
+        stdout = self._git("git rev-parse HEAD")
+        if stdout.strip() == githash.strip():
+            self.log.log(f"{self.name} is still at {githash.strip()}")
+            self.hash_wanted = None
+            return
+
+        self.hash_wanted = githash.strip()
+        self.git_update()
+
+    def changed_files(self, base_hash):
+        """ return the paths, relative to the repo, of the files that
+            changed between base_hash and HEAD, or None if git can't tell """
+
+        stdout, _, rc = test_util.run(f"git diff --name-only {base_hash.strip()} HEAD",
+                                      cwd=self.dir)
+        if rc != 0:
+            return None
+
+        return [p for p in stdout.splitlines() if p.strip()]
+
+    def changelog_command(self, base_hash=None):
+        """ return the run() arguments of the git log that makes the
+            ChangeLog: the commits since base_hash, the version tested by
+            the previous run, or the most recent ones if that is not known """
+
+        if base_hash:
+            self.changelog_range = (base_hash.strip(), self.hash_current.strip())
+            revs = f"{self.changelog_range[0]}..{self.changelog_range[1]}"
+        else:
+            self.changelog_range = None
+            revs = f"--max-count={CHANGELOG_MAX_COUNT} HEAD"
+
+        return dict(string=f"git log --name-only {revs}", cwd=self.dir,
+                    outfile=os.path.join(self.dir, f"ChangeLog.{self.name}"),
+                    outfile_mode="w")
+
+    def make_changelog(self, base_hash=None):
+        """ generate a ChangeLog for the git repository, and copy it to the
             web directory"""
 
-        os.chdir(self.dir)
+        make_changelogs([self], [base_hash])
+
+    def compare_url(self):
+        """ a web page showing the ChangeLog range, if the repo is on
+            GitHub """
 
-        self.suite.log.log(f"generating ChangeLog for {self.name}/")
+        if self.changelog_range is None:
+            return None
 
-        test_util.run("git log --name-only",
-                      outfile=f"ChangeLog.{self.name}", outfile_mode="w")
-        shutil.copy(f"ChangeLog.{self.name}", self.suite.full_web_dir)
+        stdout, _, rc = test_util.run("git config --get remote.origin.url", cwd=self.dir)
+        m = re.match(r"(?:https://|git@)github\.com[/:](.+?)(?:\.git)?/?$", stdout.strip())
+        if rc != 0 or m is None:
+            return None
+
+        return "https://github.com/{}/compare/{}...{}".format(m.group(1), *self.changelog_range)
 
     def git_back(self):
         """ switch the repo back to its original branch """
 
-        os.chdir(self.dir)
-        self.suite.log.log(f"git checkout {self.branch_orig} in {self.dir}")
+        # a worktree is left as it is -- the repo itself was never touched
+        if self.clone_dir is not None:
+            return
+
+        self.log.log(f"git checkout {self.branch_orig} in {self.dir}")
 
-        _, _, rc = test_util.run(f"git checkout {self.branch_orig}",
-                                 stdin=True, outfile=f"git.{self.name}.out")
+        _, _, rc = test_util.run(f"git checkout {self.branch_orig}", cwd=self.dir,
+                                 stdin=True, outfile=self._file(f"git.{self.name}.out"))
 
         if rc != 0:
-            self.suite.log.fail("ERROR: git checkout was unsuccessful")
+            self.log.fail("ERROR: git checkout was unsuccessful")
 
         # if we were working on a PR, delete the temporary branch, since we can't pull on it
         if self.pr_wanted is not None:
-            self.suite.log.log(f"removing pr-{self.pr_wanted}")
-            _, _, rc = test_util.run(f"git branch -D pr-{self.pr_wanted}", stdin=True)
+            self.log.log(f"removing pr-{self.pr_wanted}")
+            _, _, rc = test_util.run(f"git branch -D pr-{self.pr_wanted}", cwd=self.dir,
+                                     stdin=True)
 
         if rc != 0:
-            self.suite.log.fail("ERROR: git branch deletion was unsuccessful")
+            self.log.fail("ERROR: git branch deletion was unsuccessful")
@@ -0,0 +1,431 @@
+"""This module stores the outcome of every run of a test suite in a SQLite
+database, so the reports and the garbage collector can look up the status
+of any test in any run without scanning the .status files of the web
+directories"""
+
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    status TEXT,
+    benchmark INTEGER NOT NULL DEFAULT 0,
+    branch_mark INTEGER NOT NULL DEFAULT 0,
+    update_time TEXT,
+    note TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tests (
+    run TEXT NOT NULL,
+    test TEXT NOT NULL,
+    status TEXT NOT NULL,
+    wall_time REAL,
+    build_time REAL,
+    compile_successful INTEGER,
+    compare_successful INTEGER,
+    analysis_successful INTEGER,
+    nlevels TEXT,
+    compare_file TEXT,
+    PRIMARY KEY (run, test)
+);
+
+CREATE INDEX IF NOT EXISTS tests_by_test ON tests (test, run);
+
+CREATE TABLE IF NOT EXISTS repos (
+    run TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    branch TEXT,
+    hash TEXT,
+    PRIMARY KEY (run, repo)
+);
+
+CREATE TABLE IF NOT EXISTS benchmarks (
+    run TEXT NOT NULL,
+    test TEXT NOT NULL,
+    file TEXT,
+    PRIMARY KEY (run, test)
+);
+
+CREATE TABLE IF NOT EXISTS regions (
+    run TEXT NOT NULL,
+    test TEXT NOT NULL,
+    region TEXT NOT NULL,
+    ncalls INTEGER,
+    exclusive REAL,
+    inclusive REAL,
+    PRIMARY KEY (run, test, region)
+);
+
+CREATE TABLE IF NOT EXISTS report_rows (
+    run TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    html TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS report_pages (
+    page TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    first_run TEXT NOT NULL,
+    last_run TEXT NOT NULL
+);
+"""
+
+# only the dated directories are part of the suite history -- this
+# leaves out TEMP_RUN
+HISTORY = "name LIKE '20%'"
+
+# the most parameters we pass in a single query -- older SQLite versions
+# allow no more than 999
+MAX_PARAMS = 500
+
+
+def is_failure(status):
+    """ does a test status line mean the test failed? """
+    return "FAILED" in status or "CRASHED" in status
+
+
+class ResultsDB:
+    """ the results of all the runs of a test suite """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    #######################################################
+    #           Writing                                   #
+    #######################################################
+
+    def start_run(self, run, update_time="", note=""):
+        """ register a new run, forgetting anything stored under the same
+            name before (e.g. for TEMP_RUN) """
+
+        with self.conn:
+            self._delete_run(run)
+            self.conn.execute("INSERT INTO runs (name, update_time, note) VALUES (?, ?, ?)",
+                              (run, update_time, note))
+
+    def set_branch_mark(self, run):
+        """ note that the run used a branch other than the suite default """
+
+        with self.conn:
+            self.conn.execute("UPDATE runs SET branch_mark = 1 WHERE name = ?", (run,))
+            self._invalidate_report(run)
+
+    def record_repo(self, run, repo, branch, githash):
+        if githash is not None:
+            githash = githash.strip()
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)",
+                              (run, repo, branch, githash))
+
+    def record_test(self, run, test_name, status, test=None):
+        """ store the status line of a test and, if the Test object is
+            given, its timings and outcomes """
+
+        row = [run, test_name, status.strip()]
+        if test is not None:
+            row += [test.wall_time, test.build_time,
+                    int(bool(test.compile_successful)),
+                    int(bool(test.compare_successful)),
+                    int(bool(test.analysis_successful)),
+                    test.nlevels, test.compare_file_used]
+        else:
+            row += [None]*7
+
+        index = status.find("file:")
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              row)
+            self._invalidate_report(run)
+            if index >= 0:
+                self.conn.execute("INSERT OR REPLACE INTO benchmarks VALUES (?, ?, ?)",
+                                  (run, test_name, status[index+5:].strip()))
+
+    def record_regions(self, run, test_name, regions):
+        """ store the profiler regions of a test, a dictionary of [ncalls,
+            exclusive time, inclusive time] keyed by region name """
+
+        with self.conn:
+            self.conn.execute("DELETE FROM regions WHERE run = ? AND test = ?", (run, test_name))
+            self.conn.executemany("INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(run, test_name, name, *values)
+                                   for name, values in regions.items()])
+
+    def finish_run(self, run, status, benchmark=False):
+        """ store the overall status of a run -- only runs that have one are
+            part of the history """
+
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO runs (name) VALUES (?)", (run,))
+            self.conn.execute("UPDATE runs SET status = ?, benchmark = ? WHERE name = ?",
+                              (status.strip(), int(bool(benchmark)), run))
+            self._invalidate_report(run)
+
+    def delete_run(self, run):
+        with self.conn:
+            self._delete_run(run)
+
+    def _delete_run(self, run):
+        self.conn.execute("DELETE FROM runs WHERE name = ?", (run,))
+        for table in ["tests", "repos", "benchmarks", "regions"]:
+            self.conn.execute(f"DELETE FROM {table} WHERE run = ?", (run,))
+        self._invalidate_report(run)
+
+    #######################################################
+    #           Suite report cache                        #
+    #######################################################
+
+    def _invalidate_report(self, run):
+        """ forget the rendered report row of a run and the page holding it """
+
+        self.conn.execute("DELETE FROM report_rows WHERE run = ?", (run,))
+        self.conn.execute("DELETE FROM report_pages WHERE ? BETWEEN first_run AND last_run",
+                          (run,))
+
+    def report_rows(self, runs, columns):
+        """ a dictionary of the cached report rows of runs, rendered for
+            the set of tests identified by columns """
+
+        runs = list(runs)
+        if not runs:
+            return {}
+
+        cur = self.conn.execute("SELECT run, html FROM report_rows WHERE columns = ? " +
+                                f"AND run IN ({', '.join('?'*len(runs))})",
+                                [columns] + runs)
+        return dict(cur.fetchall())
+
+    def store_report_row(self, run, columns, html):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO report_rows VALUES (?, ?, ?)",
+                              (run, columns, html))
+
+    def report_page_digest(self, page):
+        """ the digest of the inputs page was last written from, None if
+            it has to be written again """
+
+        cur = self.conn.execute("SELECT digest FROM report_pages WHERE page = ?", (page,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def set_report_page(self, page, digest, first_run, last_run):
+        """ note that page, covering the runs first_run to last_run, was
+            written from inputs with the given digest """
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO report_pages VALUES (?, ?, ?, ?)",
+                              (page, digest, first_run, last_run))
+
+    def delete_report_page(self, page):
+        with self.conn:
+            self.conn.execute("DELETE FROM report_pages WHERE page = ?", (page,))
+
+    #######################################################
+    #           Queries                                   #
+    #######################################################
+
+    def completed_runs(self):
+        """ the names of all the finished runs, newest first """
+
+        cur = self.conn.execute(f"SELECT name FROM runs WHERE status IS NOT NULL AND {HISTORY} " +
+                                "ORDER BY name DESC")
+        return [r[0] for r in cur]
+
+    def run_info(self, run):
+        """ return (status, benchmark, branch_mark) for a run, or None if
+            we know nothing about it """
+
+        cur = self.conn.execute("SELECT status, benchmark, branch_mark FROM runs WHERE name = ?",
+                                (run,))
+        return cur.fetchone()
+
+    def _select_runs(self, query, runs):
+        """ the rows of query restricted to the runs in runs, using the
+            index on run.  SQLite limits the number of parameters, so long
+            lists are done in chunks """
+
+        runs = list(runs)
+        for i in range(0, len(runs), MAX_PARAMS):
+            chunk = runs[i:i+MAX_PARAMS]
+            yield from self.conn.execute(
+                f"{query} WHERE run IN ({', '.join('?'*len(chunk))})", chunk)
+
+    def test_names(self, runs=None):
+        """ the unique names of the tests run in any of runs (default: the
+            whole history), sorted """
+
+        # step through the distinct names of the test index, rather than
+        # reading all of its entries
+        cur = self.conn.execute("""
+            WITH RECURSIVE names(test) AS (
+                SELECT MIN(test) FROM tests
+                UNION ALL
+                SELECT (SELECT MIN(test) FROM tests WHERE test > names.test)
+                FROM names WHERE names.test IS NOT NULL)
+            SELECT test FROM names WHERE test IS NOT NULL""")
+        names = [r[0] for r in cur]
+
+        if runs is None:
+            return names
+
+        runs = list(runs)
+        if len(runs) <= MAX_PARAMS:
+            return sorted({t for (t,) in self._select_runs("SELECT DISTINCT test FROM tests", runs)})
+
+        # a long list of runs is most of the history, e.g. for the suite
+        # report, and a test is then found in it within its last few runs
+        runs = set(runs)
+        found = []
+        for test in names:
+            cur = self.conn.execute("SELECT run FROM tests WHERE test = ? ORDER BY run DESC",
+                                    (test,))
+            if any(run in runs for (run,) in cur):
+                found.append(test)
+
+        return found
+
+    def test_statuses(self, run):
+        """ a dictionary of the status line of every test in a run """
+
+        cur = self.conn.execute("SELECT test, status FROM tests WHERE run = ?", (run,))
+        return dict(cur.fetchall())
+
+    def all_test_statuses(self, runs=None):
+        """ a dictionary, keyed by run, of the status line of every test in
+            runs (default: all the runs) """
+
+        if runs is None:
+            cur = self.conn.execute("SELECT run, test, status FROM tests")
+        else:
+            cur = self._select_runs("SELECT run, test, status FROM tests", runs)
+
+        statuses = {}
+        for run, test, status in cur:
+            statuses.setdefault(run, {})[test] = status
+        return statuses
+
+    def failed_tests(self, run):
+        return [t for t, s in self.test_statuses(run).items() if is_failure(s)]
+
+    def passed_tests(self, run):
+        return [t for t, s in self.test_statuses(run).items() if "PASSED" in s]
+
+    def last_passed_runs(self):
+        """ a dictionary of the most recent finished run each test passed
+            in """
+
+        cur = self.conn.execute("SELECT tests.test, MAX(tests.run) FROM tests " +
+                                "JOIN runs ON runs.name = tests.run " +
+                                f"WHERE runs.status IS NOT NULL AND {HISTORY} " +
+                                "AND tests.status LIKE '%PASSED%' GROUP BY tests.test")
+        return dict(cur.fetchall())
+
+    def last_repo_hash(self, repo, run):
+        """ the hash of repo in the most recent finished run before run, or
+            None """
+
+        cur = self.conn.execute("SELECT repos.hash FROM repos " +
+                                "JOIN runs ON runs.name = repos.run " +
+                                f"WHERE repos.repo = ? AND repos.run < ? AND runs.status IS NOT NULL " +
+                                f"AND {HISTORY} AND repos.hash IS NOT NULL " +
+                                "ORDER BY repos.run DESC LIMIT 1", (repo, run))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def run_repos(self, run):
+        """ a dictionary of the (branch, hash) of each repo in a run """
+
+        cur = self.conn.execute("SELECT repo, branch, hash FROM repos WHERE run = ?", (run,))
+        return {repo: (branch, githash) for repo, branch, githash in cur}
+
+    def region_history(self, test_name, run, max_runs):
+        """ the exclusive times of each profiler region of a test in the
+            last max_runs finished runs before run that it passed in, as a
+            dictionary of lists, most recent first """
+
+        cur = self.conn.execute("SELECT DISTINCT regions.run FROM regions " +
+                                "JOIN runs ON runs.name = regions.run " +
+                                "JOIN tests ON tests.run = regions.run AND tests.test = regions.test " +
+                                "WHERE regions.test = ? AND regions.run < ? AND runs.status IS NOT NULL " +
+                                f"AND {HISTORY} AND tests.status LIKE '%PASSED%' " +
+                                "ORDER BY regions.run DESC LIMIT ?", (test_name, run, max_runs))
+        runs = [r[0] for r in cur]
+        if not runs:
+            return {}
+
+        cur = self.conn.execute("SELECT region, exclusive FROM regions WHERE test = ? " +
+                                f"AND run IN ({', '.join('?'*len(runs))}) ORDER BY run DESC",
+                                [test_name] + runs)
+
+        history = {}
+        for region, exclusive in cur:
+            if exclusive is not None:
+                history.setdefault(region, []).append(exclusive)
+        return history
+
+    def benchmark_tests(self, run):
+        """ the tests whose benchmarks were updated in a run """
+
+        cur = self.conn.execute("SELECT test FROM benchmarks WHERE run = ?", (run,))
+        return [r[0] for r in cur]
+
+    #######################################################
+    #           Backfilling                               #
+    #######################################################
+
+    def import_web_dirs(self, web_top_dir):
+        """ fill the database from the .status and git HEAD files of the
+            runs already in the web directory """
+
+        for run in sorted(os.listdir(web_top_dir)):
+
+            run_dir = os.path.join(web_top_dir, run)
+            if not (run.startswith("20") and os.path.isdir(run_dir)):
+                continue
+
+            run_status = _first_line(os.path.join(run_dir, f"{run}.status"))
+
+            with self.conn:
+                self._delete_run(run)
+                self.conn.execute("INSERT INTO runs (name, branch_mark) VALUES (?, ?)",
+                                  (run, int(os.path.isfile(os.path.join(run_dir, "branch.status")))))
+
+            for f in os.listdir(run_dir):
+
+                if f.endswith(".status") and not (f.startswith("20") or f == "branch.status"):
+                    status = _first_line(os.path.join(run_dir, f))
+                    if status is not None:
+                        self.record_test(run, f[:f.rfind(".status")], status)
+
+                elif f.startswith("git.") and f.endswith(".HEAD"):
+                    # these accumulate a line per run -- the last one is ours
+                    githash = _first_line(os.path.join(run_dir, f), last=True)
+                    self.record_repo(run, f[4:-5], None, githash)
+
+            if run_status is not None:
+                self.finish_run(run, run_status, "BENCHMARKS UPDATED" in run_status)
+
+
+def _first_line(filename, last=False):
+    """ the first (or last) non-empty line of a file, None if it can't be
+        read """
+
+    try:
+        with open(filename, errors="replace") as f:
+            lines = [line.strip() for line in f if line.strip()]
+    except OSError:
+        return None
+
+    if not lines:
+        return ""
+
+    return lines[-1] if last else lines[0]
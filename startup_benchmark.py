@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Measure the startup cost of the entry points of the test harness: the
+time it takes a fresh interpreter to import each of them, and the imports
+that account for most of it (as reported by python -X importtime)."""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = ["regtest", "reg_test_gc", "test_report", "timing_history"]
+
+
+def time_import(module, repeats):
+    """ return the wallclock times of importing module in repeats fresh
+        interpreters, and the importtime report of the last one """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                           cwd=here, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+
+        if p.returncode != 0:
+            sys.exit(f"ERROR: importing {module} failed:\n{p.stderr}")
+
+    return times, p.stderr
+
+
+def slowest_imports(report, top):
+    """ the top imports by cumulative time (in s) from an importtime report """
+
+    imports = []
+    for line in report.splitlines():
+        # of the form: import time:   self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+
+        name = fields[2].rstrip()
+        # only what the module imports directly -- the rest is part of those
+        if name.startswith("   ") and not name.startswith("    "):
+            imports.append((int(fields[1]) * 1.e-6, name.strip()))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS,
+                        help="the modules to import (default: the harness entry points)")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="number of interpreters to start for each module")
+    parser.add_argument("--top", type=int, default=5,
+                        help="number of slowest imports to list for each module")
+    args = parser.parse_args(argv)
+
+    baseline, _ = time_import("sys", args.repeats)
+    print(f"{'interpreter':20} {statistics.median(baseline):8.3f} s")
+
+    for module in args.modules:
+        times, report = time_import(module, args.repeats)
+        print(f"{module:20} {statistics.median(times):8.3f} s " +
+              f"(min {min(times):.3f} s, max {max(times):.3f} s)")
+
+        for t, name in slowest_imports(report, args.top):
+            print(f"    {name:30} {t:8.3f} s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
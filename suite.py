@@ -1,37 +1,124 @@
 import datetime
+import hashlib
+import importlib.util
 import json
 import os
-import glob
+import re
 import shutil
 import sys
+import time
 import test_util
 import tempfile as tf
 
 try: from json.decoder import JSONDecodeError
 except ImportError: JSONDecodeError = ValueError
 
-DO_TIMINGS_PLOTS = True
+# the plotting backends are only imported when plots are made -- they
+# are slow to load and most uses of the harness don't need them
+DO_TIMINGS_PLOTS = (importlib.util.find_spec("bokeh") is not None or
+                    importlib.util.find_spec("matplotlib") is not None)
 
-try:
-    import bokeh
-    from bokeh.plotting import figure, save, ColumnDataSource
-    from bokeh.resources import CDN
-    from bokeh.models import HoverTool
-    from datetime import datetime as dt
+# the extension of the plots made by the backend in use, once it is
+# loaded
+PLOT_EXT = None
+
+def load_plotting():
+    """ import bokeh, or else matplotlib, and return the extension of the
+        plots it makes (None if neither can be used) """
+
+    global PLOT_EXT, bokeh, figure, save, ColumnDataSource, CDN, HoverTool, dt
+    global matplotlib, plt, dates
+
+    if PLOT_EXT is not None:
+        return PLOT_EXT
 
-except:
     try:
-        import matplotlib
+        import bokeh
+        from bokeh.plotting import figure, save, ColumnDataSource
+        from bokeh.resources import CDN
+        from bokeh.models import HoverTool
+        from datetime import datetime as dt
+
     except:
-        DO_TIMINGS_PLOTS = False
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            import matplotlib.dates as dates
+        except:
+            return None
+
+        PLOT_EXT = "png"
+
     else:
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
+        PLOT_EXT = "html"
 
-    try:
-        import matplotlib.dates as dates
-    except:
-        DO_TIMINGS_PLOTS = False
+    return PLOT_EXT
+
+def plot_timings(test_name, run_dates, times, filename):
+    """ plot the runtimes of a test against the dates of the runs, most
+        recent first, into filename """
+
+    using_mpl = load_plotting() == "png"
+
+    if using_mpl:
+        convf = dates.datestr2num
+    else:
+        convf = lambda s: dt.strptime(s, '%Y-%m-%d')
+
+    def convert_date(date):
+        """ Convert to a matplotlib readable date"""
+
+        if len(date) > 10: date = date[:date.rfind("-")]
+        return convf(date)
+
+    days = list(map(convert_date, run_dates))
+
+    if using_mpl:
+
+        plt.clf()
+        plt.plot_date(days, times, "o", xdate=True)
+
+        years = dates.YearLocator()   # every year
+        months = dates.MonthLocator()
+        years_fmt = dates.DateFormatter('%Y')
+
+        ax = plt.gca()
+        ax.xaxis.set_major_locator(years)
+        ax.xaxis.set_major_formatter(years_fmt)
+        ax.xaxis.set_minor_locator(months)
+
+        plt.ylabel("time (seconds)")
+        plt.title(test_name)
+
+        if max(times) / min(times) > 10.0:
+            ax.set_yscale("log")
+
+        fig = plt.gcf()
+        fig.autofmt_xdate()
+
+        plt.savefig(filename)
+
+    else:
+
+        source = ColumnDataSource(dict(date=days, runtime=times))
+
+        settings = dict(x_axis_type="datetime")
+        if max(times) / min(times) > 10.0: settings["y_axis_type"] = "log"
+        plot = figure(**settings)
+
+        # a new hover tool for every plot, since they can't be shared
+        # between documents
+        plot.add_tools(HoverTool(
+            tooltips=[("date", "@date{%F}"), ("runtime", "@runtime{0.00}")],
+            formatters={"date": "datetime"}))
+
+        plot.circle("date", "runtime", source=source)
+        plot.xaxis.axis_label = "Date"
+        plot.yaxis.axis_label = "Runtime (s)"
+
+        save(plot, resources=CDN, filename=filename,
+             title=f"{test_name} Runtime History")
 
 class Test:
 
@@ -96,6 +183,10 @@ class Test:
 
         self.compare_file_used = ""
 
+        self.thin_output = 0
+
+        self.watch_paths = ""
+
         self.diffDir = ""
         self.diffOpts = ""
 
@@ -138,6 +229,43 @@ class Test:
         self._runs_to_average = 5
         self.past_average = None
 
+        # the ratio to the past runs above which the memory, CPU time or
+        # I/O of a run is flagged
+        self.resource_threshold = 1.2
+
+        # a run only counts as slower if the chance of it being that much
+        # slower than the past runs by noise is below this
+        self.performance_significance = 0.01
+        self.change_point_detection = 0
+
+        # the number of times the test is run again after the run that is
+        # checked, just to time it, and of those runs that are not timed
+        self.timing_repeats = 0
+        self.warmup_runs = 0
+
+        # the statistics of the timed repeats
+        self.timing_min = None
+        self.timing_median = None
+        self.timing_stddev = None
+
+        # the resources used by the run (see test_util.resource_usage), and
+        # those it used significantly more of than the past runs, as [name,
+        # percentage more, p-value]
+        self.resources = None
+        self.resource_regressions = None
+
+        # the TinyProfiler regions of the run, as [name, ncalls, exclusive,
+        # inclusive, past median of exclusive], and those that got slower,
+        # as [name, percentage slower, p-value]
+        self.profile_regions = None
+        self.region_regressions = None
+
+        # the robust comparison with the past runs (see perf_stats)
+        self.past_median = None
+        self.perf_zscore = None
+        self.perf_pvalue = None
+        self.change_point = None
+
         self.keywords = []
 
     def __lt__(self, other):
@@ -191,16 +319,65 @@ class Test:
 
         return last_plot
 
+    def get_retained_output(self, outputs, output_file, purge=False):
+        """ given the plot and checkpoint files written by the run, return
+            the ones to archive -- the rest are deleted.  With thin_output
+            set, we keep the compare file, every thin_output-th plotfile, and
+            the checkpoint a restart test restarts from.  Otherwise purge
+            keeps only the compare file and no purge keeps everything """
+
+        if self.thin_output > 0:
+
+            plts = []
+            retained = set()
+
+            for pfile in outputs:
+                m = re.match(r".*_(plt|chk)([0-9]+)$", pfile)
+                if m is None:
+                    continue
+                if m.group(1) == "plt":
+                    plts.append((int(m.group(2)), pfile))
+                elif self.restartTest and int(m.group(2)) == self.restartFileNum:
+                    retained.add(pfile)
+
+            # by step -- the names stop sorting once the steps outgrow
+            # their zero padding
+            plts.sort()
+            retained.update(pfile for _, pfile in plts[::self.thin_output])
+
+        elif purge:
+            retained = set()
+
+        else:
+            return set(outputs)
+
+        if output_file in outputs:
+            retained.add(output_file)
+
+        return retained
+
+    def performance_time(self):
+        """ the run time the performance checks use, and the column of the
+            timing history it is compared with: the median of the timing
+            repeats if there are any, or else the wall time """
+
+        if self.timing_median is not None:
+            return self.timing_median, "timing_median"
+        return self.wall_time, "runtimes"
+
     def measure_performance(self):
-        """ returns performance relative to past average, as a tuple of:
-            meets threshold, percentage slower/faster, whether slower/faster """
+        """ returns performance relative to the median of the past runs, as
+            a tuple of: meets threshold, percentage slower/faster, whether
+            slower/faster.  The threshold is only missed if the slowdown is
+            also statistically significant """
 
         try:
-            ratio = self.wall_time / self.past_average
+            ratio = self.performance_time()[0] / self.past_median
         except (ZeroDivisionError, TypeError):
             return None, 0.0, "error computing ratio"
 
-        meets_threshold = ratio < self.performance_threshold
+        meets_threshold = (ratio < self.performance_threshold or self.perf_pvalue is None or
+                           self.perf_pvalue >= self.performance_significance)
         percentage = 100 * (1 - ratio)
 
         if percentage < 0: compare_str = "slower"
@@ -247,6 +424,47 @@ class Test:
 
         return f"{self.name}.compare.out"
 
+    def get_watched_paths(self, source_repo):
+        """ return the (repo, glob) patterns of the files whose changes
+            affect this test.  source_repo is the repo tests are built in
+            unless they set extra_build_dir """
+
+        own = self.extra_build_dir or source_repo
+        build_dir = os.path.normpath(self.buildDir)
+
+        if build_dir == ".":
+            return [(own, "*")]
+
+        patterns = [(own, os.path.join(build_dir, "*"))]
+
+        for f in [self.inputFile, self.probinFile, self.run_as_script] + \
+                 self.auxFiles + self.linkFiles:
+            if f:
+                patterns.append((own, os.path.normpath(os.path.join(build_dir, f))))
+
+        for p in self.watch_paths.split():
+            repo, sep, glob = p.rpartition(":")
+            patterns.append((repo if sep else own, glob))
+
+        return patterns
+
+    def get_results(self):
+        """ the outcome of running the test, as stored in the results
+            journal of the run """
+
+        results = {f: getattr(self, f) for f in Test.result_fields}
+        results["passed"] = bool(self.passed)
+        results["crashed"] = bool(self.crashed)
+        return results
+
+    def set_results(self, results):
+        """ restore the outcome of running the test from its record in the
+            results journal """
+
+        for f in Test.result_fields:
+            if f in results:
+                setattr(self, f, results[f])
+
     def record_runtime(self, suite):
 
         test = self.passed and not self.compileTest
@@ -346,6 +564,17 @@ class Test:
     global_particle_tolerance = None
     performance_params = []
 
+    # the attributes filled in by running the test that are kept in the
+    # results journal of the run
+    result_fields = ["compile_successful", "compare_successful", "analysis_successful",
+                     "wall_time", "build_time", "nlevels", "compare_file_used",
+                     "job_info_field1", "job_info_field2", "job_info_field3",
+                     "has_jobinfo", "has_stderr", "backtrace", "return_code",
+                     "past_average", "past_median", "perf_zscore", "perf_pvalue",
+                     "change_point", "timing_min", "timing_median", "timing_stddev",
+                     "profile_regions", "region_regressions", "resources",
+                     "resource_regressions"]
+
     # Properties - allow for direct access as an attribute
     # (e.g. test.compileTest) while still utilizing getters and setters
     compileTest = property(get_compile_test, set_compile_test)
@@ -442,8 +671,30 @@ class Suite:
         # completion
         self.purge_output = 0
 
+        # how output files are placed into the web directory -- one of
+        # test_util.STAGING_MODES
+        self.web_staging = "copy"
+
+        self.ignore_paths = ""
+
+        # check out the version of each repo to test in a git worktree of
+        # its own, kept between runs, rather than in the repo itself
+        self.use_worktrees = 0
+
+        # bare mirrors of the remotes the repos fetch from, shared by all
+        # the suites on the host that use the same directory
+        self.git_cache_dir = ""
+
+        # files placed in the web directory that already have their
+        # final permissions
+        self.staged_files = set()
+
         self.log = None
 
+        # opened on demand, see the db property
+        self._db = None
+        self._timing_history = None
+
         self.do_timings_plots = DO_TIMINGS_PLOTS
 
         # default branch -- we use this only for display purposes --
@@ -457,6 +708,86 @@ class Suite:
 
         return {"runtimes": [], "dates": []}
 
+    @property
+    def run_name(self):
+        """ the name of this run, e.g. 2019-05-01-002 """
+
+        return os.path.normpath(self.test_dir)
+
+    @property
+    def db(self):
+        """ the results database of the suite.  The first time it is
+            created, it is filled from the runs already in the web
+            directory """
+
+        if self._db is None:
+            import results_db
+
+            path = os.path.join(self.webTopDir, "results.db")
+
+            if not os.path.isfile(path):
+                self.log.log("importing past runs into the results database...")
+
+                # build it aside so an interrupted import is started over
+                tmp_path = path + ".import"
+                if os.path.isfile(tmp_path):
+                    os.remove(tmp_path)
+                db = results_db.ResultsDB(tmp_path)
+                db.import_web_dirs(self.webTopDir)
+                db.close()
+                os.replace(tmp_path, path)
+
+            self._db = results_db.ResultsDB(path)
+
+        return self._db
+
+    def record_test_status(self, test_name, status, test=None):
+        """ write the status line of a test in this run to its .status
+            file in the web directory, to the results database and to the
+            results journal of the run """
+
+        with open(os.path.join(self.full_web_dir, f"{test_name}.status"), "w") as sf:
+            sf.write(status)
+
+        self.db.record_test(self.run_name, test_name, status, test=test)
+
+        record = {"test": test_name, "status": status.strip(),
+                  "time": datetime.datetime.now().isoformat(timespec="seconds")}
+        if test is not None:
+            record.update(test.get_results())
+
+        # one line per record, on disk before we go on, so the journal is
+        # complete up to the last test that finished even if we crash
+        line = json.dumps(record) + "\n"
+        with open(os.path.join(self.full_web_dir, "results.jsonl"), "ab+") as jf:
+            # don't run on from a line a crash left unfinished
+            if jf.seek(0, os.SEEK_END) > 0:
+                jf.seek(-1, os.SEEK_END)
+                if jf.read(1) != b"\n": line = "\n" + line
+
+            jf.write(line.encode())
+            jf.flush()
+            os.fsync(jf.fileno())
+
+    def load_results(self, web_dir=None):
+        """ return the latest record of each test in the results journal in
+            web_dir (default: this run's web directory) """
+
+        if web_dir is None:
+            web_dir = self.full_web_dir
+
+        results = {}
+        try:
+            with open(os.path.join(web_dir, "results.jsonl")) as jf:
+                for line in jf:
+                    try: record = json.loads(line)
+                    except JSONDecodeError: continue  # cut short by a crash
+                    results[record["test"]] = record
+        except OSError:
+            pass
+
+        return results
+
     def check_test_dir(self, dir_name):
         """ given a string representing a directory, check if it points to
             a valid directory.  If so, return the directory name """
@@ -563,10 +894,52 @@ class Suite:
         return bench_dir
 
     def get_wallclock_file(self):
-        """ returns the path to the json file storing past runtimes for each test """
+        """ returns the path to the legacy json file storing past runtimes
+            for each test """
 
         return os.path.join(self.get_bench_dir(), f"{self.wallclockFile}.json")
 
+    def get_timing_history_dir(self):
+        """ returns the path to the directory storing past runtimes for each test """
+
+        return os.path.join(self.get_bench_dir(), self.wallclockFile)
+
+    @property
+    def timing_history(self):
+        """ the store of past runtimes.  If it does not exist yet, it is
+            created from the legacy JSON file or test HTML pages """
+
+        if self._timing_history is None:
+            import timing_history
+
+            store_dir = self.get_timing_history_dir()
+
+            if not os.path.isdir(store_dir):
+                self.log.log("importing the wallclock history...")
+
+                # build it aside so an interrupted import is started over
+                tmp_dir = store_dir + ".import"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                store = timing_history.TimingHistory(tmp_dir)
+                store.import_timings(self.get_legacy_wallclock_history())
+                os.rename(tmp_dir, store_dir)
+
+            self._timing_history = timing_history.TimingHistory(store_dir)
+
+        return self._timing_history
+
+    def record_wallclock(self, test):
+        """ add the runtime of test in this run to the history """
+
+        values = {"runtimes": test.wall_time}
+        for column in ["timing_min", "timing_median", "timing_stddev"]:
+            if getattr(test, column) is not None:
+                values[column] = getattr(test, column)
+
+        values.update(test.resources or {})
+
+        self.timing_history.append(test.name, self.test_dir.rstrip("/"), **values)
+
     def make_test_dirs(self):
         os.chdir(self.testTopDir)
 
@@ -610,8 +983,29 @@ class Suite:
 
         os.mkdir(full_web_dir)
 
+        self.test_dir = test_dir
+        self.full_test_dir = full_test_dir
+        self.full_web_dir = full_web_dir
+
+        self.db.start_run(self.run_name, note=self.args.note)
+
         # copy the test file into the web output directory
-        shutil.copy(self.test_file_path, full_web_dir)
+        self.stage_to_web(self.test_file_path)
+
+    def resume_test_dirs(self, test_dir):
+        """ continue in the test and web directories of the run test_dir,
+            which was interrupted """
+
+        test_dir = os.path.normpath(test_dir) + "/"
+
+        full_test_dir = self.testTopDir + self.suiteName + "-tests/" + test_dir
+        full_web_dir = f"{self.webTopDir}/{test_dir}/"
+
+        if not (os.path.isdir(full_test_dir) and os.path.isdir(full_web_dir)):
+            self.log.fail(f"ERROR: run {test_dir} does not exist")
+
+        self.log.skip()
+        self.log.bold("resuming in testing directory: " + test_dir)
 
         self.test_dir = test_dir
         self.full_test_dir = full_test_dir
@@ -622,44 +1016,33 @@ class Suite:
             history of the suite and a separate list of the tests
             run (unique names) """
 
-        valid_dirs = []
-        all_tests = []
-
-        # start by finding the list of valid test directories
-        for f in os.listdir(self.webTopDir):
-
-            f_path = os.path.join(self.webTopDir, f)
-            # look for a directory of the form 20* (this will work up until 2099
-            if f.startswith("20") and os.path.isdir(f_path):
-
-                # look for the status file
-                status_file = f_path + '/' + f + '.status'
-                if os.path.isfile(status_file):
-                    valid_dirs.append(f)
-
-        valid_dirs.sort()
-        valid_dirs.reverse()
+        # the runs that finished, as long as their web directory is still
+        # around
+        on_disk = set(os.listdir(self.webTopDir))
+        valid_dirs = [d for d in self.db.completed_runs() if d in on_disk]
 
         # now find all of the unique problems in the test directories
-        for d in valid_dirs:
-
-            for f in os.listdir(self.webTopDir + d):
-                if f.endswith(".status") and not (f.startswith("20") or f == "branch.status"):
-                    index = f.rfind(".status")
-                    test_name = f[0:index]
-
-                    if all_tests.count(test_name) == 0:
-                        if (not (self.reportActiveTestsOnly and check_activity)) or (test_name in active_test_list):
-                            all_tests.append(test_name)
+        all_tests = []
+        for test_name in self.db.test_names(valid_dirs):
+            if (not (self.reportActiveTestsOnly and check_activity)) or (test_name in active_test_list):
+                all_tests.append(test_name)
 
         all_tests.sort()
 
         return valid_dirs, all_tests
 
-    def get_wallclock_history(self):
-        """ returns the wallclock time history for all the valid tests as a dictionary
-            of NumPy arrays. Set filter_times to False to return 0.0 as a placeholder
-            when there was no available execution time. """
+    def get_wallclock_history(self, tests=None, columns=None):
+        """ returns the wallclock time history for tests (default: all the
+            tests) as a dictionary of dictionaries holding the list of
+            dates and an array for each of columns (default: all that are
+            stored), most recent first """
+
+        return self.timing_history.load(tests, columns)
+
+    def get_legacy_wallclock_history(self):
+        """ returns the wallclock time history as stored before the timing
+            store existed: from the JSON file if there is a valid one, or
+            else from the test HTML pages of every past run """
 
         def extract_time(file):
             """ Helper function for getting runtimes """
@@ -696,23 +1079,10 @@ class Suite:
 
         for dir in valid_dirs:
 
-            # Get status files
             dir_path = os.path.join(self.webTopDir, dir)
-            sfiles = glob.glob(f"{dir_path}/*.status")
-            sfiles = list(filter(os.path.isfile, sfiles))
 
             # Tests that should be counted
-            passed = set()
-
-            for i, file in enumerate(map(open, sfiles)):
-
-                contents = file.read()
-
-                if "PASSED" in contents:
-                    filename = os.path.basename(sfiles[i])
-                    passed.add(filename.split(".")[0])
-
-                file.close()
+            passed = set(self.db.passed_tests(dir))
 
             for test in filter(lambda x: x in passed, all_tests):
 
@@ -732,93 +1102,54 @@ class Suite:
         return timings
 
     def make_timing_plots(self, active_test_list=None, valid_dirs=None, all_tests=None):
-        """ plot the wallclock time history for all the valid tests """
+        """ plot the wallclock time history for all the valid tests.  Only
+            the plots whose data changed since they were last made are
+            redrawn, in parallel """
 
         if active_test_list is not None:
             valid_dirs, all_tests = self.get_run_history(active_test_list)
-        timings = self.get_wallclock_history()
-
-        try: bokeh
-        except NameError:
-
-            convf = dates.datestr2num
-            using_mpl = True
-            self.plot_ext = "png"
+        timings = self.get_wallclock_history(all_tests, ["runtimes"])
 
-        else:
-
-            convf = lambda s: dt.strptime(s, '%Y-%m-%d')
-            using_mpl = False
-            self.plot_ext = "html"
-
-        def convert_date(date):
-            """ Convert to a matplotlib readable date"""
-
-            if len(date) > 10: date = date[:date.rfind("-")]
-            return convf(date)
-
-        def hover_tool():
-            """
-            Encapsulates hover tool creation to prevent errors when generating
-            multiple documents.
-            """
-
-            return HoverTool(
-                tooltips=[("date", "@date{%F}"), ("runtime", "@runtime{0.00}")],
-                formatters={"date": "datetime"})
+        self.plot_ext = load_plotting()
+        if self.plot_ext is None:
+            self.log.warn("no plotting backend could be loaded -- skipping the timing plots")
+            self.do_timings_plots = False
+            return
 
-        # make the plots
+        # find the plots that are out of date
+        stale = []
         for t in all_tests:
 
             try: test_dict = timings[t]
             except KeyError: continue
 
-            days = list(map(convert_date, test_dict["dates"]))
-            times = test_dict["runtimes"]
+            if len(test_dict["runtimes"]) == 0: continue
 
-            if len(times) == 0: continue
+            plot_file = f"{self.webTopDir}/{t}-timings.{self.plot_ext}"
+            key = json.dumps([t, self.plot_ext, test_dict["dates"]]).encode()
+            digest = hashlib.md5(key + test_dict["runtimes"].tobytes()).hexdigest()
 
-            if using_mpl:
+            if os.path.isfile(plot_file) and self.db.report_page_digest(plot_file) == digest:
+                continue
 
-                plt.clf()
-                plt.plot_date(days, times, "o", xdate=True)
+            stale.append((t, test_dict["dates"], test_dict["runtimes"].tolist(), plot_file, digest))
 
-                years = dates.YearLocator()   # every year
-                months = dates.MonthLocator()
-                years_fmt = dates.DateFormatter('%Y')
+        if not stale: return
 
-                ax = plt.gca()
-                ax.xaxis.set_major_locator(years)
-                ax.xaxis.set_major_formatter(years_fmt)
-                ax.xaxis.set_minor_locator(months)
-
-                plt.ylabel("time (seconds)")
-                plt.title(t)
-
-                if max(times) / min(times) > 10.0:
-                    ax.set_yscale("log")
-
-                fig = plt.gcf()
-                fig.autofmt_xdate()
-
-                plt.savefig(f"{self.webTopDir}/{t}-timings.{self.plot_ext}")
-
-            else:
+        self.log.log(f"making {len(stale)} timing plots...")
 
-                source = ColumnDataSource(dict(date=days, runtime=times))
+        if len(stale) == 1:
+            plot_timings(*stale[0][:4])
+            self.db.set_report_page(stale[0][3], stale[0][4], "", "")
+            return
 
-                settings = dict(x_axis_type="datetime")
-                if max(times) / min(times) > 10.0: settings["y_axis_type"] = "log"
-                plot = figure(**settings)
-                plot.add_tools(hover_tool())
+        from concurrent.futures import ProcessPoolExecutor
 
-                plot.circle("date", "runtime", source=source)
-                plot.xaxis.axis_label = "Date"
-                plot.yaxis.axis_label = "Runtime (s)"
-
-                save(plot, resources=CDN,
-                        filename=f"{self.webTopDir}/{t}-timings.{self.plot_ext}",
-                        title=f"{t} Runtime History")
+        with ProcessPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1)) as pool:
+            futures = [(pool.submit(plot_timings, *args[:4]), args) for args in stale]
+            for future, args in futures:
+                future.result()
+                self.db.set_report_page(args[3], args[4], "", "")
 
     def get_last_run(self):
         """ return the name of the directory corresponding to the previous
@@ -840,26 +1171,7 @@ class Suite:
         """ look at the test run in test_dir and return the list of tests that
             failed """
 
-        cwd = os.getcwd()
-
-        outdir = self.testTopDir + self.suiteName + "-tests/"
-
-        os.chdir(outdir + test_dir)
-
-        failed = []
-
-        for test in os.listdir("."):
-            if not os.path.isdir(test): continue
-
-            # the status files are in the web dir
-            status_file = f"{self.webTopDir}/{test_dir}/{test}.status"
-            with open(status_file) as sf:
-                for line in sf:
-                    if line.find("FAILED") >= 0 or line.find("CRASHED") >= 0:
-                        failed.append(test)
-
-        os.chdir(cwd)
-        return failed
+        return self.db.failed_tests(test_dir)
 
     def make_realclean(self, repo="source"):
         build_comp_string = ""
@@ -918,7 +1230,9 @@ class Suite:
 
         return comp_string, rc
 
-    def run_test(self, test, base_command):
+    def get_run_command(self, test, base_command):
+        """ the full command running the test, and its environment """
+
         test_env = None
         if test.useOMP:
             test_env = dict(os.environ, OMP_NUM_THREADS=f"{test.numthreads}")
@@ -931,18 +1245,80 @@ class Suite:
         else:
             test_run_command = base_command
 
+        return test_run_command, test_env
+
+    def run_test(self, test, base_command):
+        test_run_command, test_env = self.get_run_command(test, base_command)
+
         outfile = test.outfile
 
         if test.run_as_script: errfile = None
         else: errfile = test.errfile
 
         self.log.log(test_run_command)
+        # the run output can be huge and nobody needs it in memory
+        rusage = {}
         sout, serr, ierr = test_util.run(test_run_command, stdin=True,
                                          outfile=outfile, errfile=errfile,
-                                         env=test_env)
+                                         env=test_env, capture_limit=0,
+                                         rusage=rusage)
         test.run_command = test_run_command
         test.return_code = ierr
 
+        # a restart test adds up the resources of both its runs
+        if test.resources is None:
+            test.resources = rusage
+        else:
+            for k, v in rusage.items():
+                if k == "max_rss":
+                    test.resources[k] = max(test.resources[k], v)
+                else:
+                    test.resources[k] += v
+
+    def time_test(self, test, base_command, run_files):
+        """ run the test test.warmup_runs + test.timing_repeats more times,
+            in a scratch directory holding links to the run_files in its
+            output directory, and return the wall times of the runs after
+            the warm-up ones -- none if one of them fails.  Nothing these
+            runs write is kept """
+
+        timing_dir = os.path.join(test.output_dir, "timing")
+        os.mkdir(timing_dir)
+        for f in run_files:
+            os.symlink(os.path.join(test.output_dir, f), os.path.join(timing_dir, f))
+
+        test_run_command, test_env = self.get_run_command(test, base_command)
+        outfile = os.path.join(test.output_dir, f"{test.name}.timing.out")
+
+        times = []
+        for n in range(test.warmup_runs + test.timing_repeats):
+
+            start = time.perf_counter()
+            _, _, rc = test_util.run(test_run_command, stdin=True, outfile=outfile,
+                                     outfile_mode="w", env=test_env, cwd=timing_dir,
+                                     capture_limit=0)
+            elapsed = time.perf_counter() - start
+
+            if rc != 0:
+                self.log.warn(f"timing run {n+1} failed, see {outfile}")
+                times = []
+                break
+
+            if n >= test.warmup_runs:
+                times.append(elapsed)
+
+            # start the next run from the same files
+            for f in os.listdir(timing_dir):
+                if f in run_files: continue
+                path = os.path.join(timing_dir, f)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+        shutil.rmtree(timing_dir)
+        return times
+
     def copy_backtrace(self, test):
         """
         if any backtrace files were output (because the run crashed), find them
@@ -951,12 +1327,58 @@ class Suite:
         backtrace = test.find_backtrace()
 
         for btf in backtrace:
-            ofile = f"{self.full_web_dir}/{test.name}.{btf}"
-            shutil.copy(btf, ofile)
+            self.stage_to_web(btf, f"{test.name}.{btf}")
             test.backtrace.append(f"{test.name}.{btf}")
 
+    def get_worktree_dir(self):
+        """ returns the directory holding the git worktrees of the repos """
+
+        return os.path.join(self.testTopDir, f"{self.suiteName}-worktrees")
+
+    def relocate_repo(self, repo, old_dir):
+        """ the checkout of repo moved from old_dir to repo.dir (a
+            worktree): update the directories and compile strings that
+            refer to it """
+
+        old_dir = os.path.normpath(old_dir)
+        new_dir = os.path.normpath(repo.dir)
+
+        if os.path.normpath(self.amrex_dir) == old_dir:
+            self.amrex_dir = repo.dir
+        if os.path.normpath(self.source_dir) == old_dir:
+            self.source_dir = repo.dir
+
+        # only whole paths -- /x/amrex is not part of /x/amrex-castro
+        path = re.compile(r"(?<![\w.-]){}(?![\w.-])".format(re.escape(old_dir)))
+
+        def relocate(string):
+            return path.sub(lambda m: new_dir, string)
 
-    def build_tools(self, test_list):
+        for r in self.repos.values():
+            if r.comp_string is not None:
+                r.comp_string = relocate(r.comp_string)
+
+        self.extra_src_comp_string = relocate(self.extra_src_comp_string)
+
+    def stage_to_web(self, src, name=None, mode=None):
+        """ place the file src into the web directory for this run, under
+            the name name if given.  mode overrides the web_staging mode --
+            files that are appended to after staging need a real copy """
+
+        if name is None:
+            name = os.path.basename(src)
+
+        if mode is None:
+            mode = self.web_staging
+
+        test_util.stage_file(src, os.path.join(self.full_web_dir, name),
+                             mode=mode)
+        self.staged_files.add(name)
+
+
+    def build_tools(self, test_list, reuse=False):
+        """ build the comparison tools.  If reuse is set (when resuming a
+            run), the executables already built are used as they are """
 
         self.log.skip()
         self.log.bold("building tools...")
@@ -969,7 +1391,8 @@ class Suite:
 
         os.chdir(self.f_compare_tool_dir)
 
-        self.make_realclean(repo="AMReX")
+        if not reuse:
+            self.make_realclean(repo="AMReX")
 
         ftools = ["fcompare", "fboxinfo", "fsnapshot"]
         if ("fextract" in self.extra_tools): ftools.append("fextract")
@@ -978,12 +1401,15 @@ class Suite:
         if any([t for t in test_list if t.tolerance is not None]): ftools.append("fvarnames")
 
         for t in ftools:
-            self.log.log(f"building {t}...")
-            comp_string, rc = self.build_c(target=f"programs={t}",
-                                           opts="DEBUG=FALSE USE_MPI=FALSE USE_OMP=FALSE ",
-                                           c_make_additions="", outfile=f"{t}.make.out")
-            if not rc == 0:
-                self.log.fail("unable to continue, tools not able to be built")
+            if reuse and test_util.get_recent_filename(self.f_compare_tool_dir, t, ".ex"):
+                self.log.log(f"reusing {t}")
+            else:
+                self.log.log(f"building {t}...")
+                comp_string, rc = self.build_c(target=f"programs={t}",
+                                               opts="DEBUG=FALSE USE_MPI=FALSE USE_OMP=FALSE ",
+                                               c_make_additions="", outfile=f"{t}.make.out")
+                if not rc == 0:
+                    self.log.fail("unable to continue, tools not able to be built")
 
             exe = test_util.get_recent_filename(self.f_compare_tool_dir, t, ".ex")
             self.tools[t] = f"{self.f_compare_tool_dir}/{exe}"
@@ -999,16 +1425,20 @@ class Suite:
                 ctools = []
             else:
                 ctools = ["particle_compare"]
-                self.make_realclean(repo="AMReX")
+                if not reuse:
+                    self.make_realclean(repo="AMReX")
         else:
             ctools = []
 
 
         for t in ctools:
-            self.log.log(f"building {t}...")
-            comp_string, rc = self.build_c(opts="DEBUG=FALSE USE_MPI=FALSE EBASE=particle_compare ")
-            if not rc == 0:
-                self.log.fail("unable to continue, tools not able to be built")
+            if reuse and test_util.get_recent_filename(self.c_compare_tool_dir, t, ".exe"):
+                self.log.log(f"reusing {t}")
+            else:
+                self.log.log(f"building {t}...")
+                comp_string, rc = self.build_c(opts="DEBUG=FALSE USE_MPI=FALSE EBASE=particle_compare ")
+                if not rc == 0:
+                    self.log.fail("unable to continue, tools not able to be built")
 
             exe = test_util.get_recent_filename(self.c_compare_tool_dir, t, ".exe")
 
@@ -1020,7 +1450,8 @@ class Suite:
 
             os.chdir(self.extra_tool_dir)
 
-            self.make_realclean(repo="AMReX")
+            if not reuse:
+                self.make_realclean(repo="AMReX")
 
             extra_tools=[]
             if ("DiffSameDomainRefined1d" in self.extra_tools): extra_tools.append("DiffSameDomainRefined1d")
@@ -1031,11 +1462,14 @@ class Suite:
                 if ("1d" in t): ndim=1
                 if ("2d" in t): ndim=2
                 if ("3d" in t): ndim=3
-                self.log.log(f"building {t}...")
-                comp_string, rc = self.build_c(opts=
-                        f"EBASE=DiffSameDomainRefined DIM={ndim} DEBUG=FALSE USE_MPI=FALSE USE_OMP=FALSE ")
-                if not rc == 0:
-                    self.log.fail("unable to continue, tools not able to be built")
+                if reuse and test_util.get_recent_filename(self.extra_tool_dir, t, ".ex"):
+                    self.log.log(f"reusing {t}")
+                else:
+                    self.log.log(f"building {t}...")
+                    comp_string, rc = self.build_c(opts=
+                            f"EBASE=DiffSameDomainRefined DIM={ndim} DEBUG=FALSE USE_MPI=FALSE USE_OMP=FALSE ")
+                    if not rc == 0:
+                        self.log.fail("unable to continue, tools not able to be built")
 
                 exe = test_util.get_recent_filename(self.extra_tool_dir, t, ".ex")
 
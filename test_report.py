@@ -1,6 +1,11 @@
+import hashlib
+import html
+import json
 import os
 
+import phase_trace
 import test_coverage as coverage
+import test_util
 
 CSS_CONTENTS = \
 r"""
@@ -63,6 +68,7 @@ td.failed {background-color: red; color: yellow; opacity: 0.8;}
 td.compfailed {background-color: purple; color: yellow; opacity: 0.8;}
 td.crashed {background-color: black; color: yellow; opacity: 0.8;}
 td.benchmade {background-color: orange; opacity: 0.8;}
+td.skipped {background-color: #cccccc; opacity: 0.8;}
 td.date {background-color: #666666; color: white; opacity: 0.8; font-weight: bold;}
 
 .maintable tr:hover {background-color: blue;}
@@ -120,8 +126,10 @@ div.verticaltext {text-align: center;
 #summary td.passed-slowly {background-color: yellow; }
 #summary td.failed {background-color: red; color: yellow;}
 #summary td.benchmade {background-color: orange;}
+.skipped {background-color: #cccccc;}
 #summary td.compfailed {background-color: purple; color: yellow;}
 #summary td.crashed {background-color: black; color: yellow;}
+#summary td.skipped {background-color: #cccccc;}
 
 div.small {font-size: 75%;}
 
@@ -191,10 +199,169 @@ r"""
   <td align=center class="crashed"><h3>Crashed</h3></td>
   <td align=center class="passed"><h3>Passed</h3></td>
   <td align=center class="passed-slowly"><h3>Performance Drop</h3></td>
+  <td align=center class="skipped"><h3>Skipped (unchanged)</h3></td>
 </CENTER>
 </TABLE>
 """
 
+DASHBOARD_HTML = \
+r"""<!DOCTYPE html>
+<HTML>
+<HEAD>
+<TITLE>@TITLE@</TITLE>
+<META charset="utf-8">
+<LINK REL="stylesheet" TYPE="text/css" HREF="tests.css">
+<style>
+#controls {text-align: center; margin: 1em;}
+#grid {height: 80vh; overflow: auto; position: relative;
+       border: 1px solid gray; box-shadow: 10px 10px 5px #888888;}
+#head {position: sticky; top: 0; z-index: 1; white-space: nowrap; background: grey;}
+#body {position: relative;}
+.row {position: absolute; left: 0; white-space: nowrap; height: 26px;}
+.cell {display: inline-block; width: 26px; height: 24px; margin: 1px;
+       text-align: center; vertical-align: top; font-weight: bold; line-height: 24px;
+       background-color: white;}
+.run {display: inline-block; width: 14em; margin: 1px; padding-left: 4px;
+      background-color: #666666; color: white; font-weight: bold; line-height: 24px;}
+#head .cell {height: @TABLEHEIGHT@; background: grey; color: yellow; line-height: normal;}
+#head .run {height: @TABLEHEIGHT@; background: grey;}
+#head div.verticaltext {margin-top: calc(@TABLEHEIGHT@ - 2em);}
+.passed {background-color: lime;}
+.passed-slowly {background-color: yellow;}
+.failed {background-color: red; color: yellow;}
+.compfailed {background-color: purple; color: yellow;}
+.crashed {background-color: black; color: yellow;}
+.benchmade {background-color: orange;}
+.cell a {color: inherit; text-decoration: none;}
+</style>
+</HEAD>
+<BODY>
+<CENTER><H1>@TITLE@</H1></CENTER>
+<CENTER><H2>@SUBTITLE@</H2></CENTER>
+<div id="controls">
+  <input id="test-filter" placeholder="tests matching...">
+  <input id="run-filter" placeholder="runs matching (date or status)...">
+  <span id="count"></span>
+</div>
+<div id="grid"><div id="head"></div><div id="body"></div></div>
+<script>
+"use strict";
+
+const ROW = 26;
+const STATUS = {P: ["passed", ":)"], S: ["passed-slowly", ":]"], C: ["compfailed", ":("],
+                X: ["crashed", "xx"], F: ["failed", "!"], U: ["benchmade", "U"],
+                K: ["skipped", "-"]};
+
+const grid = document.getElementById("grid");
+const head = document.getElementById("head");
+const body = document.getElementById("body");
+const test_filter = document.getElementById("test-filter");
+const run_filter = document.getElementById("run-filter");
+
+let index = null;
+let next_chunk = -1;
+let loading = false;
+
+// all the runs loaded so far, newest first, and the ones shown
+let runs = [];
+let columns = [];
+let rows = [];
+
+function esc(s) {
+  return s.replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})[c]);
+}
+
+async function load_chunk() {
+  if (loading || next_chunk < 0) return;
+  loading = true;
+
+  const chunk = await (await fetch(index.chunks[next_chunk].file)).json();
+  next_chunk -= 1;
+
+  for (const [name, branch, codes] of chunk.runs) {
+    const status = {};
+    chunk.tests.forEach((t, i) => { if (codes[i] !== ".") status[t] = codes[i]; });
+    runs.push({name: name, branch: branch, status: status});
+  }
+
+  loading = false;
+  update();
+}
+
+function update() {
+  const tf = test_filter.value.toLowerCase();
+  const rf = run_filter.value.toLowerCase();
+
+  columns = index.tests.filter(t => t.toLowerCase().includes(tf));
+
+  rows = runs.filter(r => {
+    if (!columns.some(t => t in r.status)) return false;
+    if (!rf || r.name.includes(rf)) return true;
+    return columns.some(t => t in r.status && STATUS[r.status[t]][0].startsWith(rf));
+  });
+
+  let h = "<span class='run'>date</span>";
+  for (const t of columns) {
+    h += `<span class='cell'><div class='verticaltext'>${esc(t)}</div></span>`;
+  }
+  head.innerHTML = h;
+
+  body.style.height = `${rows.length*ROW}px`;
+  document.getElementById("count").textContent =
+    `${rows.length} runs` + (next_chunk >= 0 ? " (scroll for more)" : "");
+
+  render();
+}
+
+function render() {
+  const first = Math.max(0, Math.floor((grid.scrollTop - head.offsetHeight)/ROW));
+  const last = Math.min(rows.length, first + Math.ceil(grid.clientHeight/ROW) + 2);
+
+  let h = "";
+  for (let i = first; i < last; i++) {
+    const r = rows[i];
+    h += `<div class='row' style='top: ${i*ROW}px'>` +
+         `<a class='run main' href='${esc(r.name)}/index.html'>${esc(r.name)}${r.branch ? " &lowast;" : ""}</a>`;
+    for (const t of columns) {
+      const code = r.status[t];
+      if (code === undefined) {
+        h += "<span class='cell'></span>";
+      } else if (code === "U" || code === "K") {
+        const [cls, text] = STATUS[code];
+        h += `<span class='cell ${cls}' title='${esc(t)}'>${text}</span>`;
+      } else {
+        const [cls, text] = STATUS[code];
+        h += `<span class='cell ${cls}' title='${esc(t)}'>` +
+             `<a href='${esc(r.name)}/${esc(t)}.html'>${text}</a></span>`;
+      }
+    }
+    h += "</div>";
+  }
+  body.innerHTML = h;
+
+  // fetch older runs when we get near the end of the loaded ones
+  if (last > rows.length - 20) load_chunk();
+}
+
+grid.addEventListener("scroll", () => requestAnimationFrame(render));
+test_filter.addEventListener("input", update);
+run_filter.addEventListener("input", update);
+
+fetch("@INDEX@").then(r => r.json()).then(data => {
+  index = data;
+  next_chunk = index.chunks.length - 1;
+  load_chunk();
+});
+</script>
+</BODY>
+</HTML>
+"""
+
+# the number of TinyProfiler regions listed on a test page, besides
+# those that got slower
+MAX_PROFILE_REGIONS = 20
+
+
 def create_css(table_height=16):
     """ write the css file for the webpages """
 
@@ -358,29 +525,27 @@ def report_single_test(suite, test, tests, failure_msg=None):
             if test.crashed:
                 compare_successful = False
 
-        # write out the status file for this problem, with either
+        # write out the status for this problem, with either
         # PASSED, PASSED SLOWLY, COMPILE FAILED, or FAILED
-        status_file = f"{test.name}.status"
-        with open(status_file, 'w') as sf:
-            if (compile_successful and
-                (test.compileTest or ((not test.compileTest) and
-                                      compare_successful and analysis_successful))):
-                string = "PASSED\n"
-                if test.check_performance:
-                    meets_threshold, _, _ = test.measure_performance()
-                    if not (meets_threshold is None or meets_threshold):
-                        string = "PASSED SLOWLY\n"
-                sf.write(string)
-                suite.log.success(f"{test.name} PASSED")
-            elif not compile_successful:
-                sf.write("COMPILE FAILED\n")
-                suite.log.testfail(f"{test.name} COMPILE FAILED")
-            elif test.crashed:
-                sf.write("CRASHED\n")
-                suite.log.testfail(f"{test.name} CRASHED (backtraces produced)")
-            else:
-                sf.write("FAILED\n")
-                suite.log.testfail(f"{test.name} FAILED")
+        if (compile_successful and
+            (test.compileTest or ((not test.compileTest) and
+                                  compare_successful and analysis_successful))):
+            string = "PASSED\n"
+            if test.check_performance:
+                meets_threshold, _, _ = test.measure_performance()
+                if not (meets_threshold is None or meets_threshold):
+                    string = "PASSED SLOWLY\n"
+            suite.record_test_status(test.name, string, test)
+            suite.log.success(f"{test.name} PASSED")
+        elif not compile_successful:
+            suite.record_test_status(test.name, "COMPILE FAILED\n", test)
+            suite.log.testfail(f"{test.name} COMPILE FAILED")
+        elif test.crashed:
+            suite.record_test_status(test.name, "CRASHED\n", test)
+            suite.log.testfail(f"{test.name} CRASHED (backtraces produced)")
+        else:
+            suite.record_test_status(test.name, "FAILED\n", test)
+            suite.log.testfail(f"{test.name} FAILED")
 
     else:
         # we came in already admitting we failed...
@@ -389,9 +554,7 @@ def report_single_test(suite, test, tests, failure_msg=None):
         else:
             msg = "FAILED"
 
-        status_file = f"{test.name}.status"
-        with open(status_file, 'w') as sf:
-            sf.write(f"{msg}\n")
+        suite.record_test_status(test.name, f"{msg}\n", test)
         suite.log.testfail(f"{test.name} {msg}")
 
 
@@ -521,6 +684,11 @@ def report_single_test(suite, test, tests, failure_msg=None):
         ll.indent()
         ll.item(f"Execution time: {test.wall_time:.3f} s")
 
+        if test.timing_median is not None:
+            ll.item("Timing repeats ({} after {} warm-up): min {:.3f} s, median {:.3f} s, stddev {:.3f} s".format(
+                test.timing_repeats, test.warmup_runs, test.timing_min, test.timing_median,
+                test.timing_stddev))
+
         if test.check_performance:
 
             meets_threshold, percentage, compare_str = test.measure_performance()
@@ -530,9 +698,37 @@ def report_single_test(suite, test, tests, failure_msg=None):
                 if meets_threshold: style = "mild-success"
                 else: style = "mild-failure"
 
-                ll.item(f"{test.runs_to_average} run average: {test.past_average:.3f} s")
+                ll.item(f"{test.runs_to_average} run median: {test.past_median:.3f} s")
                 ll.item("Relative performance: <span class=\"{}\">{:.1f}% {}</span>".format(
-                    style, percentage, compare_str))
+                    style, percentage, compare_str) +
+                        f" (robust z = {test.perf_zscore:.2f}, p = {test.perf_pvalue:.2g})")
+
+            if test.change_point is not None:
+                date, shift, p = test.change_point
+                style = "mild-failure" if shift > 0 else "mild-success"
+                ll.item("Run time changed by <span class=\"{}\">{:+.1f}%</span> from {} on (p = {:.2g})".format(
+                    style, 100*shift, date, p))
+
+        if test.resources:
+            more = {r[0]: r for r in test.resource_regressions or []}
+
+            def usage(name, value):
+                if name not in more:
+                    return value
+                return "<span class=\"mild-failure\">{} ({:+.1f}%, p = {:.2g})</span>".format(
+                    value, more[name][1], more[name][2])
+
+            res = test.resources
+            ll.item("Peak memory (largest process): " +
+                    usage("max_rss", test_util.human_size(res["max_rss"])))
+            ll.item("CPU time: {} user, {} system".format(
+                usage("user_time", f"{res['user_time']:.3f} s"),
+                usage("sys_time", f"{res['sys_time']:.3f} s")))
+            ll.item("Context switches: {} voluntary, {} involuntary".format(
+                res["vol_ctx_switches"], res["invol_ctx_switches"]))
+            ll.item("Disk I/O: {} read, {} written".format(
+                usage("read_bytes", test_util.human_size(res["read_bytes"])),
+                usage("write_bytes", test_util.human_size(res["write_bytes"]))))
 
         ll.item(f"Execution command:<br><tt>{test.run_command}</tt>")
         ll.item(f"<a href=\"{test.name}.run.out\">execution output</a>")
@@ -696,6 +892,34 @@ def report_single_test(suite, test, tests, failure_msg=None):
             hf.write("<p>number of particles differ in files</p>\n")
 
 
+    if test.profile_regions:
+        # the slowest TinyProfiler regions, and any that got slower
+        slower = {r[0]: r for r in test.region_regressions or []}
+        regions = sorted(test.profile_regions, key=lambda r: -(r[2] or 0.0))
+        regions = [r for n, r in enumerate(regions) if n < MAX_PROFILE_REGIONS or r[0] in slower]
+
+        hf.write("<P>&nbsp;\n<h3>Profiler regions</h3>\n")
+        ht = HTMLTable(hf, columns=6)
+        ht.start_table()
+        ht.header(["region", "calls", "exclusive (s)", "inclusive (s)",
+                   "past median exclusive (s)", "change"])
+
+        def fmt(t):
+            return "&nbsp;" if t is None else f"{t:.4f}"
+
+        for name, ncalls, exclusive, inclusive, past_median in regions:
+            change = "&nbsp;"
+            if exclusive is not None and past_median:
+                change = f"{100*(exclusive/past_median - 1):+.1f}%"
+            if name in slower:
+                change += f" (p = {slower[name][2]:.2g})"
+
+            # print_row formats the row, so no braces
+            name_html = html.escape(name).replace("{", "&#123;").replace("}", "&#125;")
+            ht.print_row([name_html, ncalls, fmt(exclusive), fmt(inclusive),
+                          fmt(past_median), change], highlight=name in slower)
+        ht.end_table()
+
     if (not test.compileTest) and failure_msg is None:
         # show any visualizations
         if test.doVis:
@@ -720,6 +944,60 @@ def report_single_test(suite, test, tests, failure_msg=None):
     os.chdir(current_dir)
 
 
+def report_bisection(suite, run, test_name, result):
+    """ add the result of a --bisect of a test to its page in run """
+
+    page = os.path.join(suite.webTopDir, run, f"{test_name}.html")
+
+    with open(os.path.join(suite.webTopDir, run, f"{test_name}.bisect.out"), "w") as f:
+        f.write(result)
+
+    try:
+        with open(page) as f:
+            contents = f.read()
+    except OSError:
+        suite.log.warn(f"unable to read {page}")
+        return
+
+    # replace the result of an earlier bisection
+    start = contents.find("<!--BISECT-->")
+    if start >= 0:
+        contents = contents[:start] + contents[contents.find("<!--/BISECT-->") + 14:]
+
+    section = "<!--BISECT--><h3>Bisection</h3>\n<pre>{}</pre>\n<!--/BISECT-->".format(
+        html.escape(result))
+
+    head, sep, tail = contents.rpartition("</div></body>")
+    if not sep:
+        head, tail = contents, ""
+
+    with open(page, "w") as f:
+        f.write(head + section + sep + tail)
+
+
+def report_phases(suite, phases):
+    """ write the time spent in each phase of the run, given as a list of
+        (name, count, total time) """
+
+    with open(os.path.join(suite.full_web_dir, "phases.html"), "w") as hf:
+        hf.write(HTML_HEADER.replace("@TESTDIR@", suite.suiteName)
+                 .replace("@TESTNAME@", suite.test_dir))
+        hf.write(f"<CENTER><H1><A HREF=\"index.html\">{suite.test_dir}</A> / phases</H1></CENTER>\n")
+        hf.write("<p>The full timeline is in <A HREF=\"trace.json\">trace.json</A> " +
+                 "(open it in chrome://tracing or ui.perfetto.dev).  Spans nest, so the " +
+                 "times can overlap.\n")
+
+        ht = HTMLTable(hf, columns=4)
+        ht.start_table()
+        ht.header(["phase", "count", "total time (s)", "mean time (s)"])
+        for name, count, total in phases:
+            ht.print_row([html.escape(name), count, f"{total:.3f}", f"{total/count:.3f}"])
+        ht.end_table()
+
+        hf.write("</div></body>\n")
+        hf.write("</html>\n")
+
+
 def report_this_test_run(suite, make_benchmarks, note, update_time,
                          test_list, test_file):
     """ generate the master page for a single run of the test suite """
@@ -778,6 +1056,10 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
     if wall_time > 0:
         hf.write(f"<p><b>wall clock time for all tests:</b> {wall_time} s\n")
 
+    if phase_trace.enabled():
+        hf.write("<p><b>time per phase:</b> <A HREF=\"phases.html\">phases.html</A> " +
+                 "(trace: <A HREF=\"trace.json\">trace.json</A>)\n")
+
     # git info lists
     any_update = any([suite.repos[t].update for t in suite.repos])
 
@@ -787,7 +1069,7 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
         hf.write("<ul>\n")
         code_str = "<li><b>{}</b><ul>" + \
                    "<li><b>branch:</b> {}; <b>hash:</b> {}</li>" + \
-                   "<li><b>changelog:</b> <a href=\"{}\">{}</a></li></ul></li>"
+                   "<li><b>changelog:</b> <a href=\"{}\">{}</a> ({})</li></ul></li>"
 
         for k, r in suite.repos.items():
             if r.update:
@@ -796,9 +1078,18 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
                 else:
                     branch = r.branch_wanted
 
+                # the range of commits since the last run
+                if r.changelog_range is not None:
+                    changes = "{}..{}".format(*(h[:12] for h in r.changelog_range))
+                    url = r.compare_url()
+                    if url is not None:
+                        changes = f"<a href=\"{url}\">{changes}</a>"
+                else:
+                    changes = "most recent commits"
+
                 hf.write(code_str.format(r.name, branch, r.hash_current,
                                          f"ChangeLog.{r.name}",
-                                         f"ChangeLog.{r.name}"))
+                                         f"ChangeLog.{r.name}", changes))
 
         hf.write("</ul>")
 
@@ -829,39 +1120,42 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
         ht.start_table()
         ht.header(["test name", "result", "comment"])
 
+    statuses = suite.db.test_statuses(suite.run_name)
+
     # loop over the tests and add a line for each
     for test in test_list:
 
         if make_benchmarks is None:
 
             # check if it passed or failed
-            status_file = "%s.status" % (test.name)
+            line = statuses.get(test.name, "")
 
             status = None
-            with open(status_file) as sf:
-                for line in sf:
-                    if line.find("PASSED") >= 0:
-                        status = "passed"
-                        td_class = "passed-slowly" if "SLOWLY" in line else "passed"
-                        num_passed += 1
-                    elif line.find("COMPILE FAILED") >= 0:
-                        status = "compile fail"
-                        td_class = "compfailed"
-                        num_failed += 1
-                    elif line.find("CRASHED") >= 0:
-                        status = "crashed"
-                        td_class = "crashed"
-                        num_failed += 1
-                    elif line.find("FAILED") >= 0:
-                        status = "failed"
-                        td_class = "failed"
-                        num_failed += 1
-
-                    if status is not None:
-                        break
+            if line.find("PASSED") >= 0:
+                status = "passed"
+                td_class = "passed-slowly" if "SLOWLY" in line else "passed"
+                num_passed += 1
+            elif line.find("COMPILE FAILED") >= 0:
+                status = "compile fail"
+                td_class = "compfailed"
+                num_failed += 1
+            elif line.find("CRASHED") >= 0:
+                status = "crashed"
+                td_class = "crashed"
+                num_failed += 1
+            elif line.find("FAILED") >= 0:
+                status = "failed"
+                td_class = "failed"
+                num_failed += 1
+            elif line.find("SKIPPED") >= 0:
+                status = "skipped (unchanged)"
+                td_class = "skipped"
 
             row_info = []
-            row_info.append(f"<a href=\"{test.name}.html\">{test.name}</a>")
+            if status == "skipped (unchanged)":
+                row_info.append(test.name)
+            else:
+                row_info.append(f"<a href=\"{test.name}.html\">{test.name}</a>")
             row_info.append(test.dim)
             row_info.append(f"<div class='small'>{test.compare_file_used}</div>")
 
@@ -939,16 +1233,13 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
                 continue
 
             # the benchmark was updated -- find the name of the new benchmark file
-            benchStatusFile = "%s.status" % (test.name)
+            line = statuses.get(test.name, "")
 
             bench_file = "none"
 
-            with open(benchStatusFile) as bf:
-                for line in bf:
-                    index = line.find("file:")
-                    if index >= 0:
-                        bench_file = line[index+5:]
-                        break
+            index = line.find("file:")
+            if index >= 0:
+                bench_file = line[index+5:]
 
             row_info = []
             row_info.append(f"{test.name}")
@@ -977,19 +1268,23 @@ def report_this_test_run(suite, make_benchmarks, note, update_time,
     # write out a status file for all the tests
     #--------------------------------------------------------------------------
 
-    status_file = os.path.normpath(suite.test_dir) + ".status"
-    with open(status_file, 'w') as sf:
+    if make_benchmarks is None:
+        if num_failed == 0:
+            run_status = "ALL PASSED\n"
+        elif num_failed > 0 and num_passed > 0:
+            run_status = "SOME FAILED\n"
+        else:
+            run_status = "ALL FAILED\n"
 
-        if make_benchmarks is None:
-            if num_failed == 0:
-                sf.write("ALL PASSED\n")
-            elif num_failed > 0 and num_passed > 0:
-                sf.write("SOME FAILED\n")
-            else:
-                sf.write("ALL FAILED\n")
+    else:
+        run_status = "BENCHMARKS UPDATED\n"
 
-        else:
-            sf.write("BENCHMARKS UPDATED\n")
+    status_file = suite.run_name + ".status"
+    with open(status_file, 'w') as sf:
+        sf.write(run_status)
+
+    suite.db.finish_run(suite.run_name, run_status,
+                        benchmark=make_benchmarks is not None)
 
     # switch back to the original directory
     os.chdir(current_dir)
@@ -1030,6 +1325,12 @@ def report_coverage(html_file, suite):
     ht.end_table()
 
 def report_all_runs(suite, active_test_list, max_per_page=50):
+    """ write the suite report.  The newest max_per_page runs are on
+        index.html, which is rewritten every time.  The older runs are
+        spread over index1.html, index2.html, ... counting from the oldest
+        run, so a new run only changes the newest of these pages.  The rows
+        are cached in the results database and a page is only written again
+        if what it shows changed """
 
     table_height = min(max(suite.lenTestName, 4), 18)
 
@@ -1040,132 +1341,289 @@ def report_all_runs(suite, active_test_list, max_per_page=50):
     valid_dirs, all_tests = suite.get_run_history(active_test_list)
 
     if suite.do_timings_plots:
-        suite.make_timing_plots(valid_dirs=valid_dirs, all_tests=all_tests)
+        with phase_trace.span("timing plots"):
+            suite.make_timing_plots(valid_dirs=valid_dirs, all_tests=all_tests)
 
-    # how many pages are we going to spread this over?
-    npages = int(len(valid_dirs)/max_per_page)+1
+    columns = hashlib.md5("\n".join(all_tests).encode()).hexdigest()
+    table_header = all_runs_table_header(suite, all_tests)
 
-    for n in range(npages):
+    older = valid_dirs[max_per_page:][::-1]
+    pages = [older[i:i+max_per_page][::-1] for i in range(0, len(older), max_per_page)]
 
-        #--------------------------------------------------------------------------
-        # generate the HTML
-        #--------------------------------------------------------------------------
-        title = "%s regression tests" % (suite.suiteName)
+    for n, page_dirs in enumerate(pages, start=1):
 
-        if n == 0:
-            hf = open("index.html", "w")
-        else:
-            hf = open(f"index{n}.html", "w")
+        page = f"index{n}.html"
+        older_page = f"index{n-1}.html" if n > 1 else None
 
+        # the header of the page counts too
+        key = "\n".join([columns, table_header, str(older_page), suite.suiteName,
+                         suite.sub_title, str(suite.goUpLink)] + page_dirs)
+        digest = hashlib.md5(key.encode()).hexdigest()
 
-        lvalid_dirs = valid_dirs[n*max_per_page:min((n+1)*max_per_page, len(valid_dirs))]
+        if os.path.isfile(page) and suite.db.report_page_digest(page) == digest:
+            continue
 
-        header = MAIN_HEADER.replace("@TITLE@", title).replace("@SUBTITLE@", suite.sub_title)
+        write_all_runs_page(suite, page, table_header, all_tests, columns,
+                            page_dirs, older_page)
+        suite.db.set_report_page(page, digest, page_dirs[-1], page_dirs[0])
 
-        if suite.goUpLink:
-            header2 = header.replace("<!--GOUPLINK-->", '<a href="../">GO UP</a>')
-            hf.write(header2)
-        else:
-            hf.write(header)
+    write_all_runs_page(suite, "index.html", table_header, all_tests, columns,
+                        valid_dirs[:max_per_page],
+                        f"index{len(pages)}.html" if pages else None)
 
-        hf.write("<P><TABLE class='maintable'>\n")
+    write_status_export(suite, valid_dirs, all_tests, table_height)
 
-        # write out the header
-        hf.write("<TR><TH ALIGN=CENTER>date</TH>\n")
-        for test in all_tests:
-            hf.write("<TH><div class='verticaltext'>%s</div></TH>\n" % (test))
+    # remove the pages left over from a longer history
+    n = len(pages) + 1
+    while os.path.isfile(f"index{n}.html"):
+        os.remove(f"index{n}.html")
+        suite.db.delete_report_page(f"index{n}.html")
+        n += 1
 
-        hf.write("</TR>\n")
 
-        if suite.do_timings_plots:
-            hf.write("<tr><td class='date'>plots</td>")
-            for t in all_tests:
-                plot_file = f"{t}-timings.{suite.plot_ext}"
-                if os.path.isfile(plot_file):
-                    hf.write(f"<TD ALIGN=CENTER title=\"{t} timings plot\"><H3><a href=\"{plot_file}\"><i class=\"fa fa-line-chart\"></i></a></H3></TD>\n")
-                else:
-                    hf.write("<TD ALIGN=CENTER><H3>&nbsp;</H3></TD>\n")
+def all_runs_table_header(suite, all_tests):
+    """ the header rows of the suite report table """
 
-            hf.write("</TR>\n")
+    header = ["<TR><TH ALIGN=CENTER>date</TH>\n"]
+    for test in all_tests:
+        header.append("<TH><div class='verticaltext'>%s</div></TH>\n" % (test))
+
+    header.append("</TR>\n")
 
-        # loop over all the test runs
-        for tdir in lvalid_dirs:
-
-            # first look to see if there are any valid tests at all --
-            # otherwise we don't do anything for this date
-            valid = 0
-            for test in all_tests:
-                status_file = f"{suite.webTopDir}/{tdir}/{test}.status"
-                if os.path.isfile(status_file):
-                    valid = 1
-                    break
-
-            if not valid: continue
-
-            # did we run on a non-default branch?
-            try:
-                bf = open(f"{suite.webTopDir}/{tdir}/branch.status")
-            except:
-                branch_mark = ""
+    if suite.do_timings_plots:
+        header.append("<tr><td class='date'>plots</td>")
+        for t in all_tests:
+            plot_file = f"{t}-timings.{suite.plot_ext}"
+            if os.path.isfile(plot_file):
+                header.append(f"<TD ALIGN=CENTER title=\"{t} timings plot\"><H3><a href=\"{plot_file}\"><i class=\"fa fa-line-chart\"></i></a></H3></TD>\n")
             else:
-                branch_mark = r"&lowast;"
-                bf.close()
+                header.append("<TD ALIGN=CENTER><H3>&nbsp;</H3></TD>\n")
+
+        header.append("</TR>\n")
+
+    return "".join(header)
+
 
-            # write out the directory (date)
-            hf.write(f"<TR><TD class='date'><SPAN CLASS='nobreak'><A class='main' HREF=\"{tdir}/index.html\">{tdir}&nbsp;</A>{branch_mark}</SPAN></TD>\n")
+def write_all_runs_page(suite, page, table_header, all_tests, columns,
+                        run_dirs, older_page):
+    """ write a page of the suite report showing the runs in run_dirs,
+        linking to older_page if there is one """
 
-            for test in all_tests:
+    title = "%s regression tests" % (suite.suiteName)
 
-                # look to see if the current test was part of this suite run
-                status_file = f"{suite.webTopDir}/{tdir}/{test}.status"
+    cached = suite.db.report_rows(run_dirs, columns)
 
-                status = None
+    hf = open(page, "w")
 
-                if os.path.isfile(status_file):
+    header = MAIN_HEADER.replace("@TITLE@", title).replace("@SUBTITLE@", suite.sub_title)
 
-                    with open(status_file) as sf:
+    if suite.goUpLink:
+        header2 = header.replace("<!--GOUPLINK-->", '<a href="../">GO UP</a>')
+        hf.write(header2)
+    else:
+        hf.write(header)
+
+    hf.write("<P><TABLE class='maintable'>\n")
+
+    hf.write(table_header)
+
+    # loop over all the test runs
+    for tdir in run_dirs:
+
+        row = cached.get(tdir)
+        if row is None:
+            row = all_runs_table_row(suite, tdir, all_tests)
+            suite.db.store_report_row(tdir, columns, row)
 
-                        for line in sf:
-                            if line.find("PASSED") >= 0:
-                                if "SLOWLY" not in line: status, emoji = "passed", ":)"
-                                else: status, emoji = "passed-slowly", ":]"
-                            elif line.find("COMPILE FAILED") >= 0:
-                                status = "compfailed"
-                                emoji = ":("
-                            elif line.find("CRASHED") >= 0:
-                                status = "crashed"
-                                emoji = "xx"
-                            elif line.find("FAILED") >= 0:
-                                status = "failed"
-                                emoji = "!&nbsp;"
-                            elif line.find("benchmarks updated") >= 0:
-                                status = "benchmade"
-                                emoji = "U"
+        hf.write(row)
 
-                            if status is not None:
-                                break
+    hf.write("</TABLE>\n")
+
+    if older_page is not None:
+        hf.write(f"<p><a href=\"{older_page}\">older tests</a>")
+
+    hf.write("<p><a href=\"dashboard.html\">all runs (dashboard)</a>")
+
+    # close
+    hf.write("</BODY>\n")
+    hf.write("</HTML>\n")
+
+    hf.close()
+
+
+def report_batch(suite, runs):
+    """ write a page comparing the runs of a --batch, given as a list of
+        (variant, run name): a row per test and a column per variant.
+        Returns the name of the page """
+
+    os.chdir(suite.webTopDir)
+
+    statuses = suite.db.all_test_statuses([run for _, run in runs])
+    all_tests = sorted({t for run_statuses in statuses.values() for t in run_statuses})
+
+    title = "%s regression tests" % (suite.suiteName)
+    page = f"batch-{runs[0][1]}.html"
+
+    with open(page, "w") as hf:
+        hf.write(MAIN_HEADER.replace("@TITLE@", title)
+                 .replace("@SUBTITLE@", f"batch of {len(runs)} variants, based on {runs[0][0]}"))
+
+        hf.write("<P><TABLE class='maintable'>\n")
+        hf.write("<TR><TH ALIGN=CENTER>test</TH>\n")
+        for variant, run in runs:
+            hf.write(f"<TH><A class='main' HREF=\"{run}/index.html\">{variant}</A></TH>\n")
+        hf.write("</TR>\n")
+
+        for test in all_tests:
+            hf.write(f"<TR><TD class='date'>{test}</TD>\n")
+
+            for variant, run in runs:
+                status, emoji = None, None
+                if test in statuses.get(run, {}):
+                    status, emoji = STATUS_CLASSES.get(status_code(statuses[run][test]),
+                                                       (None, None))
 
-                # write out this test's status
                 if status is None:
                     hf.write("<td>&nbsp;</td>\n")
-                elif status == "benchmade":
-                    hf.write("<td align=center title=\"{}\" class=\"{}\"><h3>U</h3></td>\n".format(
-                        test, status))
+                elif status == "skipped":
+                    hf.write(f"<td align=center title=\"unchanged from {runs[0][0]}\" " +
+                             f"class=\"skipped\"><h3>{emoji}</h3></td>\n")
                 else:
-                    hf.write("<td align=center title=\"{}\" class=\"{}\"><h3><a href=\"{}/{}.html\" class=\"{}\">{}</a></h3></td>\n".format(
-                        test, status, tdir, test, status, emoji))
+                    hf.write(f"<td align=center title=\"{test}\" class=\"{status}\"><h3>" +
+                             f"<a href=\"{run}/{test}.html\" class=\"{status}\">{emoji}</a></h3></td>\n")
 
+            hf.write("</TR>\n")
 
+        hf.write("</TABLE>\n")
+        hf.write("</BODY>\n")
+        hf.write("</HTML>\n")
 
-            hf.write("</TR>\n\n")
+    return page
 
-        hf.write("</TABLE>\n")
 
-        if n != npages-1:
-            hf.write(f"<p><a href=\"index{n+1}.html\">older tests</a>")
+# the one-letter codes of the test statuses in the status export, with
+# the CSS class and symbol of each
+STATUS_CLASSES = {"P": ("passed", ":)"),
+                  "S": ("passed-slowly", ":]"),
+                  "C": ("compfailed", ":("),
+                  "X": ("crashed", "xx"),
+                  "F": ("failed", "!&nbsp;"),
+                  "U": ("benchmade", "U"),
+                  "K": ("skipped", "-")}
 
-        # close
-        hf.write("</BODY>\n")
-        hf.write("</HTML>\n")
+def status_code(line):
+    """ the one-letter code for a test status line, "." if it is not one
+        we know """
+
+    if line.find("PASSED") >= 0:
+        if "SLOWLY" not in line: return "P"
+        else: return "S"
+    elif line.find("COMPILE FAILED") >= 0:
+        return "C"
+    elif line.find("CRASHED") >= 0:
+        return "X"
+    elif line.find("FAILED") >= 0:
+        return "F"
+    elif line.find("benchmarks updated") >= 0:
+        return "U"
+    elif line.find("SKIPPED") >= 0:
+        return "K"
+
+    return "."
+
+
+def write_status_export(suite, valid_dirs, all_tests, table_height, max_per_chunk=500):
+    """ write the status of every test in every run as JSON, for the
+        dashboard.html viewer.  status/index.json lists the tests and the
+        chunks of runs; the chunks are counted from the oldest run, so only
+        the newest one changes when a run is added, and a chunk is only
+        written again if one of its runs changed """
+
+    os.makedirs("status", exist_ok=True)
+
+    chronological = valid_dirs[::-1]
+    chunks = []
+
+    for i in range(0, len(chronological), max_per_chunk):
+
+        run_dirs = chronological[i:i+max_per_chunk][::-1]
+        chunk = f"status/chunk{len(chunks)+1}.json"
+        chunks.append({"file": chunk, "first": run_dirs[-1], "last": run_dirs[0]})
+
+        digest = hashlib.md5("\n".join(run_dirs).encode()).hexdigest()
+        if os.path.isfile(chunk) and suite.db.report_page_digest(chunk) == digest:
+            continue
+
+        statuses = suite.db.all_test_statuses(run_dirs)
+        tests = suite.db.test_names(run_dirs)
+        pos = {t: n for n, t in enumerate(tests)}
+
+        runs = []
+        for tdir in run_dirs:
+            codes = ["."]*len(tests)
+            for test, line in statuses.get(tdir, {}).items():
+                codes[pos[test]] = status_code(line)
+            runs.append([tdir, suite.db.run_info(tdir)[2], "".join(codes)])
+
+        with open(chunk, "w") as f:
+            json.dump({"tests": tests, "runs": runs}, f, separators=(",", ":"))
+
+        suite.db.set_report_page(chunk, digest, run_dirs[-1], run_dirs[0])
+
+    # remove the chunks left over from a longer history
+    n = len(chunks) + 1
+    while os.path.isfile(f"status/chunk{n}.json"):
+        os.remove(f"status/chunk{n}.json")
+        suite.db.delete_report_page(f"status/chunk{n}.json")
+        n += 1
+
+    with open("status/index.json", "w") as f:
+        json.dump({"suite": suite.suiteName, "tests": all_tests, "chunks": chunks}, f,
+                  separators=(",", ":"))
+
+    title = "%s regression tests" % (suite.suiteName)
+    with open("dashboard.html", "w") as f:
+        f.write(DASHBOARD_HTML.replace("@TITLE@", title).replace("@SUBTITLE@", suite.sub_title)
+                .replace("@TABLEHEIGHT@", f"{table_height}em")
+                .replace("@INDEX@", "status/index.json"))
+
+
+def all_runs_table_row(suite, tdir, all_tests):
+    """ the row of the suite report table for the run in tdir """
+
+    statuses = suite.db.test_statuses(tdir)
+
+    # first look to see if there are any valid tests at all --
+    # otherwise we don't do anything for this date
+    if not any(test in statuses for test in all_tests): return ""
+
+    # did we run on a non-default branch?
+    if suite.db.run_info(tdir)[2]:
+        branch_mark = r"&lowast;"
+    else:
+        branch_mark = ""
+
+    # write out the directory (date)
+    row = [f"<TR><TD class='date'><SPAN CLASS='nobreak'><A class='main' HREF=\"{tdir}/index.html\">{tdir}&nbsp;</A>{branch_mark}</SPAN></TD>\n"]
+
+    for test in all_tests:
+
+        # look to see if the current test was part of this suite run
+        status, emoji = None, None
+
+        if test in statuses:
+            status, emoji = STATUS_CLASSES.get(status_code(statuses[test]), (None, None))
+
+        # write out this test's status
+        if status is None:
+            row.append("<td>&nbsp;</td>\n")
+        elif status in ["benchmade", "skipped"]:
+            row.append("<td align=center title=\"{}\" class=\"{}\"><h3>{}</h3></td>\n".format(
+                test, status, emoji))
+        else:
+            row.append("<td align=center title=\"{}\" class=\"{}\"><h3><a href=\"{}/{}.html\" class=\"{}\">{}</a></h3></td>\n".format(
+                test, status, tdir, test, status, emoji))
+
+    row.append("</TR>\n\n")
 
-        hf.close()
+    return "".join(row)
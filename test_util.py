@@ -1,8 +1,12 @@
 import argparse
+import asyncio
+import errno
 import os
 import shlex
+import shutil
 import subprocess
 import sys
+import tempfile
 import email
 import smtplib
 
@@ -16,8 +20,9 @@ The "main" block specifies the global test suite parameters:
 
   testTopDir     = < full path to test output directory >
   webTopDir      = < full path to test web output directory >
-  wallclockFile  = < name of json file for storing past runtimes, to which .json will be appended;
-                     set to wallclock_history by default >
+  wallclockFile  = < name of the directory in the benchmark directory storing past runtimes;
+                     set to wallclock_history by default.  If it does not exist, it is
+                     imported from the legacy wallclockFile.json or the test web pages >
 
   useCmake       = < 0: GNU Make handles the build (default)
                      1: CMake handles the build >
@@ -38,6 +43,27 @@ The "main" block specifies the global test suite parameters:
   purge_output = <0: leave all plotfiles in place;
                   1: delete plotfiles after compare >
 
+  web_staging = < how output files are placed into the web directory:
+                  copy: plain copies (default);
+                  link: hardlinks, falling back to a copy across filesystems
+                        or when the output is not already world readable;
+                  reflink: copy-on-write clones, falling back to a copy >
+
+  use_worktrees = < 1: test each repo in a git worktree of its own under
+                    {testTopDir}/{suiteName}-worktrees/, one per PR, branch or
+                    hash, kept between runs so their builds are incremental.
+                    The repos themselves are only fetched into.  0: check out
+                    in the repos and switch back afterwards (default) >
+
+  git_cache_dir = < directory of bare mirrors of the repos' remotes, shared
+                    by the suites on this host.  The repos borrow their
+                    objects, so each fetch only downloads what the mirror
+                    does not have yet.  The mirrors must never be pruned >
+
+  ignore_paths = < space-separated globs of files whose changes never make a
+                   test run with --changed_only (e.g. *.md Docs/*).  Prefix a
+                   glob with "repo:" (e.g. AMReX:Docs/*) to limit it to one repo >
+
   MAKE = < name of make >
   numMakeJobs = < number of make jobs >
 
@@ -71,6 +97,17 @@ The general form is:
 
   branch = < desired branch in the git repo >
 
+  url = < where to clone the repo from, if dir does not exist yet >
+
+  depth = < N > 0: only fetch the N most recent commits (a shallow clone).
+            This applies when dir is cloned from url, and to fetches into
+            a clone that is already shallow -- a full clone stays full.
+            --changed_only and the ChangeLog fall back to all tests and the
+            most recent commits when the previous run is not in them >
+
+  filter = < partial clone filter for fetches, e.g. blob:none to download
+             file contents only as they are checked out >
+
   build = < 1: this is a directory that tests will be compiled in >
 
   cmakeSetupOpts = < Options for CMake Setup (used only if useCmake=1) >
@@ -145,6 +182,19 @@ Each test is given its own block, with the general form:
   outputFile = < explicit output file to compare with -- exactly as it will
                  be written.  No prefix of the test name will be done >
 
+  thin_output = < N > 0: after the comparison, keep only every Nth plotfile,
+                  the compare file and the restart checkpoint, and delete
+                  the other plot/checkpoint files before archiving.  This
+                  takes precedence over the suite-wide purge_output >
+
+  watch_paths = < space-separated globs, relative to the repo the test is
+                  built in, of files that the test depends on outside its
+                  build directory (e.g. Source/hydro/*).  Prefix a glob with
+                  "repo:" (e.g. AMReX:Src/Particle/*) to refer to another repo.
+                  With --changed_only, a test is run if any of these files,
+                  its build directory or its input files changed.  Changes
+                  no test watches make all the tests run >
+
   diffDir = < directory/file to do a plain text diff on (recursive, if dir) >
 
   diffOpts = < options to use with the diff command for the diffDir comparison >
@@ -153,8 +203,36 @@ Each test is given its own block, with the general form:
   performance_threshold = < ratio of run time / running average above which a
                             a performance warning will be issued, default is
                             1.2 >
+  resource_threshold = < the same for the peak memory, CPU time and disk I/O
+                         of the run (see below), default is 1.2 >
   runs_to_average = < number of past runs to include when computing the average,
                       default is 5 >
+  timing_repeats = < N > 0: after the run that is checked, run the test N more
+                     times just to time it, and record the min, median and
+                     standard deviation of these in the timing history.  The
+                     performance checks then use the median.  Not done for
+                     restart tests >
+  warmup_runs = < number of untimed runs before the timing repeats, default 0 >
+  performance_significance = < a run is only flagged as slower if it is over
+                               performance_threshold times the median of the
+                               past runs and the chance of noise making it
+                               that slow, judged from their median absolute
+                               deviation, is below this.  Default is 0.01 >
+  change_point_detection = < 1: also look for a lasting shift in the run time
+                             over the whole timing history, with a rank-based
+                             permutation test at performance_significance.
+                             A shift is reported on the run it is first found
+                             in, and only a slowdown is a warning >
+  (the resources used by each run -- peak RSS of the largest process,
+   user and system CPU time, context switches and disk I/O -- are kept in
+   the timing history and shown on the test page.  With check_performance,
+   the memory, CPU time and I/O are also compared with the past runs like
+   the run time is, with resource_threshold in place of
+   performance_threshold)
+  (if the test prints AMReX TinyProfiler tables, the exclusive and inclusive
+   time of each region is stored in the results database and shown on the
+   test page.  With check_performance, the regions taking at least 1% of the
+   run are also compared with their past runs like the run time is)
 
 Getting started:
 
@@ -328,6 +406,13 @@ def get_args(arg_string=None):
                            help="what github pull request number to use for the source repo")
     git_group.add_argument("--amrex_pr", type=int, default=None, metavar="PR-number",
                            help="what github pull request number to use for the amrex repo")
+    git_group.add_argument("--batch", type=str, default=None, metavar="'variant1 variant2 ...'",
+                           help="run the suite once for each variant: a source PR number, amrex:N " +
+                           "for AMReX PR N, or a source branch.  The runs share the tool builds, " +
+                           "the test builds (only the first variant does a make realclean) and " +
+                           "the versions of the repos the variants do not change, and with " +
+                           "--changed_only the variants after the first only run the tests " +
+                           "their changes affect.  A batch report compares the variants")
 
     bench_group = parser.add_argument_group("benchmark options",
                                             "options that control benchmark creation")
@@ -362,6 +447,20 @@ def get_args(arg_string=None):
                                help="a note on the resulting test webpages")
     suite_options.add_argument("--complete_report_from_crash", type=str, default="", metavar="testdir",
                                help="complete report generation from a crashed test suite run named testdir")
+    suite_options.add_argument("--changed_only", action="store_true",
+                               help="only run the tests affected by the changes to the repos since " +
+                               "the last run they passed in -- the others are marked as skipped")
+    suite_options.add_argument("--resume", type=str, default="", metavar="testdir",
+                               help="continue the interrupted test suite run named testdir, " +
+                               "skipping the tests it completed and reusing its builds")
+    suite_options.add_argument("--bisect", type=str, default=None, metavar="test-name",
+                               help="git bisect the repos between the last run test-name passed in and " +
+                               "its last run, where it failed or ran slowly, running just that test at " +
+                               "each step, and report the culprit commit on its test page")
+    suite_options.add_argument("--trace", action="store_true",
+                               help="time the phases of the run (updates, builds, runs, comparisons, " +
+                               "reports) and write them as trace.json (Chrome trace format) and " +
+                               "phases.html in the web directory of the run")
     suite_options.add_argument("--log_file", type=str, default=None, metavar="logfile",
                                help="log file to write output to (in addition to stdout")
 
@@ -384,58 +483,340 @@ def get_args(arg_string=None):
     return args
 
 
+# how much of a command's output run() reads back from its outfile/errfile
+CAPTURE_LIMIT = 4*1024*1024
+
+
+class _OutputFiles:
+    """ the outfile/errfile of a command, opened for the child to write
+        into directly.  Without an errfile, stderr goes to a temporary file
+        and is appended to outfile once the command is done, so it is not
+        mixed into the stdout we return """
+
+    def __init__(self, string, outfile, outfile_mode="a", errfile=None,
+                 store_command=False, log=None):
+
+        self.outfile = outfile
+        self.errfile = errfile
+
+        try: self.of = open(outfile, outfile_mode + "b")
+        except OSError:
+            log.fail("  ERROR: unable to open file for writing")
+
+        if store_command:
+            self.of.write(string.encode() + b"\n")
+            self.of.flush()
+        self.out_start = self.of.tell()
+
+        if errfile is None:
+            self.ef = tempfile.TemporaryFile()
+        else:
+            self.err_existed = os.path.isfile(errfile)
+            try: self.ef = open(errfile, outfile_mode + "b")
+            except OSError:
+                self.of.close()
+                log.fail("  ERROR: unable to open file for writing")
+        self.err_start = self.ef.tell()
+
+    @property
+    def stdout(self):
+        return self.of
+
+    @property
+    def stderr(self):
+        return self.ef
+
+    def close(self, capture_limit=CAPTURE_LIMIT):
+        """ close the files and return the tail of what the command wrote """
+
+        self.of.close()
+        stdout0 = read_tail(self.outfile, self.out_start, capture_limit)
+
+        if self.errfile is None:
+            stderr0 = _read_tail(self.ef, 0, capture_limit)
+            self.ef.seek(0)
+            with open(self.outfile, "ab") as f:
+                shutil.copyfileobj(self.ef, f)
+            self.ef.close()
+            return stdout0, stderr0
+
+        self.ef.close()
+        stderr0 = read_tail(self.errfile, self.err_start, capture_limit)
+
+        # only leave an errfile behind if something was written to it
+        if not self.err_existed and os.path.getsize(self.errfile) == 0:
+            os.remove(self.errfile)
+
+        return stdout0, stderr0
+
+
+def _write_errfile(stderr0, errfile, outfile_mode, log):
+    """ store captured stderr in errfile, if there is any """
+
+    if stderr0.strip() == "":
+        return
+
+    try: cf = open(errfile, outfile_mode)
+    except OSError:
+        log.fail("  ERROR: unable to open file for writing")
+    else:
+        cf.write(stderr0)
+        cf.close()
+
+
 def run(string, stdin=False, outfile=None, store_command=False, env=None,
-        outfile_mode="a", errfile=None, log=None, cwd=None):
+        outfile_mode="a", errfile=None, log=None, cwd=None,
+        capture_limit=CAPTURE_LIMIT, rusage=None):
+    """ run the command string, returning its stdout, stderr, and return
+        code.  Without an outfile, the output is captured in memory.  With
+        an outfile, the child writes directly to it (and its stderr to
+        errfile if given, otherwise to outfile after its stdout), and only
+        the last capture_limit bytes of each are read back and returned.
+        In that case, if rusage is a dictionary, the resources used by the
+        command and its descendants are stored in it (see
+        resource_usage) """
 
     # shlex.split will preserve inner quotes
     prog = shlex.split(string)
     sin = None
     if stdin: sin = subprocess.PIPE
 
-    p0 = subprocess.Popen(prog, stdin=sin, stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE, env=env, cwd=cwd)
+    if outfile is None:
+
+        p0 = subprocess.Popen(prog, stdin=sin, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, env=env, cwd=cwd)
+
+        stdout0, stderr0 = p0.communicate()
+        rc = p0.returncode
+        p0.stdout.close()
+        p0.stderr.close()
 
-    stdout0, stderr0 = p0.communicate()
+        stdout0 = stdout0.decode('utf-8', errors="replace")
+        stderr0 = stderr0.decode('utf-8', errors="replace")
+
+        if errfile is not None:
+            _write_errfile(stderr0, errfile, outfile_mode, log)
+
+        return stdout0, stderr0, rc
+
+    files = _OutputFiles(string, outfile, outfile_mode, errfile,
+                         store_command, log)
+
+    p0 = subprocess.Popen(prog, stdin=sin, stdout=files.stdout,
+                          stderr=files.stderr, env=env, cwd=cwd)
     if stdin: p0.stdin.close()
+
+    if rusage is None:
+        rc = p0.wait()
+    else:
+        # reap the child ourselves to get its resource usage
+        _, status, ru = os.wait4(p0.pid, 0)
+        rc = p0.returncode = os.waitstatus_to_exitcode(status)
+        rusage.update(resource_usage(ru))
+
+    stdout0, stderr0 = files.close(capture_limit)
+
+    return stdout0, stderr0, rc
+
+
+async def run_async(string, stdin=False, outfile=None, store_command=False,
+                    env=None, outfile_mode="a", errfile=None, log=None,
+                    cwd=None, capture_limit=CAPTURE_LIMIT, timeout=None):
+    """ asyncio version of run(), with the same arguments and return
+        values.  If the command does not finish within timeout seconds, or
+        the task awaiting it is cancelled, the command is killed -- a
+        timeout shows up as a negative return code """
+
+    prog = shlex.split(string)
+    sin = None
+    if stdin: sin = asyncio.subprocess.PIPE
+
+    files = None
+    if outfile is None:
+        sout = asyncio.subprocess.PIPE
+        serr = asyncio.subprocess.PIPE
+    else:
+        files = _OutputFiles(string, outfile, outfile_mode, errfile,
+                             store_command, log)
+        sout = files.stdout
+        serr = files.stderr
+
+    try:
+        p0 = await asyncio.create_subprocess_exec(*prog, stdin=sin,
+                                                  stdout=sout, stderr=serr,
+                                                  env=env, cwd=cwd)
+    except OSError:
+        if files is not None: files.close(0)
+        raise
+
+    try:
+        try:
+            stdout0, stderr0 = await asyncio.wait_for(p0.communicate(),
+                                                      timeout)
+        except asyncio.TimeoutError:
+            # what was read is lost with the cancelled communicate()
+            p0.kill()
+            await p0.wait()
+            stdout0, stderr0 = b"", b""
+    except asyncio.CancelledError:
+        p0.kill()
+        await p0.wait()
+        if files is not None: files.close(0)
+        raise
+
     rc = p0.returncode
-    p0.stdout.close()
-    p0.stderr.close()
 
-    stdout0 = stdout0.decode('utf-8')
-    stderr0 = stderr0.decode('utf-8')
+    if files is not None:
+        stdout0, stderr0 = files.close(capture_limit)
+        return stdout0, stderr0, rc
+
+    stdout0 = stdout0.decode('utf-8', errors="replace")
+    stderr0 = stderr0.decode('utf-8', errors="replace")
+
+    if errfile is not None:
+        _write_errfile(stderr0, errfile, outfile_mode, log)
+
+    return stdout0, stderr0, rc
+
+
+def resource_usage(ru):
+    """ the quantities we keep from a resource.struct_rusage.  The peak
+        RSS is that of the largest process, and the I/O only counts what
+        went to or from the disks, not the page cache """
+
+    # ru_maxrss is in kB on Linux
+    return {"max_rss": ru.ru_maxrss * 1024,
+            "user_time": ru.ru_utime,
+            "sys_time": ru.ru_stime,
+            "vol_ctx_switches": ru.ru_nvcsw,
+            "invol_ctx_switches": ru.ru_nivcsw,
+            "read_bytes": ru.ru_inblock * 512,
+            "write_bytes": ru.ru_oublock * 512}
+
+
+def human_size(nbytes):
+    for unit in ["B", "kB", "MB", "GB"]:
+        if abs(nbytes) < 1024.0:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024.0
+    return f"{nbytes:.1f} TB"
+
+
+def run_concurrent(commands, max_jobs=None):
+    """ run several commands at once.  commands is a list of dictionaries
+        of run_async() keyword arguments (at least "string"), and we return
+        the list of their (stdout, stderr, return code) tuples, in order.
+        At most max_jobs of them are in flight at any time """
+
+    async def run_all():
+        limit = asyncio.Semaphore(max_jobs or len(commands) or 1)
+
+        async def run_one(kwargs):
+            async with limit:
+                return await run_async(**kwargs)
+
+        return await asyncio.gather(*[run_one(c) for c in commands])
+
+    return asyncio.run(run_all())
+
 
-    if outfile is not None:
-        try: cf = open(outfile, outfile_mode)
+def read_tail(filename, start=0, limit=CAPTURE_LIMIT):
+    """ return (at most) the last limit bytes of filename past offset
+        start, decoded as text """
+
+    if limit <= 0:
+        return ""
+
+    try:
+        with open(filename, "rb") as f:
+            return _read_tail(f, start, limit)
+    except OSError:
+        return ""
+
+
+def _read_tail(f, start, limit):
+    """ read_tail() for the open binary file f """
+
+    if limit <= 0:
+        return ""
+
+    end = f.seek(0, os.SEEK_END)
+    f.seek(max(start, end - limit))
+    return f.read().decode('utf-8', errors="replace")
+
+
+# Linux ioctl request number for a copy-on-write clone of a whole file
+FICLONE = 0x40049409
+
+STAGING_MODES = ["copy", "link", "reflink"]
+
+COPY_BUFSIZE = 1024*1024
+
+
+def _copy_file(src, dst, perm):
+    """ copy src to dst, creating dst with permissions perm """
+
+    with open(src, "rb") as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, perm)
+        os.fchmod(fd, perm)
+        with open(fd, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+
+
+def _reflink_file(src, dst, perm):
+    """ clone src to dst without copying the data, raising OSError if the
+        filesystem does not support it """
+
+    import fcntl
+
+    with open(src, "rb") as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, perm)
+        try:
+            os.fchmod(fd, perm)
+            fcntl.ioctl(fd, FICLONE, fsrc.fileno())
         except OSError:
-            log.fail("  ERROR: unable to open file for writing")
+            os.close(fd)
+            os.remove(dst)
+            raise
+        os.close(fd)
+
+
+def stage_file(src, dst, mode="copy", perm=0o644):
+    """ place the file src at dst (a file name or a directory), giving it
+        permissions perm.  mode is one of STAGING_MODES -- hardlinks and
+        reflinks fall back to a plain copy when they are not possible,
+        e.g. when src and dst are on different filesystems """
+
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+
+    # a hardlink cannot replace an existing file, and a copy must not
+    # write through an old hardlink into the original output
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    # a hardlink shares its mode with src, so link only when src already
+    # has the permissions perm asks for -- it is left as it is
+    if mode == "link" and os.stat(src).st_mode & perm == perm:
+        try:
+            os.link(src, dst)
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                 errno.ENOTSUP):
+                raise
         else:
-            if store_command:
-                cf.write(string)
-                cf.write('\n')
-            for line in stdout0:
-                cf.write(line)
-
-            if errfile is None:
-                for line in stderr0:
-                    cf.write(line)
-
-            cf.close()
-
-    if errfile is not None and stderr0 is not None:
-        write_err = True
-        if isinstance(stderr0, str):
-            if stderr0.strip() == "":
-                write_err = False
-        if write_err:
-            try: cf = open(errfile, outfile_mode)
-            except OSError:
-                log.fail("  ERROR: unable to open file for writing")
-            else:
-                for line in stderr0:
-                    cf.write(line)
-                cf.close()
+            return dst
 
-    return stdout0, stderr0, rc
+    elif mode == "reflink":
+        try:
+            _reflink_file(src, dst, perm)
+        except (OSError, ImportError):
+            pass
+        else:
+            return dst
+
+    _copy_file(src, dst, perm)
+    return dst
 
 
 def get_recent_filename(fdir, base, extension):
@@ -0,0 +1,45 @@
+"""Tests of the statistics behind the performance checks.  Run with
+
+  python -m unittest discover tests
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import perf_stats
+
+
+class TestChangePoint(unittest.TestCase):
+
+    def test_ties_share_ranks(self):
+        self.assertEqual(perf_stats.ranks([3.0, 1.0, 3.0, 2.0, 1.0]),
+                         [4.5, 1.5, 4.5, 3.0, 1.5])
+
+    def test_flat_series(self):
+        self.assertIsNone(perf_stats.change_point([1.0]*20))
+
+    def test_tie_heavy_series(self):
+        # run times quantized to two values, with no shift in their mix
+        rng = random.Random(1)
+        series = [rng.choice([1.0, 1.1]) for _ in range(60)]
+
+        result = perf_stats.change_point(series)
+        self.assertTrue(result is None or result[2] >= 0.01)
+
+    def test_shift(self):
+        rng = random.Random(2)
+        series = ([10.0 + rng.gauss(0, 0.1) for _ in range(20)] +
+                  [12.0 + rng.gauss(0, 0.1) for _ in range(10)])
+
+        index, shift, p = perf_stats.change_point(series)
+        self.assertEqual(index, 20)
+        self.assertAlmostEqual(shift, 0.2, delta=0.02)
+        self.assertLess(p, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""This module stores the timing history of each test as an append-only,
+columnar time series: a text file with the run names (dates) and one
+binary file of doubles per measured quantity.  Loading the history is
+then a handful of bulk reads per test, no matter how many runs there are.
+
+Run as a script with a suite's input file, it imports the legacy history
+(the wallclock JSON file, or else the test HTML pages) into the store."""
+
+import array
+import math
+import os
+import sys
+
+# the quantities stored for every recorded run: the wall time of the run
+# that was checked, the statistics of the timing repeats, if any, and the
+# resources the run used
+COLUMNS = ["runtimes", "timing_min", "timing_median", "timing_stddev",
+           "max_rss", "user_time", "sys_time", "vol_ctx_switches",
+           "invol_ctx_switches", "read_bytes", "write_bytes"]
+
+
+class TimingHistory:
+    """ the timing history of all the tests of a suite, kept in directory """
+
+    def __init__(self, directory):
+
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # the number of records of each test, once we have counted them
+        self._counts = {}
+
+    def _file(self, test, column):
+        return os.path.join(self.dir, f"{test}.{column}")
+
+    def tests(self):
+        """ the names of all the tests with a history """
+
+        return sorted(f[:-len(".dates")] for f in os.listdir(self.dir)
+                      if f.endswith(".dates"))
+
+    def _count(self, test):
+        """ the number of records of test """
+
+        if test not in self._counts:
+            ndates = 0
+            try:
+                with open(self._file(test, "dates"), "rb") as f:
+                    ndates = f.read().count(b"\n")
+            except OSError:
+                pass
+            self._counts[test] = ndates
+
+        return self._counts[test]
+
+    def append(self, test, date, **values):
+        """ add the measurements of a test in run date.  values holds the
+            COLUMNS entries -- anything missing is stored as NaN """
+
+        self.extend(test, [date], {c: [v] for c, v in values.items()})
+
+    def extend(self, test, dates, values):
+        """ add the measurements of a test in several runs at once, oldest
+            first.  values holds a list for each of the COLUMNS, in the
+            order of dates -- missing columns are stored as NaN """
+
+        if not dates:
+            return
+
+        ndates = self._count(test)
+        itemsize = array.array("d").itemsize
+
+        for column in COLUMNS:
+            fname = self._file(test, column)
+
+            # drop anything left behind by an append that was interrupted
+            # before its date was written
+            if os.path.isfile(fname) and os.path.getsize(fname) > ndates*itemsize:
+                os.truncate(fname, ndates*itemsize)
+
+            column_values = values.get(column)
+            if column_values is None:
+                column_values = [math.nan]*len(dates)
+
+            with open(fname, "ab") as f:
+                array.array("d", column_values).tofile(f)
+
+        # the dates are written last: they are what make the records count
+        with open(self._file(test, "dates"), "a") as f:
+            f.write("".join(f"{date}\n" for date in dates))
+
+        self._counts[test] = ndates + len(dates)
+
+    def load(self, tests=None, columns=None):
+        """ return the history of tests (default: all tests) as a
+            dictionary of dictionaries holding the list of dates and an
+            array of doubles for each of columns (default: all the
+            COLUMNS), most recent run first """
+
+        if tests is None:
+            tests = self.tests()
+
+        if columns is None:
+            columns = COLUMNS
+
+        timings = {}
+
+        for test in tests:
+
+            try:
+                with open(self._file(test, "dates")) as f:
+                    dates = f.read().splitlines()
+                dates.reverse()
+            except OSError:
+                continue
+
+            n = len(dates)
+            test_dict = {"dates": dates}
+
+            for column in columns:
+                values = array.array("d")
+                try:
+                    with open(self._file(test, column), "rb") as f:
+                        values.frombytes(f.read())
+                except OSError:
+                    pass
+
+                # columns that were added later are missing their oldest
+                # entries
+                if len(values) > n:
+                    values = values[:n]
+                elif len(values) < n:
+                    values = array.array("d", [math.nan]*(n - len(values))) + values
+
+                values.reverse()
+                test_dict[column] = values
+
+            timings[test] = test_dict
+
+        return timings
+
+    def import_timings(self, timings):
+        """ add a history in the format returned by load() (the format of
+            the legacy JSON file), which lists the most recent run first """
+
+        for test, test_dict in timings.items():
+            values = {c: test_dict[c][::-1] for c in COLUMNS if c in test_dict}
+            self.extend(test, test_dict["dates"][::-1], values)
+
+
+if __name__ == "__main__":
+
+    import params
+    import test_util
+
+    args = test_util.get_args(sys.argv[1:])
+    suite, _ = params.load_params(args)
+
+    store_dir = suite.get_timing_history_dir()
+    if os.path.isdir(store_dir):
+        suite.log.fail(f"ERROR: {store_dir} already exists")
+
+    # accessing the store the first time imports the legacy history
+    store = suite.timing_history
+    suite.log.log(f"{len(store.tests())} tests imported into {store.dir}")
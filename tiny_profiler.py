@@ -0,0 +1,79 @@
+"""This module reads the timers AMReX's TinyProfiler prints at the end of
+a run.  Its tables look like
+
+  ---------------------------------------------------------------------------
+  Name                          NCalls  Excl. Min  Excl. Avg  Excl. Max   Max %
+  ---------------------------------------------------------------------------
+  FabArray::ParallelCopy()          32     0.1021     0.1102     0.1187  25.61%
+  ...
+
+followed by the same for the inclusive times (Incl.)"""
+
+import os
+
+# the run output can be huge, but the profiler tables are at its end
+TAIL_BYTES = 4 * 1024**2
+
+# regions taking less than this fraction of the run are not checked for
+# slowdowns -- their timings are mostly noise
+MIN_FRACTION = 0.01
+
+
+def parse(lines):
+    """ return the regions of the last profile in lines, as a dictionary
+        of [ncalls, exclusive time, inclusive time] keyed by region name.
+        The times are the maximum over the processes """
+
+    regions = {}
+    kind = None
+
+    for line in lines:
+
+        fields = line.split()
+
+        if fields[:2] == ["Name", "NCalls"]:
+            kind = {"Excl.": 1, "Incl.": 2}.get(fields[2])
+
+            # a new profile starts with its exclusive times
+            if kind == 1:
+                regions = {}
+            continue
+
+        if kind is None or not fields or set(line.strip()) == {"-"}:
+            # a blank line ends the table
+            if not fields:
+                kind = None
+            continue
+
+        # the name may hold spaces -- the 5 numbers come last
+        if len(fields) < 6:
+            kind = None
+            continue
+
+        try:
+            ncalls = int(fields[-5])
+            tmax = float(fields[-2])
+        except ValueError:
+            kind = None
+            continue
+
+        name = " ".join(fields[:-5])
+        region = regions.setdefault(name, [ncalls, None, None])
+        region[kind] = tmax
+
+    return regions
+
+
+def parse_file(filename):
+    """ the regions of the last profile in the output file filename (see
+        parse), an empty dictionary if there is none """
+
+    try:
+        with open(filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - TAIL_BYTES))
+            lines = f.read().decode("utf-8", errors="replace").splitlines()
+    except OSError:
+        return {}
+
+    return parse(lines)